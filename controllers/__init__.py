@@ -1,6 +1,6 @@
 """toptica_wrapper - Thin wrapper for the Toptica DLCpro driver"""
 
-from driver_topticadlc import TopticaDLCPro
+from .driver_topticadlc import TopticaDLCPro
 
 __all__ = ["TopticaDLCPro"]
 __version__ = "0.2"
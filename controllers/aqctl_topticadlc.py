@@ -16,6 +16,22 @@ from toptica.lasersdk.client import (
     SubscriptionValue,
 )
 
+# Parameters published when none are given on the command line
+DEFAULT_SUBSCRIPTIONS = [
+    "emission-button-enabled",
+    "emission",
+    "laser1:label",
+    "laser1:enabled",
+    "laser1:dl:cc:current-set",
+    "laser1:amp:cc:current-set",
+    "laser1:dl:lock:lock-enabled",
+    "laser2:label",
+    "laser2:enabled",
+    "laser2:dl:cc:current-set",
+    "laser2:amp:cc:current-set",
+    "laser2:dl:lock:lock-enabled",
+]
+
 
 def get_argparser():
     parser = argparse.ArgumentParser(description="ARTIQ controller for Toptica DLCPro")
@@ -25,6 +41,35 @@ def get_argparser():
         default="192.168.0.4",
         help="IP address of the Toptica DLCPro",
     )
+    parser.add_argument(
+        "--simulation",
+        action="store_true",
+        help="talk to an in-process simulated DLC Pro instead of the device",
+    )
+    parser.add_argument(
+        "--simulation-latency",
+        default=0.0,
+        type=float,
+        help="delay in seconds of each simulated parameter access",
+    )
+    parser.add_argument(
+        "--subscriptions",
+        default=",".join(DEFAULT_SUBSCRIPTIONS),
+        help="comma-separated DeCoP names of the parameters to publish, "
+        "e.g. set from the 'subscriptions' field of the device_db entry",
+    )
+    parser.add_argument(
+        "--poll-min",
+        default=0.01,
+        type=float,
+        help="poll interval in seconds while parameters are changing",
+    )
+    parser.add_argument(
+        "--poll-max",
+        default=0.1,
+        type=float,
+        help="poll interval in seconds once parameters have settled",
+    )
 
     sca.simple_network_args(parser, 3272)
     sca.verbosity_args(parser)
@@ -50,6 +95,8 @@ def main():
     )
     dev = TopticaDLCPro(
         ip=args.ip_address,
+        simulation=args.simulation,
+        simulation_latency=args.simulation_latency,
         rpc=True,
     )
     dev.open()
@@ -59,41 +106,21 @@ def main():
     loop.run_until_complete(rpc.start(bind, args.port))
     atexit_register_coroutine(rpc.stop, loop=loop)
 
-    notifier = Notifier(
-        {
-            "emission-button-enabled": dev._dlcpro.emission_button_enabled.get(),
-            "emission": dev._dlcpro.emission.get(),
-            "laser1:label": dev._dlcpro.laser1.label.get(),
-            "laser1:enabled": dev._dlcpro.laser1.enabled.get(),
-            "laser1:dl:cc:current-set": dev._dlcpro.laser1.dl.cc.current_set.get(),
-            "laser1:amp:cc:current-set": dev._dlcpro.laser1.amp.cc.current_set.get(),
-            "laser1:dl:lock:lock-enabled": dev._dlcpro.laser1.dl.lock.lock_enabled.get(),
-            "laser2:label": dev._dlcpro.laser2.label.get(),
-            "laser2:enabled": dev._dlcpro.laser2.enabled.get(),
-            "laser2:dl:cc:current-set": dev._dlcpro.laser2.dl.cc.current_set.get(),
-            "laser2:amp:cc:current-set": dev._dlcpro.laser2.amp.cc.current_set.get(),
-            "laser2:dl:lock:lock-enabled": dev._dlcpro.laser2.dl.lock.lock_enabled.get(),
-        }
-    )
+    subscriptions = [path for path in args.subscriptions.split(",") if path]
+    parameters = {path: dev._get_parameter(path) for path in subscriptions}
+    notifier = Notifier({path: p.get() for path, p in parameters.items()})
+
+    # Values received since the last tick. Only the latest value of each
+    # parameter is published, so a parameter changing several times between
+    # ticks results in a single Notifier mod
+    pending = dict()
 
     def callback(subscription: Subscription, time: Timestamp, value: SubscriptionValue):
         logging.debug(f"Callback: {subscription.name} = {value.get()}")
-        notifier[subscription.name] = value.get()
-
-    dev._dlcpro.emission_button_enabled.subscribe(callback)
-    dev._dlcpro.emission.subscribe(callback)
+        pending[subscription.name] = value.get()
 
-    dev._dlcpro.laser1.label.subscribe(callback)
-    dev._dlcpro.laser1.enabled.subscribe(callback)
-    dev._dlcpro.laser1.dl.cc.current_set.subscribe(callback)
-    dev._dlcpro.laser1.amp.cc.current_set.subscribe(callback)
-    dev._dlcpro.laser1.dl.lock.lock_enabled.subscribe(callback)
-
-    dev._dlcpro.laser2.label.subscribe(callback)
-    dev._dlcpro.laser2.enabled.subscribe(callback)
-    dev._dlcpro.laser2.dl.cc.current_set.subscribe(callback)
-    dev._dlcpro.laser2.amp.cc.current_set.subscribe(callback)
-    dev._dlcpro.laser2.dl.lock.lock_enabled.subscribe(callback)
+    for parameter in parameters.values():
+        parameter.subscribe(callback)
 
     publisher = Publisher(notifiers={"DLCProState": notifier})
     loop.run_until_complete(publisher.start(bind, args.port - 1))
@@ -103,10 +130,26 @@ def main():
     # Subscribing to value changes requires to either regularly call .poll()
     # (which will process all currently queued up callbacks) or .run() (which
     # will continuously process callbacks and block until .stop() is called).
+    #
+    # The poll interval drops to --poll-min as soon as anything changes and
+    # backs off towards --poll-max while nothing does.
     async def run():
+        interval = args.poll_max
         while True:
             dev._dlcpro.poll()
-            await asyncio.sleep(0.1)
+
+            changed = False
+            for path, value in pending.items():
+                if notifier.raw_view.get(path) != value:
+                    notifier[path] = value
+                    changed = True
+            pending.clear()
+
+            if changed:
+                interval = args.poll_min
+            else:
+                interval = min(interval * 1.5, args.poll_max)
+            await asyncio.sleep(interval)
 
     run_task = loop.create_task(run())
     atexit.register(run_task.cancel)
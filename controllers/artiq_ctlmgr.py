@@ -3,12 +3,14 @@
 import asyncio
 import atexit
 import argparse
+import collections
 import logging
 import platform
 import subprocess
 import shlex
 import socket
 import os
+import time
 
 from sipyco import common_args
 from sipyco.asyncio_tools import (
@@ -19,13 +21,19 @@ from sipyco.asyncio_tools import (
 )
 from sipyco.pc_rpc import Server, AsyncioClient
 from sipyco.logging_tools import LogForwarder, SourceFilter, LogParser
-from sipyco.sync_struct import Subscriber
+from sipyco.sync_struct import Notifier, Publisher, Subscriber
 
 logger = logging.getLogger(__name__)
 
+# A controller is only restarted when one of these device_db fields changes
+RESTART_KEYS = ("command", "host", "port", "environment")
+
+# Upper bounds, in seconds, of the ping round-trip time histogram buckets
+PING_RTT_BUCKETS = (1e-3, 3e-3, 1e-2, 3e-2, 0.1, 0.3, 1.0, 3.0, 10.0)
+
 
 class Controller:
-    def __init__(self, name, ddb_entry):
+    def __init__(self, name, ddb_entry, workers):
         self.name = name
         self.command = ddb_entry["command"]
         self.retry_timer = ddb_entry.get("retry_timer", 5)
@@ -36,37 +44,145 @@ class Controller:
         self.ping_timer = ddb_entry.get("ping_timer", 30)
         self.ping_timeout = ddb_entry.get("ping_timeout", 30)
         self.term_timeout = ddb_entry.get("term_timeout", 30)
+        self.startup_timeout = ddb_entry.get("startup_timeout", 60)
+        self.startup_poll = ddb_entry.get("startup_poll", 0.5)
         self.env = ddb_entry.get("environment", {})
 
+        # Limits how many controllers are starting or stopping at once
+        self.workers = workers
+
+        # Set once the controller answers pings, cleared when it goes down
+        self.ready = asyncio.Event()
+
         self.retry_timer_cur = self.retry_timer
         self.retry_now = Condition()
         self.process = None
+
+        # RPC client shared by pings and management calls, connected on first
+        # use and dropped whenever the connection may have broken
+        self.remote = None
+        self.remote_lock = asyncio.Lock()
+
+        # (time, latency in seconds) of recent successful pings
+        self.ping_latencies = collections.deque(maxlen=100)
+
+        # Health metrics, see get_metrics()
+        self.up_since = None
+        self.restarts = 0
+        # Counts of pings no slower than each bucket, and of all pings
+        self.ping_rtt_counts = [0] * len(PING_RTT_BUCKETS)
+        self.ping_count = 0
+        self.ping_rtt_sum = 0.0
+        self.log_lines = 0
+        self.log_lines_last = 0
+        self.log_lines_time = time.monotonic()
+
         self.launch_task = asyncio.ensure_future(self.launcher())
 
     async def end(self):
         self.launch_task.cancel()
         await asyncio.wait_for(self.launch_task, None)
 
+    async def _get_remote(self):
+        if self.remote is None:
+            remote = AsyncioClient()
+            await remote.connect_rpc(self.host, self.port, None)
+            try:
+                targets, _ = remote.get_rpc_id()
+                await remote.select_rpc_target(targets[0])
+            except BaseException:
+                remote.close_rpc()
+                raise
+            self.remote = remote
+        return self.remote
+
+    def _close_remote(self):
+        if self.remote is not None:
+            self.remote.close_rpc()
+            self.remote = None
+
     async def call(self, method, *args, **kwargs):
-        remote = AsyncioClient()
-        await remote.connect_rpc(self.host, self.port, None)
-        try:
-            targets, _ = remote.get_rpc_id()
-            await remote.select_rpc_target(targets[0])
-            r = await getattr(remote, method)(*args, **kwargs)
-        finally:
-            remote.close_rpc()
-        return r
+        async with self.remote_lock:
+            remote = await self._get_remote()
+            try:
+                return await getattr(remote, method)(*args, **kwargs)
+            except BaseException:
+                # Including cancellation by a timeout: the reply may still be
+                # on its way, so the connection can't be reused
+                self._close_remote()
+                raise
 
     async def _ping(self):
         try:
+            t_start = time.monotonic()
             ok = await asyncio.wait_for(self.call("ping"), self.ping_timeout)
             if ok:
+                latency = time.monotonic() - t_start
+                self.ping_latencies.append((time.time(), latency))
+                self._record_ping_rtt(latency)
+                logger.debug(
+                    "Controller %s ping took %.1f ms", self.name, 1e3 * latency
+                )
                 self.retry_timer_cur = self.retry_timer
             return ok
         except Exception:
             return False
 
+    def _record_ping_rtt(self, latency):
+        for i, bound in enumerate(PING_RTT_BUCKETS):
+            if latency <= bound:
+                self.ping_rtt_counts[i] += 1
+        self.ping_count += 1
+        self.ping_rtt_sum += latency
+
+    def get_metrics(self):
+        """Return a dict of health metrics for publishing
+
+        The log line rate is averaged since the previous call.
+        """
+        now = time.monotonic()
+        log_line_rate = (self.log_lines - self.log_lines_last) / max(
+            now - self.log_lines_time, 1e-3
+        )
+        self.log_lines_last = self.log_lines
+        self.log_lines_time = now
+
+        return {
+            "up": self.ready.is_set(),
+            "uptime": time.time() - self.up_since if self.up_since else 0.0,
+            "restarts": self.restarts,
+            "last_ping_rtt": (
+                self.ping_latencies[-1][1] if self.ping_latencies else None
+            ),
+            "ping_rtt_buckets": list(PING_RTT_BUCKETS),
+            "ping_rtt_counts": list(self.ping_rtt_counts),
+            "ping_count": self.ping_count,
+            "ping_rtt_sum": self.ping_rtt_sum,
+            "backoff": self.retry_timer_cur,
+            "log_line_rate": log_line_rate,
+        }
+
+    async def _wait_until_ready(self):
+        # Ping the new process until it answers, exits or runs out of time
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.startup_timeout
+        while self.process.returncode is None:
+            if await self._ping():
+                logger.info("Controller %s is up", self.name)
+                return True
+            if loop.time() >= deadline:
+                logger.warning(
+                    "Controller %s did not answer within %.1f seconds of starting",
+                    self.name,
+                    self.startup_timeout,
+                )
+                return False
+            try:
+                await asyncio.wait_for(self.process.wait(), self.startup_poll)
+            except asyncio.TimeoutError:
+                pass
+        return False
+
     async def _wait_and_ping(self):
         while True:
             try:
@@ -86,11 +202,17 @@ class Controller:
                 break
 
     def _get_log_source(self):
+        # Called by the LogParsers once for every line the controller prints
+        self.log_lines += 1
         return "controller({})".format(self.name)
 
     async def launcher(self):
         try:
+            first = True
             while True:
+                if not first:
+                    self.restarts += 1
+                first = False
                 logger.info(
                     "Starting controller %s with command: %s",
                     self.name,
@@ -102,20 +224,34 @@ class Controller:
                     env = os.environ.copy()
                     env["PYTHONUNBUFFERED"] = "1"
                     env.update(self.env)
-                    self.process = await asyncio.create_subprocess_exec(
-                        *shlex.split(self.command),
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        env=env,
-                        start_new_session=True
-                    )
-                    asyncio.ensure_future(
-                        LogParser(self._get_log_source).stream_task(self.process.stdout)
-                    )
-                    asyncio.ensure_future(
-                        LogParser(self._get_log_source).stream_task(self.process.stderr)
-                    )
-                    await self._wait_and_ping()
+                    async with self.workers:
+                        self.process = await asyncio.create_subprocess_exec(
+                            *shlex.split(self.command),
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE,
+                            env=env,
+                            start_new_session=True
+                        )
+                        asyncio.ensure_future(
+                            LogParser(self._get_log_source).stream_task(
+                                self.process.stdout
+                            )
+                        )
+                        asyncio.ensure_future(
+                            LogParser(self._get_log_source).stream_task(
+                                self.process.stderr
+                            )
+                        )
+                        ready = await self._wait_until_ready()
+                    if ready:
+                        self.ready.set()
+                        self.up_since = time.time()
+                        await self._wait_and_ping()
+                    else:
+                        await self._terminate()
+                    self.ready.clear()
+                    self.up_since = None
+                    self._close_remote()
                 except FileNotFoundError:
                     logger.warning("Controller %s failed to start", self.name)
                 else:
@@ -127,9 +263,17 @@ class Controller:
                     pass
                 self.retry_timer_cur *= self.retry_timer_backoff
         except asyncio.CancelledError:
+            self.ready.clear()
+            self.up_since = None
             await self._terminate()
 
     async def _terminate(self):
+        try:
+            await self._terminate_process()
+        finally:
+            self._close_remote()
+
+    async def _terminate_process(self):
         if self.process is None or self.process.returncode is not None:
             logger.info("Controller %s already terminated", self.name)
             return
@@ -178,27 +322,105 @@ def get_ip_addresses(host):
 
 
 class Controllers:
-    def __init__(self):
+    """
+    The controllers managed on this host
+
+    Actions on different controllers run concurrently, with at most
+    `max_workers` controllers starting or stopping at any one time, while
+    actions on the same controller run in the order they were queued.
+
+    A device_db entry may list other controllers in `depends_on`. Its
+    controller is then only started once those managed on this host have
+    answered a ping, or after `depends_timeout` seconds (default 60).
+
+    Setting an entry which only differs from the current one in fields not
+    listed in `RESTART_KEYS` leaves its controller running.
+    """
+
+    def __init__(self, max_workers=4):
         self.host_filter = None
         self.active_or_queued = set()
+        # The device_db entry of each active or queued controller
+        self.entries = dict()
         self.queue = asyncio.Queue()
         self.active = dict()
+        self.workers = asyncio.Semaphore(max_workers)
+        # The latest queued action for each controller
+        self.actions = dict()
         self.process_task = asyncio.ensure_future(self._process())
 
     async def _process(self):
         while True:
             action, param = await self.queue.get()
             if action == "set":
-                k, ddb_entry = param
-                if k in self.active:
-                    await self.active[k].end()
-                self.active[k] = Controller(k, ddb_entry)
+                k = param[0]
             elif action == "del":
-                await self.active[param].end()
-                del self.active[param]
-            self.queue.task_done()
-            if action not in ("set", "del"):
+                k = param
+            else:
                 raise ValueError
+            task = asyncio.ensure_future(
+                self._run_action(action, param, self.actions.get(k))
+            )
+            self.actions[k] = task
+            task.add_done_callback(lambda task, k=k: self._action_done(k, task))
+            self.queue.task_done()
+
+    def _action_done(self, k, task):
+        if self.actions.get(k) is task:
+            del self.actions[k]
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(
+                "Failed to update controller %s", k, exc_info=task.exception()
+            )
+
+    async def _run_action(self, action, param, previous):
+        # Wait for the previous action on this controller, whatever its outcome
+        if previous is not None:
+            await asyncio.wait([previous])
+
+        if action == "set":
+            k, ddb_entry = param
+            if k in self.active:
+                await self._end(self.active.pop(k))
+            await self._wait_for_dependencies(k, ddb_entry)
+            self.active[k] = Controller(k, ddb_entry, self.workers)
+        elif action == "del":
+            if param in self.active:
+                await self._end(self.active.pop(param))
+
+    async def _end(self, controller):
+        async with self.workers:
+            await controller.end()
+
+    async def _wait_for_dependencies(self, k, ddb_entry):
+        depends_on = ddb_entry.get("depends_on", [])
+        timeout = ddb_entry.get("depends_timeout", 60)
+
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        for dependency in depends_on:
+            if dependency not in self.active_or_queued:
+                logger.warning(
+                    "Controller %s depends on %s, which is not managed here",
+                    k,
+                    dependency,
+                )
+                continue
+
+            # The dependency may not have been started yet, so poll for it
+            while not (
+                dependency in self.active and self.active[dependency].ready.is_set()
+            ):
+                if loop.time() >= deadline:
+                    logger.warning(
+                        "Controller %s is starting without %s, "
+                        "which is not up after %.1f seconds",
+                        k,
+                        dependency,
+                        timeout,
+                    )
+                    return
+                await asyncio.sleep(0.1)
 
     def __setitem__(self, k, v):
         try:
@@ -208,16 +430,29 @@ class Controllers:
                 and self.host_filter in get_ip_addresses(v["host"])
                 and "command" in v
             ):
+                v = dict(v)
                 v["command"] = v["command"].format(name=k, bind=self.host_filter, **v)
+                if k in self.active_or_queued and not self._needs_restart(k, v):
+                    logger.debug("Controller %s is unchanged", k)
+                    return
                 self.queue.put_nowait(("set", (k, v)))
                 self.active_or_queued.add(k)
+                self.entries[k] = v
+            elif k in self.active_or_queued:
+                # No longer a controller for this host
+                del self[k]
         except Exception:
             logger.error("Failed to process device database entry %s", k, exc_info=True)
 
+    def _needs_restart(self, k, v):
+        current = self.entries[k]
+        return any(current.get(key) != v.get(key) for key in RESTART_KEYS)
+
     def __delitem__(self, k):
         if k in self.active_or_queued:
             self.queue.put_nowait(("del", k))
             self.active_or_queued.remove(k)
+            del self.entries[k]
 
     def delete_all(self):
         for name in set(self.active_or_queued):
@@ -225,32 +460,38 @@ class Controllers:
 
     async def shutdown(self):
         self.process_task.cancel()
-        for c in self.active.values():
-            await c.end()
+        for task in list(self.actions.values()):
+            task.cancel()
+        await asyncio.gather(*(c.end() for c in self.active.values()))
 
 
 class ControllerDB:
-    def __init__(self):
-        self.current_controllers = Controllers()
+    def __init__(self, max_workers=4):
+        self.current_controllers = Controllers(max_workers)
 
     def set_host_filter(self, host_filter):
         self.current_controllers.host_filter = host_filter
 
     def sync_struct_init(self, init):
-        if self.current_controllers is not None:
-            self.current_controllers.delete_all()
+        # Called again on every reconnection to the master, so only stop the
+        # controllers which have gone and let the others be restarted if their
+        # entries have changed
+        for k in self.current_controllers.active_or_queued - init.keys():
+            del self.current_controllers[k]
         for k, v in init.items():
             self.current_controllers[k] = v
         return self.current_controllers
 
 
 class ControllerManager(TaskObject):
-    def __init__(self, server, port, retry_master, host_filter):
+    def __init__(self, server, port, retry_master, host_filter, max_workers=4):
         self.server = server
         self.port = port
         self.retry_master = retry_master
-        self.controller_db = ControllerDB()
+        self.controller_db = ControllerDB(max_workers)
         self.host_filter = host_filter
+        # Health metrics of each controller, keyed by name
+        self.metrics = Notifier(dict())
 
     async def _do(self):
         try:
@@ -294,6 +535,76 @@ class ControllerManager(TaskObject):
         now."""
         self.controller_db.current_controllers.active[k].retry_now.notify()
 
+    def get_ping_latencies(self, k):
+        """Return the (time, latency / s) of a controller's recent pings"""
+        return list(self.controller_db.current_controllers.active[k].ping_latencies)
+
+    def update_metrics(self):
+        """Publish the current health metrics of every active controller"""
+        active = self.controller_db.current_controllers.active
+        for k in set(self.metrics.raw_view) - set(active):
+            del self.metrics[k]
+        for k, controller in list(active.items()):
+            self.metrics[k] = controller.get_metrics()
+
+    async def publish_metrics(self, interval):
+        while True:
+            self.update_metrics()
+            await asyncio.sleep(interval)
+
+    def get_metrics_text(self):
+        """Return the latest health metrics in the Prometheus text format"""
+        lines = []
+        metrics = sorted(self.metrics.raw_view.items())
+
+        for name, kind, help in [
+            ("up", "gauge", "Whether the controller answers pings"),
+            ("uptime", "gauge", "Seconds since the controller came up"),
+            ("restarts", "counter", "Number of times the controller was restarted"),
+            ("last_ping_rtt", "gauge", "Round-trip time of the last ping in seconds"),
+            ("backoff", "gauge", "Current delay before a restart in seconds"),
+            ("log_line_rate", "gauge", "Lines logged by the controller per second"),
+            ("ping_rtt", "histogram", "Ping round-trip times in seconds"),
+        ]:
+            lines.append("# HELP artiq_controller_{} {}".format(name, help))
+            lines.append("# TYPE artiq_controller_{} {}".format(name, kind))
+            for k, m in metrics:
+                if kind == "histogram":
+                    buckets = list(zip(m["ping_rtt_buckets"], m["ping_rtt_counts"]))
+                    buckets.append(("+Inf", m["ping_count"]))
+                    samples = [
+                        ('_bucket{{controller="{}",le="{}"}}'.format(k, bound), n)
+                        for bound, n in buckets
+                    ]
+                    label = '{{controller="{}"}}'.format(k)
+                    samples.append(("_sum" + label, m["ping_rtt_sum"]))
+                    samples.append(("_count" + label, m["ping_count"]))
+                elif m[name] is not None:
+                    samples = [('{{controller="{}"}}'.format(k), float(m[name]))]
+                else:
+                    samples = []
+                for suffix, value in samples:
+                    lines.append("artiq_controller_{}{} {}".format(name, suffix, value))
+
+        return "\n".join(lines) + "\n"
+
+    async def _serve_metrics_http(self, reader, writer):
+        # Any request gets the metrics, which is all a Prometheus scraper needs
+        try:
+            await reader.readline()
+            body = self.get_metrics_text().encode()
+            writer.write(
+                b"HTTP/1.0 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                b"Content-Length: %d\r\n\r\n" % len(body) + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start_metrics_http(self, host, port):
+        return await asyncio.start_server(self._serve_metrics_http, host, port)
+
 
 def get_argparser():
     parser = argparse.ArgumentParser(description="ARTIQ controller manager")
@@ -330,7 +641,28 @@ def get_argparser():
         help="IP address of controllers to launch "
         "(local address of master connection by default)",
     )
-    common_args.simple_network_args(parser, [("control", "control", 3249)])
+    parser.add_argument(
+        "--max-workers",
+        default=4,
+        type=int,
+        help="maximum number of controllers starting or stopping at once",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        default=5.0,
+        type=float,
+        help="interval in seconds between updates of the published health metrics",
+    )
+    parser.add_argument(
+        "--port-metrics-http",
+        default=None,
+        type=int,
+        help="TCP port serving the health metrics as Prometheus text "
+        "(disabled by default)",
+    )
+    common_args.simple_network_args(
+        parser, [("control", "control", 3249), ("metrics", "metrics publisher", 3274)]
+    )
     return parser
 
 
@@ -364,13 +696,19 @@ def main():
     atexit_register_coroutine(logfwd.stop)
 
     ctlmgr = ControllerManager(
-        args.server, args.port_notify, args.retry_master, args.host_filter
+        args.server,
+        args.port_notify,
+        args.retry_master,
+        args.host_filter,
+        args.max_workers,
     )
     ctlmgr.start()
     atexit_register_coroutine(ctlmgr.stop)
 
     class CtlMgrRPC:
         retry_now = ctlmgr.retry_now
+        get_ping_latencies = ctlmgr.get_ping_latencies
+        get_metrics_text = ctlmgr.get_metrics_text
 
     rpc_target = CtlMgrRPC()
     rpc_server = Server({"ctlmgr": rpc_target}, builtin_terminate=True)
@@ -379,6 +717,22 @@ def main():
     )
     atexit_register_coroutine(rpc_server.stop)
 
+    # Health metrics of the controllers, for applets and monitoring
+    metrics_task = loop.create_task(ctlmgr.publish_metrics(args.metrics_interval))
+    atexit.register(metrics_task.cancel)
+    publisher = Publisher({"ControllerMetrics": ctlmgr.metrics})
+    loop.run_until_complete(
+        publisher.start(common_args.bind_address_from_args(args), args.port_metrics)
+    )
+    atexit_register_coroutine(publisher.stop)
+    if args.port_metrics_http is not None:
+        http_server = loop.run_until_complete(
+            ctlmgr.start_metrics_http(
+                common_args.bind_address_from_args(args), args.port_metrics_http
+            )
+        )
+        atexit.register(http_server.close)
+
     print("ARTIQ controller manager is now running.")
     _, pending = loop.run_until_complete(
         asyncio.wait(
@@ -1,7 +1,9 @@
 from toptica.lasersdk.dlcpro.v3_2_0 import DLCpro
 from toptica.lasersdk.dlcpro.v3_2_0 import Laser, DigifalcBoard
 from toptica.lasersdk.dlcpro.v3_2_0 import NetworkConnection
+import inspect
 import logging
+from typing import Any, Dict, List
 
 logger = logging.getLogger(__name__)
 
@@ -27,11 +29,28 @@ class TopticaDLCPro:
         ...
 
         driver.close()
+
+    When constructed with ``rpc=True``, every parameter of the DLC Pro can also
+    be called directly by a flattened name, e.g. ``laser1_dl_cc_current_set()``
+    and ``laser1_dl_cc_current_set_set(x)``. These names are resolved on first
+    use, so they don't appear in sipyco's ``get_rpc_method_list`` - call
+    :meth:`list_parameters` to get them instead.
     """
 
-    def __init__(self, *args, ip, laser=None, falc=None, simulation=False, rpc=False):
-        if simulation:
-            raise ValueError("Simulation mode is not supported for the Toptica SDK")
+    def __init__(
+        self,
+        *args,
+        ip,
+        laser=None,
+        falc=None,
+        simulation=False,
+        simulation_latency=0.0,
+        rpc=False,
+    ):
+        # In simulation, talk to an in-process SimulatedDLCpro instead, with
+        # `simulation_latency` seconds per parameter access
+        self.simulation = simulation
+        self.simulation_latency = simulation_latency
 
         if laser:
             assert laser in ["laser1", "laser2"], ValueError(
@@ -46,44 +65,103 @@ class TopticaDLCPro:
         self.ip = ip
         self._dlcpro = None
 
+        # Only resolve flattened parameter names when serving RPCs, see
+        # __getattr__
+        self._rpc = rpc
+
         if rpc:
             self.open()
-            self.bring_methods_into_namespace()
-
-    def bring_methods_into_namespace(self):
-        # to work in RPCs we need all member variables to be accessible directly
-        # on this class as methods so we hunt down the chain to find them.
 
-        """find all callables on the object
-        - if its not a property add it to our class
-        - if it is a property, check the type hint and if its a *Decop* type
-            add the .get and if available .set
-        - otherwise recurse
+    def __getattr__(self, name):
+        # To work in RPCs we need every parameter of the DLC Pro to be callable
+        # directly on this class, e.g. `laser1_dl_cc_current_set()` returns
+        # the value of laser1.dl.cc.current_set and
+        # `laser1_dl_cc_current_set_set(x)` sets it. Bound methods of the SDK
+        # objects, e.g. `laser1_dl_lock_close`, are passed through as they are.
+        #
+        # Names are only resolved on first use, and cached as attributes of
+        # this object so that later calls don't come back here.
+        if name.startswith("_") or not self._rpc:
+            raise AttributeError(name)
+
+        try:
+            resolved = self._resolve(self.get_dlcpro(), name.split("_"))
+        except AttributeError:
+            raise AttributeError(
+                f"{type(self).__name__} has no DLC Pro parameter or method {name}"
+            ) from None
+
+        setattr(self, name, resolved)
+        return resolved
+
+    @staticmethod
+    def _resolve(obj, parts):
+        """Find the getter, setter or method named by `parts` below `obj`
+
+        Parameter names contain underscores too, so every way of splitting the
+        parts is tried, longest name first.
         """
-
-        def hunt_down(obj, path):
-
-            for name in dir(obj):
-                # skip private and special methods
-                if name.startswith("_"):
-                    continue
-
-                attr = getattr(obj, name)
-
-                # if its a Decop add its get/set and stop
-                if "Mutable" in str(attr):
-                    setattr(self, f"{path}{name}_set", getattr(obj, name).set)
-                if "Decop" in str(attr):
-                    setattr(self, f"{path}{name}", getattr(obj, name).get)
-                    continue
-
-                if "bound method" in str(attr):
-                    setattr(self, f"{path}{name}", getattr(obj, name))
-                    continue
-
-                hunt_down(attr, f"{path}{name}_")
-
-        hunt_down(self._dlcpro, "")
+        type_name = type(obj).__name__
+        if "Decop" in type_name:
+            if not parts:
+                return obj.get
+            if parts == ["set"] and "Mutable" in type_name:
+                return obj.set
+            raise AttributeError
+        if not parts:
+            if inspect.ismethod(obj):
+                return obj
+            raise AttributeError
+
+        for i in range(len(parts), 0, -1):
+            name = "_".join(parts[:i])
+            if name.startswith("_") or not hasattr(obj, name):
+                continue
+            try:
+                return TopticaDLCPro._resolve(getattr(obj, name), parts[i:])
+            except AttributeError:
+                continue
+
+        raise AttributeError
+
+    def list_parameters(self) -> List[str]:
+        """List the flattened names that can be called over RPC
+
+        These are the getters, setters (with a ``_set`` suffix) and methods of
+        the DLC Pro that are resolved on first use by ``__getattr__``.
+        """
+        names = []
+        root = self.get_dlcpro()
+        self._collect_names(root, "", type(root).__module__, names, set())
+        return sorted(names)
+
+    @staticmethod
+    def _collect_names(obj, prefix, module, names, seen):
+        # Walk the parameter tree as _resolve does, only descending into
+        # objects defined by the same module as the DLC Pro itself
+        type_name = type(obj).__name__
+        if "Decop" in type_name:
+            names.append(prefix)
+            if "Mutable" in type_name:
+                names.append(prefix + "_set")
+            return
+        if inspect.ismethod(obj):
+            names.append(prefix)
+            return
+        if type(obj).__module__ != module or id(obj) in seen:
+            return
+        seen.add(id(obj))
+
+        for name in dir(obj):
+            if name.startswith("_"):
+                continue
+            try:
+                child = getattr(obj, name)
+            except Exception:
+                continue
+            TopticaDLCPro._collect_names(
+                child, f"{prefix}_{name}" if prefix else name, module, names, seen
+            )
 
     def open(self):
         logger.debug("Opening connection to %s", self.ip)
@@ -99,7 +177,16 @@ class TopticaDLCPro:
         Users should prefer to use the get_laser() function, so the details of
         which laser you're accessing can be stored in device_db"""
 
-        if self._dlcpro is None:
+        if self._dlcpro is None and self.simulation:
+            try:
+                from .sim_topticadlc import SimulatedDLCpro
+            except ImportError:
+                # Loaded as a script from this directory, e.g. by the controller
+                from sim_topticadlc import SimulatedDLCpro
+
+            logger.debug("Making simulated DLCPro for %s, %s", self.ip, self.laser)
+            self._dlcpro = SimulatedDLCpro(latency=self.simulation_latency)
+        elif self._dlcpro is None:
             logger.debug("Making DLCPro driver for %s, %s", self.ip, self.laser)
             self._dlcpro = DLCpro(NetworkConnection(self.ip))
 
@@ -146,6 +233,45 @@ class TopticaDLCPro:
         self.get_dlcpro().system_label.get()
         return True
 
+    def _get_parameter(self, path: str):
+        """Find the SDK object of a parameter from its DeCoP name
+
+        e.g. "laser1:dl:cc:current-set" gives laser1.dl.cc.current_set
+        """
+        obj = self.get_dlcpro()
+        for name in path.split(":"):
+            name = name.replace("-", "_")
+            if not name or name.startswith("_"):
+                raise ValueError(f"Invalid parameter name {path}")
+            try:
+                obj = getattr(obj, name)
+            except AttributeError:
+                raise ValueError(f"No such parameter {path}") from None
+        return obj
+
+    def get_many(self, paths: List[str]) -> Dict[str, Any]:
+        """Read several parameters in one call
+
+        Takes DeCoP names as published by the controller, e.g.
+        ``["laser1:dl:cc:current-set", "laser1:dl:cc:current-act"]``, and
+        returns a dict of their values so that clients need a single RPC.
+        """
+        parameters = [(path, self._get_parameter(path)) for path in paths]
+        return {path: parameter.get() for path, parameter in parameters}
+
+    def set_many(self, values: Dict[str, Any]) -> None:
+        """Set several parameters in one call
+
+        Takes a dict of values keyed by DeCoP name. All the names are checked
+        before any parameter is set.
+        """
+        parameters = [(path, self._get_parameter(path)) for path in values]
+        for path, parameter in parameters:
+            if not hasattr(parameter, "set"):
+                raise ValueError(f"Parameter {path} is read-only")
+        for path, parameter in parameters:
+            parameter.set(values[path])
+
     # Pass on __enter__ and __exit__ so that users can use `with TopticaDLCPro`
     # to start a network connection
     def __enter__(self, *args, **kwargs):
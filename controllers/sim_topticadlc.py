@@ -0,0 +1,227 @@
+"""
+In-process stand-in for a Toptica DLC Pro
+
+:class:`SimulatedDLCpro` implements the part of the SDK's ``DLCpro`` parameter
+tree that this repository uses, so that the driver, the controller and the
+experiments which talk to them can run without the real box. It is used by
+:class:`~driver_topticadlc.TopticaDLCPro` when constructed with
+``simulation=True``, e.g. ``python controllers/aqctl_topticadlc.py
+--simulation``.
+
+Parameters behave like the SDK's: they have ``get()``, mutable ones also have
+``set()``, and ``subscribe(callback)`` registers a callback which is called
+from :meth:`SimulatedDLCpro.poll` for every change. Every access takes
+`latency` seconds, to mimic the network round-trip when benchmarking.
+"""
+
+import logging
+import time
+from datetime import datetime
+from typing import Any, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SimSubscription:
+    """Handle returned by :meth:`SimDecop.subscribe`"""
+
+    def __init__(self, parameter: "SimDecop", callback: Callable):
+        self.parameter = parameter
+        self.callback = callback
+
+    @property
+    def name(self) -> str:
+        return self.parameter.name
+
+    def cancel(self) -> None:
+        self.parameter._callbacks.remove(self.callback)
+
+
+class SimSubscriptionValue:
+    """Value passed to subscription callbacks, as in the SDK"""
+
+    def __init__(self, value: Any):
+        self._value = value
+
+    def get(self) -> Any:
+        return self._value
+
+
+class SimDecop:
+    """A read-only parameter"""
+
+    def __init__(self, dlcpro: "SimulatedDLCpro", name: str, value: Any):
+        self._dlcpro = dlcpro
+        self._name = name
+        self._value = value
+        self._callbacks: List[Callable] = []
+        dlcpro._parameters[name] = self
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def get(self) -> Any:
+        self._dlcpro._access()
+        return self._value
+
+    def subscribe(self, callback: Callable) -> SimSubscription:
+        self._callbacks.append(callback)
+        return SimSubscription(self, callback)
+
+    def _update(self, value: Any) -> None:
+        if value == self._value:
+            return
+        self._value = value
+        for callback in self._callbacks:
+            self._dlcpro._queue.append((callback, self, value))
+
+
+class MutableSimDecop(SimDecop):
+    """A parameter which can be set
+
+    `on_set` is called with the new value after every set, e.g. to update the
+    matching read-back parameter.
+    """
+
+    def __init__(
+        self,
+        dlcpro: "SimulatedDLCpro",
+        name: str,
+        value: Any,
+        on_set: Optional[Callable[[Any], None]] = None,
+    ):
+        super().__init__(dlcpro, name, value)
+        self._on_set = on_set
+
+    def set(self, value: Any) -> None:
+        self._dlcpro._access()
+        logger.debug("Setting %s to %s", self._name, value)
+        self._update(value)
+        if self._on_set is not None:
+            self._on_set(value)
+
+
+class SimCurrentControl:
+    def __init__(self, dlcpro, prefix, current):
+        self.current_act = SimDecop(dlcpro, prefix + ":current-act", 0.0)
+        self.current_set = MutableSimDecop(
+            dlcpro, prefix + ":current-set", current, self._update_current_act
+        )
+        self.enabled = MutableSimDecop(
+            dlcpro, prefix + ":enabled", False, self._update_current_act
+        )
+
+    def _update_current_act(self, _):
+        # The actual current only follows the setpoint while enabled
+        self.current_act._update(
+            self.current_set._value if self.enabled._value else 0.0
+        )
+
+
+class SimPiezoControl:
+    def __init__(self, dlcpro, prefix, voltage):
+        self.voltage_act = SimDecop(dlcpro, prefix + ":voltage-act", voltage)
+        self.voltage_set = MutableSimDecop(
+            dlcpro, prefix + ":voltage-set", voltage, self.voltage_act._update
+        )
+
+
+class SimTemperatureControl:
+    def __init__(self, dlcpro, prefix, temperature):
+        self.temp_act = SimDecop(dlcpro, prefix + ":temp-act", temperature)
+        self.temp_set = MutableSimDecop(
+            dlcpro, prefix + ":temp-set", temperature, self.temp_act._update
+        )
+
+
+class SimLock:
+    def __init__(self, dlcpro, prefix):
+        self._dlcpro = dlcpro
+        self.lock_enabled = MutableSimDecop(dlcpro, prefix + ":lock-enabled", False)
+
+    def close(self) -> None:
+        self._dlcpro._access()
+        self.lock_enabled._update(True)
+
+    def open(self) -> None:
+        self._dlcpro._access()
+        self.lock_enabled._update(False)
+
+
+class SimLaserHead:
+    def __init__(self, dlcpro, prefix):
+        self.cc = SimCurrentControl(dlcpro, prefix + ":cc", 100.0)
+        self.pc = SimPiezoControl(dlcpro, prefix + ":pc", 70.0)
+        self.tc = SimTemperatureControl(dlcpro, prefix + ":tc", 20.0)
+        self.lock = SimLock(dlcpro, prefix + ":lock")
+
+
+class SimAmplifier:
+    def __init__(self, dlcpro, prefix):
+        self.cc = SimCurrentControl(dlcpro, prefix + ":cc", 1000.0)
+
+
+class SimLaser:
+    def __init__(self, dlcpro, prefix, label):
+        self.label = MutableSimDecop(dlcpro, prefix + ":label", label)
+        self.enabled = MutableSimDecop(dlcpro, prefix + ":enabled", True)
+        self.dl = SimLaserHead(dlcpro, prefix + ":dl")
+        self.amp = SimAmplifier(dlcpro, prefix + ":amp")
+
+
+class SimulatedDLCpro:
+    """
+    Simulated DLC Pro with two lasers, each with a laser head and an amplifier
+
+    Use :meth:`inject` to change any parameter, including read-only ones, as
+    the device would, e.g. to simulate a laser falling out of lock.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+        self._parameters = dict()
+        # Callbacks waiting for poll()
+        self._queue = []
+        self._is_open = False
+
+        self.system_label = SimDecop(self, "system-label", "Simulated DLC pro")
+        self.emission = SimDecop(self, "emission", False)
+        self.emission_button_enabled = SimDecop(self, "emission-button-enabled", False)
+        self.laser1 = SimLaser(self, "laser1", "852nm")
+        self.laser2 = SimLaser(self, "laser2", "780nm")
+
+    def open(self) -> None:
+        self._is_open = True
+
+    def close(self) -> None:
+        self._is_open = False
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _access(self) -> None:
+        if not self._is_open:
+            raise RuntimeError("Connection to the simulated DLC Pro is not open")
+        if self.latency:
+            time.sleep(self.latency)
+
+    def poll(self) -> None:
+        """Call the subscription callbacks for all changes since the last poll"""
+        queue, self._queue = self._queue, []
+        timestamp = datetime.now()
+        for callback, parameter, value in queue:
+            callback(
+                SimSubscription(parameter, callback),
+                timestamp,
+                SimSubscriptionValue(value),
+            )
+
+    def inject(self, name: str, value: Any) -> None:
+        """Change a parameter, given by its DeCoP name, as the device would"""
+        self._parameters[name]._update(value)
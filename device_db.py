@@ -314,7 +314,24 @@ device_db.update(
             "host": server_addr,
             "port": 3272,
             "ip": "192.168.0.4",
-            "command": "python controllers/aqctl_topticadlc.py -ip {ip} -p {port} --bind {bind}",
+            # DeCoP names of the parameters published in DLCProState
+            "subscriptions": ",".join(
+                [
+                    "emission-button-enabled",
+                    "emission",
+                    "laser1:label",
+                    "laser1:enabled",
+                    "laser1:dl:cc:current-set",
+                    "laser1:amp:cc:current-set",
+                    "laser1:dl:lock:lock-enabled",
+                    "laser2:label",
+                    "laser2:enabled",
+                    "laser2:dl:cc:current-set",
+                    "laser2:amp:cc:current-set",
+                    "laser2:dl:lock:lock-enabled",
+                ]
+            ),
+            "command": "python controllers/aqctl_topticadlc.py -ip {ip} -p {port} --bind {bind} --subscriptions {subscriptions}",
         },
     }
 )
@@ -3,12 +3,15 @@ from typing import List
 
 import numpy as np
 from artiq.coredevice.core import Core
+from artiq.coredevice.dma import CoreDMA
 from artiq.coredevice.suservo import Channel as SUServoChannel
 from artiq.coredevice.ttl import TTLOut
-from artiq.experiment import at_mu, delay, delay_mu, kernel, now_mu, portable
+from artiq.experiment import delay, delay_mu, kernel, now_mu, portable
 from ndscan.experiment import Fragment
 
 from repository.utils.get_local_devices import get_local_devices
+from repository.utils.kernel_trace import KernelTrace, get_kernel_trace
+from repository.utils.shutter_planner import ShutterPlanner, get_shutter_planner
 from repository.models import SUServoedBeam
 
 
@@ -36,6 +39,22 @@ class ControlBeamsWithoutCoolingAOM(Fragment):
     consumed, avoiding collisions. If this is unacceptable for your application,
     you will need to manage the lane usage manually.
 
+    The on/off sequences only depend on the beams passed at build time, so
+    with ``use_dma=True`` they are recorded to DMA during the first
+    ``device_setup`` (one sequence for each combination of `ignore_shutters`
+    and `already_on`) and played back from then on. This costs a single
+    playback per call instead of a few kernel-side RTIO writes per beam, but
+    means that these methods can't be called while recording your own DMA
+    sequence, so it is off by default. As with
+    :class:`~repository.fragments.ramping_phase.GeneralRampingPhase`, looking
+    up a sequence by name is slow, so call :meth:`precalculate_dma_handles`
+    before time-critical code once no more DMA sequences will be recorded.
+
+    If several instances act close together, their shutter writes into the past
+    interleave. Pass ``plan_shutters=True`` to hand the shutter moves to the
+    experiment's :class:`~repository.utils.shutter_planner.ShutterPlanner`
+    instead, and call its ``emit()`` method once the moves have been requested.
+
     Example usage
     -------------
 
@@ -90,10 +109,15 @@ class ControlBeamsWithoutCoolingAOM(Fragment):
         MyBeamTurnerOnnerer = make_fragment_scan_exp(MyBeamTurnerOnnererFrag)
     """
 
-    def build_fragment(self, beam_infos: List[SUServoedBeam]):
+    def build_fragment(
+        self, beam_infos: List[SUServoedBeam], use_dma=False, plan_shutters=False
+    ):
         self.setattr_device("core")
         self.core: Core
 
+        self.setattr_device("core_dma")
+        self.core_dma: CoreDMA
+
         # Kernel variables
         self.debug_enabled = logger.isEnabledFor(logging.INFO)
 
@@ -139,13 +163,102 @@ class ControlBeamsWithoutCoolingAOM(Fragment):
                         beam_info.shutter_device,
                     )
 
+        beam_names = [info.name for info in self.beam_infos[1:]]
         self.longest_beam_delay = max([info.shutter_delay for info in self.beam_infos])
 
+        # DMA sequences for turn_beams_on, indexed by 2*already_on +
+        # ignore_shutters, followed by those for turn_beams_off, indexed by
+        # ignore_shutters
+        self.use_dma = use_dma
+        self.dma_names = [
+            f"{self.fqn}.on",
+            f"{self.fqn}.on_ignore_shutters",
+            f"{self.fqn}.on_already_on",
+            f"{self.fqn}.on_already_on_ignore_shutters",
+            f"{self.fqn}.off",
+            f"{self.fqn}.off_ignore_shutters",
+        ]
+        self.dma_recorded = False
+        # Handles from an epoch of -1 are never valid, so each is looked up on
+        # first use if it hasn't been precalculated
+        self.dma_handles = [(np.int32(-1), np.int64(0), np.int32(0), False)] * len(
+            self.dma_names
+        )
+
+        # The id of each shutter in the shared planner, if it's in use. The
+        # planner is referenced (and so compiled) either way, so it's seeded
+        # with the dummy beam's shutter in case nothing registers with it
+        self.plan_shutters = plan_shutters
+        self.shutter_planner: ShutterPlanner = get_shutter_planner(
+            self.core, self.beam_shutters[0]
+        )
+        if plan_shutters:
+            self.planner_shutter_ids = [
+                self.shutter_planner.register(shutter) for shutter in self.beam_shutters
+            ]
+        else:
+            self.planner_shutter_ids = [0] * len(self.beam_shutters)
+
+        # Debug events, one of each per beam
+        self.trace: KernelTrace = get_kernel_trace(self.core)
+        self.trace_open_shutter = []
+        self.trace_close_shutter = []
+        self.trace_beam_on = []
+        self.trace_beam_off = []
+        for beam_info in self.beam_infos:
+            self.trace_open_shutter.append(
+                self.trace.register(
+                    logger,
+                    f"Opening Shutter [{beam_info.shutter_device}] "
+                    f"for beam [{beam_info.name}]",
+                )
+            )
+            self.trace_close_shutter.append(
+                self.trace.register(
+                    logger,
+                    f"Closing Shutter [{beam_info.shutter_device}] "
+                    f"for beam [{beam_info.name}]",
+                )
+            )
+            self.trace_beam_on.append(
+                self.trace.register(
+                    logger,
+                    f"AOM+shuttering ON: suservo = {beam_info.suservo_device}, "
+                    f"delay_by = {beam_info.shutter_delay}, "
+                    f"servo_enabled = {beam_info.servo_enabled}, "
+                    f"info = {beam_info}",
+                )
+            )
+            self.trace_beam_off.append(
+                self.trace.register(
+                    logger,
+                    f"AOM+shuttering OFF: suservo = {beam_info.suservo_device}, "
+                    f"delay_by = {beam_info.shutter_delay}, "
+                    f"servo_enabled = {beam_info.servo_enabled}, "
+                    f"info = {beam_info}",
+                )
+            )
+
+        self.trace_playback = self.trace.register(
+            logger, "Playing back DMA sequence %d for beams " + str(beam_names)
+        )
+
         # Kernel invariants
         kernel_invariants = getattr(self, "kernel_invariants", set())
         self.kernel_invariants = kernel_invariants | {
             "debug_enabled",
             "longest_beam_delay",
+            "use_dma",
+            "dma_names",
+            "plan_shutters",
+            "shutter_planner",
+            "planner_shutter_ids",
+            "trace",
+            "trace_open_shutter",
+            "trace_close_shutter",
+            "trace_beam_on",
+            "trace_beam_off",
+            "trace_playback",
         }
 
     def host_setup(self):
@@ -154,8 +267,83 @@ class ControlBeamsWithoutCoolingAOM(Fragment):
         self.t_rtio_cycle_mu = np.int64(self.core.ref_multiplier)
         self.kernel_invariants.add("t_rtio_cycle_mu")
 
+        # Sequences are recorded this far after their start so that the events
+        # written into the past by turn_beams_on have positive timestamps
+        self.dma_offset_mu = self.core.seconds_to_mu(self.longest_beam_delay)
+        self.kernel_invariants.add("dma_offset_mu")
+
+        self.shutter_delays_mu = [
+            self.core.seconds_to_mu(info.shutter_delay) for info in self.beam_infos
+        ]
+        self.kernel_invariants.add("shutter_delays_mu")
+
         return super().host_setup()
 
+    @kernel
+    def device_setup(self):
+        self.device_setup_subfragments()
+
+        if self.use_dma and not self.dma_recorded:
+            self._record_dma_sequences()
+            self.core.break_realtime()
+
+        # Ship the events recorded so far, before any time-critical code runs
+        if self.debug_enabled:
+            self.trace.flush()
+
+    def host_cleanup(self):
+        # Log anything still in the trace when the kernel returned
+        self.trace.flush()
+
+        super().host_cleanup()
+
+    @kernel
+    def _record_dma_sequences(self):
+        for i in range(len(self.dma_names)):
+            with self.core_dma.record(self.dma_names[i]):
+                delay_mu(self.dma_offset_mu)
+                if i < 4:
+                    self._write_beams_on(
+                        ignore_shutters=i % 2 == 1, already_on=i >= 2
+                    )
+                else:
+                    self._write_beams_off(ignore_shutters=i % 2 == 1)
+
+        self.dma_recorded = True
+
+    @kernel
+    def precalculate_dma_handles(self):
+        """
+        Call this method to precalculate the handles of the on/off DMA
+        sequences, making :meth:`turn_beams_on` and :meth:`turn_beams_off` a lot
+        faster.
+
+        Recording any other DMA sequence after this method is called
+        invalidates the handles, and each will be looked up again (slowly) the
+        next time it is played. That's why this step is not done automatically
+        as part of device_setup.
+        """
+        if not self.use_dma:
+            return
+
+        for i in range(len(self.dma_names)):
+            self.dma_handles[i] = self.core_dma.get_handle(self.dma_names[i])
+
+    @kernel
+    def _play_dma_sequence(self, index):
+        # Shift back so that the events recorded at dma_offset_mu land at the
+        # cursor. Playback advances the cursor by the recorded duration, so this
+        # leaves it exactly where writing the events directly would have done
+        if self.debug_enabled:
+            self.trace.record(self.trace_playback, index)
+
+        # Recording any DMA sequence invalidates the handle
+        if self.dma_handles[index][0] != self.core_dma.epoch:
+            self.dma_handles[index] = self.core_dma.get_handle(self.dma_names[index])
+
+        delay_mu(-self.dma_offset_mu)
+        self.core_dma.playback_handle(self.dma_handles[index])
+
     @kernel
     def turn_beams_on(self, ignore_shutters=False, already_on=False):
         """
@@ -174,7 +362,41 @@ class ControlBeamsWithoutCoolingAOM(Fragment):
         * t = 0: AOMs turned on
         * t > 0: No events are written in the future.
         """
+        if self.plan_shutters and not ignore_shutters:
+            self._plan_shutter_moves(state=True, in_advance=True)
+
+        if self.debug_enabled:
+            self._trace_beams(state=True, ignore_shutters=ignore_shutters)
 
+        if not self.use_dma:
+            self._write_beams_on(ignore_shutters, already_on)
+            return
+
+        index = 0
+        if ignore_shutters:
+            index += 1
+        if already_on:
+            index += 2
+        self._play_dma_sequence(index)
+
+    @kernel
+    def _trace_beams(self, state, ignore_shutters):
+        # The write methods may be running inside a DMA recording, so the
+        # events are recorded here instead, each time the beams are switched
+        for i in range(1, len(self.beam_infos)):
+            if not ignore_shutters and self.shutter_indexes[i] >= 0:
+                if state:
+                    self.trace.record(self.trace_open_shutter[i])
+                else:
+                    self.trace.record(self.trace_close_shutter[i])
+
+            if state:
+                self.trace.record(self.trace_beam_on[i])
+            else:
+                self.trace.record(self.trace_beam_off[i])
+
+    @kernel
+    def _write_beams_on(self, ignore_shutters, already_on):
         if not ignore_shutters:
             for i in range(len(self.beam_infos) - 1, 0, -1):
                 beam_info = self.beam_infos[i]
@@ -184,15 +406,6 @@ class ControlBeamsWithoutCoolingAOM(Fragment):
                 suservo = self.beam_suservos[i]
                 shutter = self.beam_shutters[self.shutter_indexes[i]]
 
-                if self.debug_enabled:
-                    slack_mu = now_mu() - self.core.get_rtio_counter_mu()
-                    logger.info(
-                        "Opening Shutter [%s] for beam [%s]",
-                        shutter.channel,
-                        beam_info.name,
-                    )
-                    at_mu(self.core.get_rtio_counter_mu() + slack_mu)
-
                 delay(-beam_info.shutter_delay)
                 if not already_on:
                     suservo.set(
@@ -201,7 +414,8 @@ class ControlBeamsWithoutCoolingAOM(Fragment):
                         profile=suservo.channel,
                     )
                 delay_mu(self.t_rtio_cycle_mu)
-                shutter.on()
+                if not self.plan_shutters:
+                    shutter.on()
                 delay_mu(self.t_rtio_cycle_mu)
 
                 delay(beam_info.shutter_delay)
@@ -210,23 +424,6 @@ class ControlBeamsWithoutCoolingAOM(Fragment):
             suservo = self.beam_suservos[i]
             beam_info = self.beam_infos[i]
 
-            if self.debug_enabled:
-                slack_mu = now_mu() - self.core.get_rtio_counter_mu()
-                logger.info(
-                    (
-                        "AOM+shuttering ON: "
-                        "suservo = 0x%x, "
-                        "delay_by = %s, "
-                        "servo_enabled = %s, "
-                        "info = %s"
-                    ),
-                    suservo.channel,
-                    beam_info.shutter_delay,
-                    beam_info.servo_enabled,
-                    beam_info,
-                )
-                at_mu(self.core.get_rtio_counter_mu() + slack_mu)
-
             suservo.set(
                 en_out=1,
                 en_iir=1 if beam_info.servo_enabled else 0,
@@ -250,28 +447,28 @@ class ControlBeamsWithoutCoolingAOM(Fragment):
         * t = 0: AOM off and Shutter closed
         * 0 < t < longest_beam_delay: AOMs turned back on to stay warm
         """
+        if self.plan_shutters and not ignore_shutters:
+            self._plan_shutter_moves(state=False, in_advance=False)
+
+        if self.debug_enabled:
+            self._trace_beams(state=False, ignore_shutters=ignore_shutters)
+
+        if not self.use_dma:
+            self._write_beams_off(ignore_shutters)
+            return
+
+        if ignore_shutters:
+            self._play_dma_sequence(5)
+        else:
+            self._play_dma_sequence(4)
+
+    @kernel
+    def _write_beams_off(self, ignore_shutters):
 
         for i in range(1, len(self.beam_infos)):
             suservo = self.beam_suservos[i]
             beam_info = self.beam_infos[i]
 
-            if self.debug_enabled:
-                slack_mu = now_mu() - self.core.get_rtio_counter_mu()
-                logger.info(
-                    (
-                        "AOM+shuttering OFF: "
-                        "suservo = 0x%x, "
-                        "delay_by = %s, "
-                        "servo_enabled = %s, "
-                        "info = %s"
-                    ),
-                    suservo.channel,
-                    beam_info.shutter_delay,
-                    beam_info.servo_enabled,
-                    beam_info,
-                )
-                at_mu(self.core.get_rtio_counter_mu() + slack_mu)
-
             suservo.set(
                 en_out=0,
                 en_iir=0,
@@ -285,7 +482,8 @@ class ControlBeamsWithoutCoolingAOM(Fragment):
 
             if not ignore_shutters and beam_info.shutter_device != "None":
                 shutter = self.beam_shutters[self.shutter_indexes[i]]
-                shutter.off()
+                if not self.plan_shutters:
+                    shutter.off()
                 delay_mu(self.t_rtio_cycle_mu)
 
         if not ignore_shutters:
@@ -297,15 +495,6 @@ class ControlBeamsWithoutCoolingAOM(Fragment):
                 suservo = self.beam_suservos[i]
                 shutter = self.beam_shutters[self.shutter_indexes[i]]
 
-                if self.debug_enabled:
-                    slack_mu = now_mu() - self.core.get_rtio_counter_mu()
-                    logger.info(
-                        "Closing shutter [%s] for beam [%s]",
-                        shutter.channel,
-                        beam_info.name,
-                    )
-                    at_mu(self.core.get_rtio_counter_mu() + slack_mu)
-
                 delay(beam_info.shutter_delay)
 
                 # If the servo was engaged, this should recall the last output value:
@@ -319,8 +508,29 @@ class ControlBeamsWithoutCoolingAOM(Fragment):
 
                 delay(-beam_info.shutter_delay)
 
+    @kernel
+    def _plan_shutter_moves(self, state, in_advance):
+        # Request the shutter moves that the write methods skip when planning.
+        # These match the timings of the direct writes: opening ahead of the
+        # cursor by each shutter's delay, or closing at the cursor
+        t_mu = now_mu()
+        for i in range(1, len(self.beam_infos)):
+            if self.shutter_indexes[i] < 0:
+                continue
+
+            t_move_mu = t_mu
+            if in_advance:
+                t_move_mu += self.t_rtio_cycle_mu - self.shutter_delays_mu[i]
+
+            self.shutter_planner.request(
+                self.planner_shutter_ids[self.shutter_indexes[i]], t_move_mu, state
+            )
+
     @kernel
     def _set_shutters(self, state=True, ignore_delay=False):
+        if self.plan_shutters:
+            self._plan_shutter_moves(state=state, in_advance=True)
+
         for i in range(len(self.beam_infos) - 1, 0, -1):
             beam_info = self.beam_infos[i]
             if beam_info.shutter_device == "None":
@@ -329,21 +539,18 @@ class ControlBeamsWithoutCoolingAOM(Fragment):
             shutter = self.beam_shutters[self.shutter_indexes[i]]
 
             if self.debug_enabled:
-                slack_mu = now_mu() - self.core.get_rtio_counter_mu()
-                logger.info(
-                    "%s Shutter [%s] for beam [%s]",
-                    "Opening" if state else "Closing",
-                    shutter.channel,
-                    beam_info.name,
-                )
-                at_mu(self.core.get_rtio_counter_mu() + slack_mu)
+                if state:
+                    self.trace.record(self.trace_open_shutter[i])
+                else:
+                    self.trace.record(self.trace_close_shutter[i])
 
             delay(-beam_info.shutter_delay)
             delay_mu(self.t_rtio_cycle_mu)
-            if state:
-                shutter.on()
-            else:
-                shutter.off()
+            if not self.plan_shutters:
+                if state:
+                    shutter.on()
+                else:
+                    shutter.off()
             delay_mu(self.t_rtio_cycle_mu)
             delay(beam_info.shutter_delay)
 
@@ -5,7 +5,7 @@ from ndscan.experiment import ExpFragment, make_fragment_scan_exp, EnumerationVa
 from toptica.lasersdk.dlcpro.v3_2_0 import Laser
 
 from repository.utils.get_local_devices import get_local_devices
-from submodules.topticadlcpro.toptica_wrapper.driver import TopticaDLCPro
+from controllers.driver_topticadlc import TopticaDLCPro
 
 
 class CheckTopticaFrag(ExpFragment):
@@ -20,13 +20,7 @@ class CheckTopticaFrag(ExpFragment):
 
         self.setattr_argument(
             "laser_name",
-            EnumerationValue(
-                get_local_devices(
-                    self,
-                    TopticaDLCPro,
-                    "submodules.topticadlcpro.toptica_wrapper.driver",
-                )
-            ),
+            EnumerationValue(get_local_devices(self, TopticaDLCPro)),
         )
         self.laser_name: str
 
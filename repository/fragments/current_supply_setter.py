@@ -1,36 +1,67 @@
 import logging
 from typing import List
 
+import numpy as np
 from artiq.coredevice.core import Core
+from artiq.coredevice.dma import CoreDMA
 from artiq.coredevice.fastino import Fastino
 from artiq.experiment import (
+    TBool,
     TFloat,
     TInt32,
+    TInt64,
     TList,
     delay_mu,
+    host_only,
     kernel,
     now_mu,
     at_mu,
     portable,
+    rpc,
 )
 from artiq.language.units import ms
 from ndscan.experiment import Fragment
+from numpy import int64
 
 from repository.models import VDrivenSupply
+from repository.utils.fastino_registry import FastinoChannelMasks, get_fastino_masks
+from repository.utils.kernel_trace import KernelTrace, get_kernel_trace
 
 logger = logging.getLogger(__name__)
 
+# Most points of a ramp table fetched from the host in one RPC while recording,
+# to bound the size of the list on the kernel stack
+RAMP_CHUNK_POINTS = 256
+
+# Longest interpolation period of the Fastino's CIC interpolators, in frames
+MAX_CIC_RATE = 1 << 16
+
 
 class SetAnalogCurrentSupplies(Fragment):
     """
     Set multiple current supplies that are controlled by a analog voltages.
     The supplies must all be controlled by the same fastino
+
+    Ramps are played back from DMA. The table of Fastino words for a ramp is
+    computed on the host, recorded once and replayed for as long as the ramp's
+    parameters stay the same, so queueing a ramp costs a single DMA playback
+    rather than a conversion and RTIO write per point. Up to `num_ramp_slots`
+    different ramps can be kept recorded at once, e.g. for a ramp up and a ramp
+    down in the same sequence.
     """
 
-    def build_fragment(self, current_configs: List[VDrivenSupply], init: bool = True):
+    def build_fragment(
+        self,
+        current_configs: List[VDrivenSupply],
+        init: bool = True,
+        num_ramp_slots: int = 4,
+    ):
         self.setattr_device("core")
         self.core: Core
 
+        self.setattr_device("core_dma")
+        self.core_dma: CoreDMA
+
         self.current_configs: list[VDrivenSupply] = current_configs
 
         assert all(
@@ -42,11 +73,56 @@ class SetAnalogCurrentSupplies(Fragment):
 
         self.fastino_channels = [c.ch for c in self.current_configs]
 
+        # All of our channels are held and then updated together, so that e.g.
+        # both coils of a CoilPair switch at the same time
+        self.fastino_channel_mask = 0
+        for ch in self.fastino_channels:
+            self.fastino_channel_mask |= 1 << ch
+
+        # The hold mask is card-wide, so it's shared with any other users of
+        # this Fastino and each only changes its own channels
+        self.fastino_masks: FastinoChannelMasks = get_fastino_masks(self.fastino)
+
         # %% Kernel variables
         self.first_run = init
         self.debug_enabled = logger.isEnabledFor(logging.INFO)
         self.num_supplies = len(self.current_configs)
 
+        # %% Ramp slots
+        # The parameters each slot was last recorded with, stored flat as
+        # [duration, num_points, *currents_start, *currents_end], and the DMA
+        # handle of its recording. A duration of -1 marks an empty slot
+        self.num_ramp_slots = num_ramp_slots
+        self.ramp_params_size = 2 + 2 * self.num_supplies
+        self.ramp_params = [-1.0] * (num_ramp_slots * self.ramp_params_size)
+        self.ramp_names = [f"{self.fqn}.ramp{i}" for i in range(num_ramp_slots)]
+        self.ramp_handles = [(np.int32(-1), np.int64(0), np.int32(0), False)] * (
+            num_ramp_slots
+        )
+
+        # %% Debug events
+        self.trace: KernelTrace = get_kernel_trace(self.core)
+        self.trace_init = self.trace.register(
+            logger, f"Initiating Fastino {self.current_configs[0].fastino}"
+        )
+        self.trace_set_current = [
+            self.trace.register(
+                logger, f"Setting {c.name} (channel {c.ch}) to %s A via %s V"
+            )
+            for c in self.current_configs
+        ]
+        self.trace_ramp_start = self.trace.register(
+            logger, "Starting ramp of %d points for %.3f ms"
+        )
+        self.trace_ramp_step = [
+            self.trace.register(logger, f"Ramping {c.name} in steps of %s A = %s V")
+            for c in self.current_configs
+        ]
+        self.trace_ramp_queued = self.trace.register(logger, "RTIO events queued")
+        self.trace_ramp_recorded = self.trace.register(
+            logger, "Recorded ramp slot %d with %d points"
+        )
+
         # %% Kernel invariants
         kernel_invariants = getattr(self, "kernel_invariants", set())
         self.kernel_invariants = kernel_invariants | {
@@ -55,13 +131,25 @@ class SetAnalogCurrentSupplies(Fragment):
             "current_configs",
             "fastino",
             "fastino_channels",
+            "fastino_channel_mask",
+            "fastino_masks",
+            "num_ramp_slots",
+            "ramp_params_size",
+            "ramp_names",
+            "trace",
+            "trace_init",
+            "trace_set_current",
+            "trace_ramp_start",
+            "trace_ramp_step",
+            "trace_ramp_queued",
+            "trace_ramp_recorded",
         }
 
     @kernel
     def device_setup(self) -> None:
         if self.first_run:
             if self.debug_enabled:
-                logger.info("Initiating Fastino %s", self.fastino)
+                self.trace.record(self.trace_init)
 
             self.core.break_realtime()
             self.fastino.init()
@@ -70,6 +158,30 @@ class SetAnalogCurrentSupplies(Fragment):
 
         self.device_setup_subfragments()
 
+        # Ship the events recorded so far, before any time-critical code runs
+        if self.debug_enabled:
+            self.trace.flush()
+
+    def host_setup(self):
+        # One coarse RTIO cycle, used to space writes to different channels
+        self.t_rtio_cycle_mu = np.int64(self.core.ref_multiplier)
+        self.kernel_invariants.add("t_rtio_cycle_mu")
+
+        # How far into the past a grouped update starts: one write per channel,
+        # preceded by setting the hold mask when not already held
+        self.group_writes_mu = np.int64(self.num_supplies) * self.t_rtio_cycle_mu
+        self.group_write_offset_mu = self.group_writes_mu + self.t_rtio_cycle_mu
+        self.kernel_invariants.add("group_writes_mu")
+        self.kernel_invariants.add("group_write_offset_mu")
+
+        return super().host_setup()
+
+    def host_cleanup(self):
+        # Log anything still in the trace when the kernel returned
+        self.trace.flush()
+
+        super().host_cleanup()
+
     @portable
     def _single_current_to_volts(self, current: TFloat, current_supply_idx: TInt32):
         lim = self.current_configs[current_supply_idx].current_limit
@@ -87,34 +199,71 @@ class SetAnalogCurrentSupplies(Fragment):
         for i in range(len(self.current_configs)):
             voltages_out[i] = self._single_current_to_volts(currents[i], i)
 
+    @kernel
+    def _write_group_mu(self, words_mu: TList(TInt32), first: TInt32):
+        # Write words_mu[first:first + num_supplies] to our channels in the
+        # cycles before the cursor and update them all together at the cursor.
+        # The channels must already be held. This does not move the cursor
+        t_mu = now_mu()
+
+        at_mu(t_mu - self.group_writes_mu)
+        for i in range(self.num_supplies):
+            self.fastino.set_dac_mu(self.fastino_channels[i], words_mu[first + i])
+            delay_mu(self.t_rtio_cycle_mu)
+
+        at_mu(t_mu)
+        self.fastino.update(self.fastino_channel_mask)
+        at_mu(t_mu)
+
+    @kernel
+    def _set_hold(self, hold: TBool):
+        # Hold (or release) our channels without moving the cursor, leaving
+        # those of other users of the Fastino alone
+        t_mu = now_mu()
+        self.fastino_masks.set_hold(self.fastino_channel_mask, hold)
+        at_mu(t_mu)
+
     @kernel
     def set_currents(self, currents: TList(TFloat)):
         """
         Set currents in amps.
 
-        This method does not advance the timeline but does require at least
-        1.5us + 808ns * len(currents) on a Kasli 1.x as SPI events are written
-        into the past.
+        All the channels are written while held and then updated together, so
+        the new currents take effect simultaneously at the cursor. The channels
+        are released again afterwards so that other users of the Fastino see
+        immediate updates.
+
+        This method advances the timeline by two RTIO cycles and writes
+        `len(currents) + 1` cycles into the past, so consecutive calls must be
+        at least `len(currents) + 3` RTIO cycles apart for their writes to stay
+        in order. It also requires at least 1.5us + 808ns * len(currents) of
+        slack on a Kasli 1.x for the SPI transfers to the Fastino.
         """
         voltages = [0.0] * len(self.current_configs)
 
         self._currents_to_volts(currents, voltages)
 
         if self.debug_enabled:
-            slack_mu = now_mu() - self.core.get_rtio_counter_mu()
-            logger.info(
-                "Setting currents = %s via voltages = %s on channels %s",
-                currents,
-                voltages,
-                self.fastino_channels,
-            )
-            at_mu(self.core.get_rtio_counter_mu() + slack_mu)
+            for idx in range(self.num_supplies):
+                self.trace.record(
+                    self.trace_set_current[idx], currents[idx], voltages[idx]
+                )
+
+        words_mu = [0] * self.num_supplies
+        for idx in range(self.num_supplies):
+            words_mu[idx] = self.fastino.voltage_to_mu(voltages[idx])
+
+        t_mu = now_mu()
 
-        for idx in range(len(self.fastino_channels)):
-            self.fastino.set_dac(self.fastino_channels[idx], voltages[idx])
-            delay_mu(
-                8
-            )  # Nothing happens for multiple channels if we use a shorter delay?!
+        at_mu(t_mu - self.group_write_offset_mu)
+        self._set_hold(True)
+
+        at_mu(t_mu)
+        self._write_group_mu(words_mu, 0)
+
+        delay_mu(self.t_rtio_cycle_mu)
+        self._set_hold(False)
+        delay_mu(self.t_rtio_cycle_mu)
 
     @kernel
     def set_defaults(self):
@@ -135,10 +284,11 @@ class SetAnalogCurrentSupplies(Fragment):
         """
         Queue a linear ramp of the currents controlled by this object
 
-        This method will write lots of RTIO events for the `duration` of the
-        ramp and will advance the timeline until the end of the ramp. It will
-        also require quite a lot of time to compute and queue the ramp, so users
-        should consider DMA if performance is limiting.
+        This method plays the ramp back from DMA and will advance the timeline
+        until the end of the ramp. The first call with a new set of parameters
+        records the ramp, which takes an RPC and some CPU time - to avoid this
+        eating into the slack, call :meth:`prepare_ramp` with the same
+        parameters ahead of time.
 
         Note that `time_step` will be approximate - this method will ensure that
         initial and final writes occurs at the start and end of the `duration`
@@ -177,10 +327,11 @@ class SetAnalogCurrentSupplies(Fragment):
         """
         Queue a linear ramp of the currents controlled by this object
 
-        This method will write lots of RTIO events for the `duration` of the
-        ramp and will advance the timeline until the end of the ramp. It will
-        also require quite a lot of time to compute and queue the ramp, so users
-        should consider DMA if performance is limiting.
+        This method plays the ramp back from DMA and will advance the timeline
+        until the end of the ramp. The first call with a new set of parameters
+        records the ramp, which takes an RPC and some CPU time - to avoid this
+        eating into the slack, call :meth:`prepare_ramp` with the same
+        parameters ahead of time.
 
         Note that `time_step` will be approximate - this method will ensure that
         initial and final writes occurs at the start and end of the `duration`
@@ -198,140 +349,315 @@ class SetAnalogCurrentSupplies(Fragment):
 
             num_points (TInt32, optional): Number of samples
         """
+        self.prepare_ramp(currents_start, currents_end, duration, num_points)
+        self.play_ramp()
+
+    @host_only
+    def _ramp_table_mu(
+        self, currents_start, currents_end, num_points, first_point=0, count=None
+    ):
+        # The Fastino words for points first_point to first_point + count
+        # (rows) and each supply (columns), computed exactly for each point
+        # rather than by accumulating steps
+        if count is None:
+            count = num_points - first_point
+        if len(currents_start) != self.num_supplies:
+            raise ValueError("Wrong number of currents")
+        if len(currents_end) != self.num_supplies:
+            raise ValueError("Wrong number of currents")
+
+        currents_start = np.asarray(currents_start, dtype=float)
+        currents_end = np.asarray(currents_end, dtype=float)
+
+        points = np.arange(first_point, min(first_point + count, num_points))
+        fractions = (points / (num_points - 1))[:, np.newaxis]
+        currents = currents_start + fractions * (currents_end - currents_start)
+
+        limits = np.array([c.current_limit for c in self.current_configs])
+        gains = np.array([c.gain for c in self.current_configs])
+        voltages = np.minimum(limits, currents / gains)
+
+        # Vectorised version of Fastino.voltage_to_mu
+        table = np.rint(voltages * ((1 << 16) / 20.0)).astype(np.int64) + 0x8000
+        if np.any(table < 0) or np.any(table > 0xFFFF):
+            raise ValueError("DAC voltage out of bounds")
+
+        return table.astype(np.int32)
+
+    @rpc
+    def _get_ramp_table_mu(
+        self,
+        currents_start: TList(TFloat),
+        currents_end: TList(TFloat),
+        num_points: TInt32,
+        first_point: TInt32,
+    ) -> TList(TInt32):
+        # At most RAMP_CHUNK_POINTS points of the table, flattened
+        table_mu = self._ramp_table_mu(
+            currents_start, currents_end, num_points, first_point, RAMP_CHUNK_POINTS
+        )
+        return table_mu.ravel().tolist()
+
+    @kernel
+    def _record_ramp_chunk(
+        self,
+        currents_start: TList(TFloat),
+        currents_end: TList(TFloat),
+        num_points: TInt32,
+        first_point: TInt32,
+        t_start_mu: TInt64,
+        time_step_mu: TInt64,
+    ):
+        # Fetch and write one chunk of the ramp table. This is a separate call
+        # so that each chunk's list is freed from the stack when it returns
+        table_mu = self._get_ramp_table_mu(
+            currents_start, currents_end, num_points, first_point
+        )
+        for i in range(len(table_mu) // self.num_supplies):
+            at_mu(t_start_mu + int64(first_point + i) * time_step_mu)
+            self._write_group_mu(table_mu, i * self.num_supplies)
+
+    @kernel
+    def _ramp_params_match(
+        self,
+        slot: TInt32,
+        currents_start: TList(TFloat),
+        currents_end: TList(TFloat),
+        duration: TFloat,
+        num_points: TInt32,
+    ):
+        offset = slot * self.ramp_params_size
+        if self.ramp_params[offset] != duration:
+            return False
+        if self.ramp_params[offset + 1] != float(num_points):
+            return False
+        for i in range(self.num_supplies):
+            if self.ramp_params[offset + 2 + i] != currents_start[i]:
+                return False
+            if self.ramp_params[offset + 2 + self.num_supplies + i] != currents_end[i]:
+                return False
+        return True
+
+    @kernel
+    def prepare_ramp(
+        self,
+        currents_start: TList(TFloat),
+        currents_end: TList(TFloat),
+        duration: TFloat,
+        num_points: TInt32 = 1000,
+        slot: TInt32 = 0,
+    ):
+        """
+        Record a linear ramp of the currents into DMA slot `slot`, unless it
+        already holds a ramp with the same parameters
+
+        Recording needs an RPC per ``RAMP_CHUNK_POINTS`` points to fetch the
+        table of Fastino words and some CPU time, so call this ahead of
+        time-critical code (e.g. in ``device_setup``) whenever the ramp might
+        have changed. This does not move the timeline cursor but does eat into
+        the slack when recording.
+        See :meth:`set_currents_ramping_numpoints` for the arguments.
+        """
+        if slot < 0 or slot >= self.num_ramp_slots:
+            raise ValueError("Invalid ramp slot")
+        if num_points < 2:
+            raise ValueError("A ramp needs at least two points")
+
+        if self._ramp_params_match(
+            slot, currents_start, currents_end, duration, num_points
+        ):
+            return
+
         if self.debug_enabled:
-            slack_mu = now_mu() - self.core.get_rtio_counter_mu()
-            logger.info("Starting ramp for %.3f ms", 1e3 * duration)
-            at_mu(self.core.get_rtio_counter_mu() + slack_mu)
+            self.trace.record(self.trace_ramp_start, float(num_points), 1e3 * duration)
 
-        # Compute grid for writes
         actual_time_step_mu = self.actual_timestep_mu(duration, num_points)
 
-        current_steps = [0.0] * self.num_supplies
-        for i_supply in range(self.num_supplies):
-            current_steps[i_supply] = (
-                currents_end[i_supply] - currents_start[i_supply]
-            ) / float(num_points - 1)
-
-        # Here we convert the current steps to voltage steps. This assumes that
-        # the current to voltage conversion function _currents_to_volts is
-        # linear. If this is not true, this will break. This is tested in
-        # `test_current_to_volts_convertion_is_linear`. Note that we don't
-        # calculate the voltage steps in machine units. That would be vulnerable
-        # to rounding errors. This means that we have to call the fastino's
-        # "voltage_to_mu" function for each write which is wasteful, but assures
-        # that we actually get the currents we expect.
-        voltage_steps = [0.0] * self.num_supplies
-        for i_supply in range(self.num_supplies):
-            voltage_steps[i_supply] = self._single_current_to_volts(
-                current_steps[i_supply], i_supply
-            )
+        # Each point is a grouped update, which starts this far before the
+        # point itself. Writes to different channels are separated by one
+        # coarse RTIO cycle, otherwise they would replace each other
+        if actual_time_step_mu <= self.group_write_offset_mu:
+            raise ValueError("Ramp time step is too short for this many supplies")
+
+        # Queue the points, including an initial and final point. The sequence
+        # is recorded group_write_offset_mu late so that the writes for the
+        # first point have positive timestamps, see play_ramp. The hold mask is
+        # shared with other users of the Fastino, so it's written by play_ramp
+        # rather than baked into the recording
+        with self.core_dma.record(self.ramp_names[slot]):
+            t_start_mu = now_mu() + self.group_write_offset_mu
+
+            for first_point in range(0, num_points, RAMP_CHUNK_POINTS):
+                self._record_ramp_chunk(
+                    currents_start,
+                    currents_end,
+                    num_points,
+                    first_point,
+                    t_start_mu,
+                    actual_time_step_mu,
+                )
 
-        # Calculate the starting voltages
-        voltages_now = [0.0] * self.num_supplies
-        for i_supply in range(self.num_supplies):
-            voltages_now[i_supply] = self._single_current_to_volts(
-                currents_start[i_supply], i_supply
-            )
+            at_mu(t_start_mu + int64(num_points) * actual_time_step_mu)
+
+        offset = slot * self.ramp_params_size
+        self.ramp_params[offset] = duration
+        self.ramp_params[offset + 1] = float(num_points)
+        for i in range(self.num_supplies):
+            self.ramp_params[offset + 2 + i] = currents_start[i]
+            self.ramp_params[offset + 2 + self.num_supplies + i] = currents_end[i]
+
+        self.ramp_handles[slot] = self.core_dma.get_handle(self.ramp_names[slot])
 
         if self.debug_enabled:
-            slack_mu = now_mu() - self.core.get_rtio_counter_mu()
-            logger.info(
-                "Precomputation completed: %d points with steps of %s A = %s V",
-                num_points,
-                current_steps,
-                voltage_steps,
-            )
-            at_mu(self.core.get_rtio_counter_mu() + slack_mu)
+            self.trace.record(self.trace_ramp_recorded, float(slot), float(num_points))
 
-        # Queue the points, including an initial and final point
-        for _ in range(num_points):
-            # Set voltages and calculate next voltages
-            for i_supply in range(self.num_supplies):
-                self.fastino.set_dac(
-                    self.fastino_channels[i_supply], voltages_now[i_supply]
-                )
-                voltages_now[i_supply] += voltage_steps[i_supply]
+    @kernel
+    def play_ramp(self, slot: TInt32 = 0):
+        """
+        Play the ramp recorded in `slot` by :meth:`prepare_ramp`
 
-            delay_mu(actual_time_step_mu)
+        This advances the timeline cursor by the duration of the ramp.
+        """
+        if self.ramp_params[slot * self.ramp_params_size] < 0.0:
+            raise ValueError("No ramp has been prepared in this slot")
+
+        # Recording any DMA sequence, including other slots, invalidates the
+        # handle. Looking it up again is slow but only needed once
+        if self.ramp_handles[slot][0] != self.core_dma.epoch:
+            self.ramp_handles[slot] = self.core_dma.get_handle(self.ramp_names[slot])
+
+        # Hold our channels from just before the first point until just after
+        # the last, with the hold mask as it is now
+        offset = slot * self.ramp_params_size
+        num_points = int(self.ramp_params[offset + 1])
+        time_step_mu = self.actual_timestep_mu(self.ramp_params[offset], num_points)
+        t_mu = now_mu()
+        t_release_mu = (
+            t_mu + int64(num_points - 1) * time_step_mu + self.t_rtio_cycle_mu
+        )
+
+        at_mu(t_mu - self.group_write_offset_mu)
+        self._set_hold(True)
+        self.core_dma.playback_handle(self.ramp_handles[slot])
+        t_end_mu = now_mu()
+
+        at_mu(t_release_mu)
+        self._set_hold(False)
+        at_mu(t_end_mu)
 
         if self.debug_enabled:
-            slack_mu = now_mu() - self.core.get_rtio_counter_mu()
-            logger.info("RTIO events queued - now_mu() = %d", now_mu())
-            at_mu(self.core.get_rtio_counter_mu() + slack_mu)
+            self.trace.record(self.trace_ramp_queued)
 
     @kernel
-    def smooth_voltage_ramp(
+    def set_currents_interpolated(
         self,
-        dac_channel,
-        start_v=1.0,
-        end_v=2.0,
-        duration=20 * ms,
-        max_step_duration=20 * ms,
-        steps=None,
+        currents_start: TList(TFloat),
+        currents_end: TList(TFloat),
+        duration: TFloat,
+        max_breakpoint_interval: TFloat = 20 * ms,
     ):
-        """Create a voltage ramp of arbitrary duration with smooth transitions.
-
-        This function combines CIC interpolation with timeline-based programming to
-        create smooth voltage transitions of any duration.
+        """
+        Ramp the currents linearly using the Fastino's CIC interpolators
+
+        Only the breakpoints of the ramp are written. The interpolators fill in
+        between them at the full Fastino frame rate, so a long ramp costs a
+        few RTIO events per breakpoint rather than per 75 kHz sample as with
+        :meth:`set_currents_ramping`.
+
+        The breakpoints are spaced by a power-of-two number of Fastino frames
+        (at most ~25 ms, the longest interpolation the gateware supports),
+        since only then is the gain of the interpolators exactly one. The
+        number of breakpoints is rounded to fit, so the actual duration of the
+        ramp can differ from `duration` by up to half a breakpoint interval.
+        Reconfiguring the interpolators resets them, so the supplies should
+        already be at `currents_start` when this is called.
+
+        The output lags the breakpoints by the interpolators' group delay, so
+        interpolation is only switched back off four breakpoint intervals,
+        the length of the interpolators' response, after the last one. This
+        method advances the timeline to that point, i.e. by the duration of
+        the ramp plus up to 4 * `max_breakpoint_interval`, and writes the
+        interpolator configuration a few RTIO cycles into the past.
 
         Args:
-            dac_channel: DAC channel number (0-31)
-            start_v: Starting voltage in volts
-            end_v: Ending voltage in volts
-            duration: Total ramp duration
-            max_step_duration: Maximum duration for a single CIC interpolation step
-            steps: Optional number of steps to use (overrides max_step_duration)
+            currents_start (TList): List of starting currents / A
+
+            currents_end (TList): List of ending currents / A
+
+            duration (TFloat): Time to perform the ramp for
+
+            max_breakpoint_interval (TFloat, optional):
+                Longest time between breakpoints. Defaults to 20 ms.
         """
-        # Calculate how many steps we need
-        if steps is None:
-            # Each CIC interpolation can handle up to ~25ms
-            # Using 80% of theoretical max for safety margin
-            num_steps = int(duration / (max_step_duration * 0.8)) + 1
-        else:
-            num_steps = steps
-
-        step_time = duration / num_steps
-        voltage_step = (end_v - start_v) / num_steps
-
-        # Configure the CIC interpolator for each step
-        # Calculate appropriate interpolation rate based on step_time
-        frames_per_step = step_time / self.core.mu_to_seconds(self.t_frame)
-
-        # Select a reasonable rate that's below the maximum (65536)
-        # but still provides good smoothness
-        rate = min(int(frames_per_step / 4), 65530)
-        if rate < 2:
-            rate = 2  # Ensure at least some interpolation
-
-        # Setup the CIC interpolator
-        self.stage_cic(rate)
-
-        # Enable continuous updates on this channel
-        self.set_continuous(1 << dac_channel)
-
-        # Apply the interpolator setting to the channel
-        self.apply_cic(1 << dac_channel)
-
-        # Wait for interpolator to stabilize
-        delay_mu(4 * self.t_frame)
-
-        # Set initial voltage
-        self.set_dac(dac_channel, start_v)
-        delay_mu(4 * self.t_frame)
-
-        # Record start time for precise timeline control
-        t_start = now_mu()
-
-        # For very short durations, just do a single CIC interpolation
-        if num_steps == 1:
-            self.set_dac(dac_channel, end_v)
-            # Wait for completion
-            at_mu(t_start + self.core.seconds_to_mu(duration))
-            return
+        if len(currents_start) != self.num_supplies:
+            raise ValueError("Wrong number of currents")
+        if len(currents_end) != self.num_supplies:
+            raise ValueError("Wrong number of currents")
+
+        # The longest power-of-two interpolation period that fits within both
+        # the breakpoint interval and the ramp
+        t_frame = self.core.mu_to_seconds(self.fastino.t_frame)
+        max_frames = min(
+            int(min(max_breakpoint_interval, duration) / t_frame), MAX_CIC_RATE
+        )
+        frames_per_segment = 1
+        while 2 * frames_per_segment <= max_frames:
+            frames_per_segment *= 2
+
+        num_segments = int(duration / (frames_per_segment * t_frame) + 0.5)
+        if num_segments < 1:
+            num_segments = 1
+
+        t_start_mu = now_mu()
+
+        # Configure the interpolators before the first breakpoint, one RTIO
+        # cycle apart and finishing with the hold for the grouped writes
+        t_mu = t_start_mu - self.group_write_offset_mu - 3 * self.t_rtio_cycle_mu
+        at_mu(t_mu)
+        rate = self.fastino.stage_cic(frames_per_segment)
+        at_mu(t_mu + self.t_rtio_cycle_mu)
+        self.fastino.apply_cic(self.fastino_channel_mask)
+        at_mu(t_mu + 2 * self.t_rtio_cycle_mu)
+        self.fastino_masks.set_continuous(self.fastino_channel_mask, True)
+        at_mu(t_mu + 3 * self.t_rtio_cycle_mu)
+        self._set_hold(True)
+
+        t_segment_mu = int64(rate) * self.fastino.t_frame
+
+        if self.debug_enabled:
+            at_mu(t_start_mu)
+            self.trace.record(
+                self.trace_ramp_start,
+                float(num_segments + 1),
+                1e3 * self.core.mu_to_seconds(int64(num_segments) * t_segment_mu),
+            )
 
-        # For longer durations, schedule each step with precise timing
-        for i in range(1, num_steps + 1):
-            step_voltage = start_v + i * voltage_step
-            # Schedule this voltage update at the precise time
-            at_mu(t_start + self.core.seconds_to_mu(i * step_time))
-            self.set_dac(dac_channel, step_voltage)
+        # Write the breakpoints, one interpolation period apart
+        words_mu = [0] * self.num_supplies
+        for i_point in range(num_segments + 1):
+            fraction = float(i_point) / float(num_segments)
+            for i_supply in range(self.num_supplies):
+                current = currents_start[i_supply] + fraction * (
+                    currents_end[i_supply] - currents_start[i_supply]
+                )
+                words_mu[i_supply] = self.fastino.voltage_to_mu(
+                    self._single_current_to_volts(current, i_supply)
+                )
+
+            at_mu(t_start_mu + int64(i_point) * t_segment_mu)
+            self._write_group_mu(words_mu, 0)
+
+        # Once the output has settled, return to plain, uninterpolated updates
+        t_mu = t_start_mu + int64(num_segments + 4) * t_segment_mu
+        at_mu(t_mu)
+        self._set_hold(False)
+        at_mu(t_mu + self.t_rtio_cycle_mu)
+        self.fastino.stage_cic(1)
+        at_mu(t_mu + 2 * self.t_rtio_cycle_mu)
+        self.fastino.apply_cic(self.fastino_channel_mask)
+        at_mu(t_mu + 3 * self.t_rtio_cycle_mu)
+        self.fastino_masks.set_continuous(self.fastino_channel_mask, False)
+        at_mu(t_mu + 4 * self.t_rtio_cycle_mu)
+
+        if self.debug_enabled:
+            self.trace.record(self.trace_ramp_queued)
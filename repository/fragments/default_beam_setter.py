@@ -16,6 +16,7 @@ from repository.utils.dummy_devices import (
     DummyFloatParameterHandle,
 )
 from repository.fragments.suservo_frag import SUServoFrag
+from repository.fragments.suservo_group_writer import SUServoGroupWriter
 from repository.models import SUServoedBeam
 
 
@@ -201,6 +202,16 @@ class SetBeamsToDefaults(Fragment):
                 )
             )
 
+        # The profiles of all the beams are written together by a group writer
+        # so that they go out back to back
+        self.setattr_fragment("suservo_writer", SUServoGroupWriter)
+        self.suservo_writer: SUServoGroupWriter
+        self.suservo_writer_indices = [
+            self.suservo_writer.index_of(beam_info.suservo_device)
+            for beam_info in self.default_suservo_beam_infos
+        ]
+        self.has_suservo_beams = bool(self.suservo_writer_indices)
+
         self.max_shutter_delay = max(
             [beam_info.shutter_delay for beam_info in (self.default_suservo_beam_infos)]
             + [0]
@@ -233,10 +244,16 @@ class SetBeamsToDefaults(Fragment):
                     name="", frequency=0.0, attenuation=0.0, suservo_device=""
                 )
             ]
+            self.suservo_writer_indices = [0]
 
         # %% Kernel invariants and variables
         kernel_invariants = getattr(self, "kernel_invariants", set())
-        self.kernel_invariants = kernel_invariants | {"debug_mode", "max_shutter_delay"}
+        self.kernel_invariants = kernel_invariants | {
+            "debug_mode",
+            "max_shutter_delay",
+            "has_suservo_beams",
+            "suservo_writer_indices",
+        }
 
         # Init these arrays to zeros - we fill it in in device_setup
         self.suservo_setpoints = [0.0] * len(self.default_suservo_beam_infos)
@@ -319,37 +336,51 @@ class SetBeamsToDefaults(Fragment):
             logger.info("SetBeamsToDefaults::_turn_on_suservos")
             at_mu(self.core.get_rtio_counter_mu() + slack_mu)
 
-        for i in range(len(self.suservo_setters_and_info)):
+        num_beams = len(self.suservo_setters_and_info)
+        setpoints = [0.0] * num_beams
+        frequencies = [0.0] * num_beams
+        initial_amplitudes = [0.0] * num_beams
+
+        # Attenuators first: these are SPI writes to the Urukuls
+        for i in range(num_beams):
             settings = self.suservo_setters_and_info[i]
             beam_info = self.default_suservo_beam_infos[i]
-            setpoint = settings.setpoint_handle.get()
-            frequency = settings.frequency_handle.get()
-            initial_amplitude = settings.initial_amplitude_handle.get()
-
-            en_out = light_enabled or (not light_enabled and settings.shutter_present)
+            setpoints[i] = settings.setpoint_handle.get()
+            frequencies[i] = settings.frequency_handle.get()
+            initial_amplitudes[i] = settings.initial_amplitude_handle.get()
 
             if self.debug_mode:
                 slack_mu = now_mu() - self.core.get_rtio_counter_mu()
                 logger.info(
                     "Enabling suservo (%s)\n- beam_info %s\n- setpoint %s\n- \
-                        frequency %s\n- en_out %s\n- initial_amplitude %.3f",
+                        frequency %s\n- initial_amplitude %.3f",
                     settings.setter,
                     beam_info,
-                    setpoint,
-                    frequency,
-                    en_out,
-                    initial_amplitude,
+                    setpoints[i],
+                    frequencies[i],
+                    initial_amplitudes[i],
                 )
                 at_mu(self.core.get_rtio_counter_mu() + slack_mu)
 
-            settings.setter.set_suservo(
-                frequency,
-                initial_amplitude,
-                float(beam_info.attenuation),
-                en_out=en_out,
-                setpoint_v=setpoint,
-                enable_iir=beam_info.servo_enabled and light_enabled,
+            settings.setter.set_attenuation(float(beam_info.attenuation))
+
+        # Then all the profiles, back to back
+        if self.has_suservo_beams:
+            self.suservo_writer.write_profiles(
+                self.suservo_writer_indices, setpoints, initial_amplitudes, frequencies
+            )
+
+        # And finally switch the outputs
+        for i in range(num_beams):
+            settings = self.suservo_setters_and_info[i]
+            beam_info = self.default_suservo_beam_infos[i]
+
+            en_out = light_enabled or (not light_enabled and settings.shutter_present)
+
+            settings.setter.set_channel_state(
+                en_out, beam_info.servo_enabled and light_enabled
             )
+            delay_mu(int64(self.core.ref_multiplier))
 
     @kernel
     def _set_shutters(self, light_enabled):
@@ -1,13 +1,22 @@
 import logging
+import time
+from typing import List
 
+import numpy as np
 from artiq.coredevice.core import Core
 from artiq.coredevice.suservo import Channel as SUServoChannel
 from artiq.experiment import (
     BooleanValue,
     EnumerationValue,
+    TBool,
+    TFloat,
+    TInt32,
+    TList,
+    delay_mu,
     kernel,
     ms,
     rpc,
+    us,
     delay,
 )
 from ndscan.experiment import ExpFragment, FloatParam
@@ -19,6 +28,7 @@ from repository.fragments.default_beam_setter import (
 )
 from repository.models.devices import SUServoedBeam
 from repository.fragments.read_adc import ReadSUServoADC
+from repository.utils.ring_buffer import RingBuffer
 
 from device_db import server_addr
 
@@ -28,8 +38,24 @@ logger = logging.getLogger(__name__)
 class SingleSUServoReadingFrag(ExpFragment):
     """
     Plot a single SUServo photodiode reading
+
+    Readings are collected in blocks on the core device and shipped with async
+    RPCs, at roughly the rate at which the plot is refreshed. The host keeps the
+    last :attr:`HISTORY_LENGTH` readings in a ring buffer and publishes them at
+    most :attr:`MAX_PUBLISH_RATE` times per second. Readings continue until the
+    scheduler asks the experiment to pause or terminate, at which point any
+    partial block is shipped and published.
     """
 
+    # Number of readings kept in the dataset
+    HISTORY_LENGTH = 1000
+
+    # Maximum rate at which the dataset is published / Hz
+    MAX_PUBLISH_RATE = 10.0
+
+    # Size of the kernel-side buffer of readings
+    BLOCK_SIZE = 100
+
     def build_fragment(self):
         self.setattr_device("core")
         self.core: Core
@@ -41,7 +67,7 @@ class SingleSUServoReadingFrag(ExpFragment):
             "waittime",
             FloatParam,
             description="Time between measurements",
-            default=0.0,
+            default=0.05,
             min=0.05,
             max=10,
             unit="s",
@@ -101,6 +127,14 @@ class SingleSUServoReadingFrag(ExpFragment):
 
         # %% Kernel params
         self.first_run = True
+        self.block = [0.0] * self.BLOCK_SIZE
+
+        # %% Kernel invariants
+        kernel_invariants = getattr(self, "kernel_invariants", set())
+        self.kernel_invariants = kernel_invariants | {
+            "BLOCK_SIZE",
+            "MAX_PUBLISH_RATE",
+        }
 
     def host_setup(self):
         # These are conventions in the AION lab:
@@ -115,6 +149,9 @@ class SingleSUServoReadingFrag(ExpFragment):
             broadcast=True,
         )
 
+        self.history = RingBuffer(self.HISTORY_LENGTH)
+        self.last_publish_time = 0.0
+
         self.ccb.issue(
             "create_applet",
             self.name,
@@ -135,24 +172,224 @@ class SingleSUServoReadingFrag(ExpFragment):
 
     @kernel
     def run_once(self):
-        delay(self.waittime.get())
+        waittime = self.waittime.get()
+        delay(waittime)
+
+        # Ship the readings about as often as they can be published
+        block_length = self.BLOCK_SIZE
+        if waittime > 0.0:
+            block_length = int(1.0 / (self.MAX_PUBLISH_RATE * waittime))
+        if block_length < 1:
+            block_length = 1
+        if block_length > self.BLOCK_SIZE:
+            block_length = self.BLOCK_SIZE
 
         self.core.break_realtime()
+        num_in_block = 0
         while True:
-            for i in range(1000):
-                v = self.adc_reader.read_adc() - self.beam.photodiode_offset
-                delay(self.waittime.get())
-                self.update_data(v)
-            self.reset_data()
-
-    @rpc
-    def update_data(self, data):
-        self.name = f"SUServo{self.beam_name}"
-        self.append_to_dataset(self.name, data)
+            self.block[num_in_block] = (
+                self.adc_reader.read_adc() - self.beam.photodiode_offset
+            )
+            num_in_block += 1
+
+            if num_in_block == block_length:
+                # Check the scheduler once per block, not per reading, since
+                # it's a synchronous RPC
+                if self.scheduler.check_pause():
+                    break
+                self.update_data(num_in_block, self.block)
+                num_in_block = 0
+
+            delay(waittime)
+
+        # Don't lose the readings from the last, partly filled block
+        self.update_data(num_in_block, self.block, True)
+
+    @rpc(flags={"async"})
+    def update_data(
+        self, num_readings: TInt32, block: TList(TFloat), final: TBool = False
+    ):
+        self.history.extend(block[:num_readings])
+
+        now = time.monotonic()
+        if not final and now - self.last_publish_time < 1.0 / self.MAX_PUBLISH_RATE:
+            return
+        self.last_publish_time = now
+
+        self.set_dataset(self.name, self.history.ordered(), broadcast=True)
+
+
+class AllSUServosReadingFrag(ExpFragment):
+    """
+    Plot the photodiode readings and control signals of every SUServo channel
+
+    All 8 ADC channels and the y-values (the servos' control signals) are read
+    in a single kernel loop, so every beam can be watched from one experiment.
+    The readings are published as a 2D dataset with one row per sample:
+    columns 0-7 are the ADC voltages and 8-15 the y-values of channels 0-7.
+    As with :class:`SingleSUServoReadingFrag`, they are shipped to the host in
+    blocks and published at a capped rate, until the scheduler asks the
+    experiment to pause or terminate.
+    """
+
+    HISTORY_LENGTH = 1000
+    MAX_PUBLISH_RATE = 10.0
+    BLOCK_SIZE = 100
 
-    @rpc
-    def reset_data(self):
-        self.set_dataset(self.name, [], broadcast=True)
+    NUM_CHANNELS = 8
+
+    # ADC voltages then y-values
+    ROW_WIDTH = 2 * NUM_CHANNELS
+
+    DATASET = "SUServoMonitor"
+
+    def build_fragment(self):
+        self.setattr_device("core")
+        self.core: Core
+
+        self.setattr_device("ccb")
+        self.setattr_device("scheduler")
+
+        self.setattr_param(
+            "waittime",
+            FloatParam,
+            description="Time between measurements",
+            default=0.1,
+            min=0.01,
+            max=10,
+            unit="s",
+            step=0.01,
+        )
+        self.waittime: FloatParamHandle
+
+        self.suservo_channels: List[SUServoChannel] = [
+            self.get_device(f"suservo_ch{i}") for i in range(self.NUM_CHANNELS)
+        ]
+
+        # Label each channel with the beam that uses it, if any
+        self.channel_names = [f"ch{i}" for i in range(self.NUM_CHANNELS)]
+        # (aliases give separate device objects, so compare the servo channels)
+        for beam in SUServoedBeam.values():
+            device: SUServoChannel = self.get_device(beam.suservo_device)
+            for i, channel in enumerate(self.suservo_channels):
+                if (
+                    channel.servo is device.servo
+                    and channel.servo_channel == device.servo_channel
+                ):
+                    self.channel_names[i] = beam.name
+
+        # All the ADCs are read through the first channel's SUServo
+        self.setattr_fragment("adc_reader", ReadSUServoADC, self.suservo_channels[0])
+        self.adc_reader: ReadSUServoADC
+
+        # %% Kernel variables
+        self.adc_values = [0.0] * self.NUM_CHANNELS
+        self.block = [0.0] * (self.BLOCK_SIZE * self.ROW_WIDTH)
+
+        # %% Kernel invariants
+        kernel_invariants = getattr(self, "kernel_invariants", set())
+        self.kernel_invariants = kernel_invariants | {
+            "BLOCK_SIZE",
+            "MAX_PUBLISH_RATE",
+            "NUM_CHANNELS",
+            "ROW_WIDTH",
+            "suservo_channels",
+        }
+
+    def host_setup(self):
+        super().host_setup()
+
+        # As elsewhere in the AION lab, each channel uses the profile with the
+        # same number as its servo channel
+        self.profiles = [c.servo_channel for c in self.suservo_channels]
+        self.kernel_invariants.add("profiles")
+
+        # Reads of the servo memory use up all of the slack, so each one is
+        # preceded by this much, as in ReadSUServoADC
+        self.read_slack_mu = np.int64(self.core.seconds_to_mu(20 * us))
+        self.kernel_invariants.add("read_slack_mu")
+
+        self.history = RingBuffer(self.HISTORY_LENGTH, self.ROW_WIDTH)
+        self.last_publish_time = 0.0
+        self.num_samples = 0
+
+        self.set_dataset(f"{self.DATASET}.names", self.channel_names, broadcast=True)
+        self.set_dataset(
+            f"{self.DATASET}.readings",
+            np.zeros((0, self.ROW_WIDTH)),
+            broadcast=True,
+        )
+        self.set_dataset(f"{self.DATASET}.time", np.zeros(0), broadcast=True)
+
+        self.ccb.issue(
+            "create_applet",
+            "SUServo Monitor",
+            "${python} -m repository.gui.suservo_monitor_applet "
+            f"--server {server_addr}",
+        )
+
+    @kernel
+    def run_once(self):
+        waittime = self.waittime.get()
+
+        # Ship the readings about as often as they can be published
+        block_length = int(1.0 / (self.MAX_PUBLISH_RATE * waittime))
+        if block_length < 1:
+            block_length = 1
+        if block_length > self.BLOCK_SIZE:
+            block_length = self.BLOCK_SIZE
+
+        self.core.break_realtime()
+        num_in_block = 0
+        while True:
+            offset = num_in_block * self.ROW_WIDTH
+
+            self.adc_reader.read_all_channels(self.adc_values)
+            for ch in range(self.NUM_CHANNELS):
+                self.block[offset + ch] = self.adc_values[ch]
+
+            for ch in range(self.NUM_CHANNELS):
+                delay_mu(self.read_slack_mu)
+                channel = self.suservo_channels[ch]
+                y = channel.get_y(self.profiles[ch])
+                self.block[offset + self.NUM_CHANNELS + ch] = y
+
+            num_in_block += 1
+            if num_in_block == block_length:
+                # Check the scheduler once per block, not per reading, since
+                # it's a synchronous RPC
+                if self.scheduler.check_pause():
+                    break
+                self.update_data(num_in_block, self.block)
+                num_in_block = 0
+
+            delay(waittime)
+
+        # Don't lose the readings from the last block
+        self.update_data(num_in_block, self.block, True)
+
+    @rpc(flags={"async"})
+    def update_data(
+        self, num_rows: TInt32, block: TList(TFloat), final: TBool = False
+    ):
+        rows = np.reshape(block[: num_rows * self.ROW_WIDTH], (num_rows, -1))
+        self.history.extend(rows)
+        self.num_samples += num_rows
+
+        now = time.monotonic()
+        if not final and now - self.last_publish_time < 1.0 / self.MAX_PUBLISH_RATE:
+            return
+        self.last_publish_time = now
+
+        # Times relative to the first sample, assuming evenly spaced samples
+        first_sample = self.num_samples - len(self.history)
+        times = self.waittime.get() * np.arange(first_sample, self.num_samples)
+
+        self.set_dataset(
+            f"{self.DATASET}.readings", self.history.ordered(), broadcast=True
+        )
+        self.set_dataset(f"{self.DATASET}.time", times, broadcast=True)
 
 
 SUServoReading = make_fragment_scan_exp(SingleSUServoReadingFrag)
+AllSUServosReading = make_fragment_scan_exp(AllSUServosReadingFrag)
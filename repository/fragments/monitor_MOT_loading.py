@@ -3,7 +3,7 @@ import numpy as np
 
 from artiq.coredevice.core import Core
 from artiq.experiment import TFloat, TInt32, TInt64, TList
-from artiq.experiment import kernel, rpc, delay_mu
+from artiq.experiment import host_only, kernel, rpc, delay_mu
 from artiq.language.units import ms, s
 from ndscan.experiment import (
     Fragment,
@@ -30,6 +30,9 @@ logger = logging.getLogger(__name__)
 
 
 class MOTPhotodiodeMeasurement(Fragment):
+    # Number of raw readings shipped to the host in each RPC when streaming
+    CHUNK_SIZE = 256
+
     def build_fragment(self):
         self.setattr_device("core")
         self.core: Core
@@ -51,6 +54,16 @@ class MOTPhotodiodeMeasurement(Fragment):
         )
         self.adc_reader: ReadSUServoADC
 
+        # Kernel-side buffer for the readings being streamed and the host-side
+        # array they are collected into
+        self.chunk_mu = [0] * self.CHUNK_SIZE
+        self.trace_mu = np.zeros(0, dtype=np.int32)
+        self.num_received = 0
+
+        # %% Kernel invariants
+        kernel_invariants = getattr(self, "kernel_invariants", set())
+        self.kernel_invariants = kernel_invariants | {"CHUNK_SIZE"}
+
     @kernel
     def unload_MOT(self, unload_time_mu: TInt64):  # type: ignore
         """
@@ -95,6 +108,68 @@ class MOTPhotodiodeMeasurement(Fragment):
             data[i] = self.adc_reader.read_adc()
             delay_mu(delay_between_points_mu)
 
+    @kernel
+    def measure_MOT_fluorescence_streaming(
+        self,
+        num_points: TInt32,  # type: ignore
+        delay_between_points_mu: TInt64,  # type: ignore
+        unload_time_mu: TInt64,  # type: ignore
+    ) -> None:
+        """
+        Read the fluorescence, streaming it to the host as it is acquired
+
+        Raw readings are collected in chunks of :attr:`CHUNK_SIZE` and each
+        chunk is shipped with an async RPC while acquisition continues, so long
+        traces never need one large transfer at the end of the kernel. Once
+        this returns, call :meth:`get_trace_volts` on the host for the result.
+        """
+        self.unload_MOT(unload_time_mu)
+
+        offset = 0
+        num_in_chunk = 0
+        for i in range(num_points):
+            if i == num_points // 20:
+                self.load_MOT()
+
+            self.chunk_mu[num_in_chunk] = self.adc_reader.read_adc_mu()
+            num_in_chunk += 1
+
+            if num_in_chunk == self.CHUNK_SIZE:
+                self._receive_chunk(num_points, offset, num_in_chunk, self.chunk_mu)
+                offset += num_in_chunk
+                num_in_chunk = 0
+
+            delay_mu(delay_between_points_mu)
+
+        if num_in_chunk > 0:
+            self._receive_chunk(num_points, offset, num_in_chunk, self.chunk_mu)
+
+    @rpc(flags={"async"})
+    def _receive_chunk(
+        self,
+        num_points: TInt32,  # type: ignore
+        offset: TInt32,  # type: ignore
+        num_in_chunk: TInt32,  # type: ignore
+        chunk_mu: TList(TInt32),  # type: ignore
+    ):
+        # A new trace starts with the chunk at offset 0
+        if offset == 0:
+            if len(self.trace_mu) != num_points:
+                self.trace_mu = np.zeros(num_points, dtype=np.int32)
+            self.num_received = 0
+
+        self.trace_mu[offset : offset + num_in_chunk] = chunk_mu[:num_in_chunk]
+        self.num_received += num_in_chunk
+
+    @host_only
+    def get_trace_volts(self) -> np.ndarray:
+        """Get the last streamed trace, converted to volts"""
+        if self.num_received != len(self.trace_mu):
+            logger.warning(
+                "Only received %d of %d points", self.num_received, len(self.trace_mu)
+            )
+        return self.adc_reader.adc_mu_to_volts(self.trace_mu)
+
 
 class MeasureMOTWithPDFrag(ExpFragment):
     """
@@ -157,19 +232,24 @@ class MeasureMOTWithPDFrag(ExpFragment):
     def run_once(self):
         num_points = self.num_trace_points.get()
 
-        trace_data = [0.0] * num_points
-
         self.core.break_realtime()
-        self.mot_measurer.measure_MOT_fluorescence(
+        self.mot_measurer.measure_MOT_fluorescence_streaming(
             num_points=num_points,
             delay_between_points_mu=self.core.seconds_to_mu(
                 self.total_loading_time.get() / num_points
             ),
             unload_time_mu=self.core.seconds_to_mu(self.unload_time.get()),
-            data=trace_data,
         )
 
-        self.photodiode_voltage.push(np.array(trace_data))
+        self.finish_trace()
+
+    @rpc(flags={"async"})
+    def finish_trace(self):
+        # The chunks were streamed with async RPCs, which arrive in order, so
+        # the whole trace is on the host by now
+        trace_data = self.mot_measurer.get_trace_volts()
+
+        self.photodiode_voltage.push(trace_data)
 
         self.update_data(trace_data)
 
@@ -179,7 +259,7 @@ class MeasureMOTWithPDFrag(ExpFragment):
     @rpc(flags={"async"})
     def update_data(self, data):
         self.name = "MOT_loading"
-        data = np.asarray(data)
+        data = np.array(data, dtype=float)
 
         xs = np.linspace(0, self.total_loading_time.get(), self.num_trace_points.get())
 
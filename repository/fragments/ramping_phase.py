@@ -22,6 +22,7 @@ from numpy import int64
 from repository.utils.dummy_devices import DummyAD9910
 from repository.utils.dummy_devices import DummySUServoChannel
 from repository.fragments.suservo_frag import SUServoFrag
+from repository.fragments.suservo_group_writer import SUServoGroupWriter
 
 logger = logging.getLogger(__name__)
 
@@ -268,6 +269,8 @@ class GeneralRampingPhase(Fragment):
         kernel_invariants = getattr(self, "kernel_invariants", set())
         self.kernel_invariants = kernel_invariants | {
             "debug_enabled",
+            "ramp_suservos",
+            "suservo_writer_indices",
         }
 
     @kernel
@@ -397,6 +400,17 @@ class GeneralRampingPhase(Fragment):
         self.setpoint_global_multiple_start: FloatParamHandle
         self.setpoint_global_multiple_end: FloatParamHandle
 
+        # The setpoints for each step are written together by a group writer
+        # rather than by the individual setters, so that they go out back to
+        # back. If there are no SUServos, use a placeholder index so that the
+        # compiler can infer the type, and never call the writer
+        self.setattr_fragment("suservo_writer", SUServoGroupWriter)
+        self.suservo_writer: SUServoGroupWriter
+        self.suservo_writer_indices = [
+            self.suservo_writer.index_of(suservo_name) for suservo_name in self.suservos
+        ] or [0]
+        self.ramp_suservos = bool(self.suservos)
+
         if not suservo_setters_and_param_handles:
             # If we don't have any SUServos to ramp, add a dummy object so that
             # the compiler doesn't complain, with pointers to a dummy parameter
@@ -762,12 +776,13 @@ class GeneralRampingPhase(Fragment):
                     amplitude_values[i] += amplitude_steps[i]
 
                 # %% Set suservo setpoints
-                for i in range(len(self.suservo_setters_and_param_handles)):
-                    suservo_channel = self.suservo_setters_and_param_handles[i][0]
-                    suservo_channel.set_setpoint(suservo_values[i])
-                    suservo_values[i] += suservo_steps[i]
+                if self.ramp_suservos:
+                    self.suservo_writer.write_setpoints(
+                        self.suservo_writer_indices, suservo_values
+                    )
 
-                    delay_mu(t_one_rtio_cycle_mu)
+                for i in range(len(suservo_values)):
+                    suservo_values[i] += suservo_steps[i]
 
                 t_total_used_mu = now_mu() - t_start_this_step_mu
 
@@ -1,16 +1,19 @@
 import logging
-from typing import Optional
+from typing import List, Optional
 
+import numpy as np
 from artiq.coredevice.core import Core
-from artiq.coredevice.sampler import Sampler
+from artiq.coredevice.sampler import Sampler, adc_mu_to_volt
 from artiq.coredevice.suservo import Channel as SUServoChannel
 from artiq.coredevice.suservo import SUServo
 from artiq.experiment import EnumerationValue
-from artiq.experiment import kernel
+from artiq.experiment import TFloat, TInt32, TList, delay_mu, host_only, kernel
+from artiq.language.units import us
 from ndscan.experiment import Fragment
 from ndscan.experiment.parameters import IntParam
 from ndscan.experiment.parameters import IntParamHandle
 from repository.utils.get_local_devices import get_local_devices
+from repository.utils.suservo_registry import claim_suservo_init
 
 logger = logging.getLogger(__name__)
 
@@ -24,14 +27,98 @@ class ReadADC(Fragment):
     single reading from an ADC, abstracting away the details. Currently, the
     only possible ADC types are Samplers and SUServos - see
     :class:`~.ReadSamplerADC` and :class:`~.ReadSUServoADC`.
+
+    On top of single readings, the interface provides averaged readings
+    (:meth:`read_adc_averaged`), boxcar-decimated traces
+    (:meth:`read_adc_decimated`) and captures of every channel of the ADC
+    (:meth:`read_all_channels` / :meth:`read_all_channels_averaged`). These
+    loop on the core device and write into caller-provided lists, so consumers
+    don't have to.
+
+    Readings are separated by `sample_spacing` so that each one sees a fresh
+    ADC conversion. Each reading waits for the data to come back from the ADC,
+    which uses up the slack, so the spacing must also leave the core device
+    time to prepare the next one - the default of 20 us does. Implementations
+    may advance the timeline in each reading too (see
+    :class:`~.ReadSUServoADC`), so the actual spacing is `sample_spacing` plus
+    that advance, and each method advances the timeline by this much per
+    reading.
     """
 
+    # Number of input channels of the ADC
+    NUM_CHANNELS = 8
+
     def build_fragment(self, *args, **kwargs):
         raise NotImplementedError
 
     def read_adc(self) -> float:
         raise NotImplementedError
 
+    def read_all_channels(self, data: List[float]):
+        """Read every channel of the ADC into `data`, of length NUM_CHANNELS"""
+        raise NotImplementedError
+
+    @kernel
+    def read_adc_averaged(
+        self, num_samples: TInt32 = 1, sample_spacing: TFloat = 20 * us
+    ) -> TFloat:
+        """Average `num_samples` readings"""
+        if num_samples < 1:
+            raise ValueError("Need at least one sample")
+
+        sample_spacing_mu = self.core.seconds_to_mu(sample_spacing)
+
+        total = 0.0
+        for _ in range(num_samples):
+            total += self.read_adc()
+            delay_mu(sample_spacing_mu)
+
+        return total / float(num_samples)
+
+    @kernel
+    def read_adc_decimated(
+        self,
+        data: TList(TFloat),
+        decimation: TInt32 = 1,
+        sample_spacing: TFloat = 20 * us,
+    ):
+        """
+        Fill `data` with a trace in which each point is the boxcar average of
+        `decimation` consecutive readings
+        """
+        for i in range(len(data)):
+            data[i] = self.read_adc_averaged(decimation, sample_spacing)
+
+    @kernel
+    def read_all_channels_averaged(
+        self,
+        data: TList(TFloat),
+        num_samples: TInt32 = 1,
+        sample_spacing: TFloat = 20 * us,
+    ):
+        """
+        Fill `data` (of length NUM_CHANNELS) with the average of `num_samples`
+        readings of every channel
+        """
+        if num_samples < 1:
+            raise ValueError("Need at least one sample")
+        if len(data) != self.NUM_CHANNELS:
+            raise ValueError("Output array is wrong size")
+
+        sample_spacing_mu = self.core.seconds_to_mu(sample_spacing)
+
+        for ch in range(self.NUM_CHANNELS):
+            data[ch] = 0.0
+
+        for _ in range(num_samples):
+            self.read_all_channels(self.channel_buffer)
+            for ch in range(self.NUM_CHANNELS):
+                data[ch] += self.channel_buffer[ch]
+            delay_mu(sample_spacing_mu)
+
+        for ch in range(self.NUM_CHANNELS):
+            data[ch] /= float(num_samples)
+
 
 class ReadSamplerADC(ReadADC):
     """
@@ -103,6 +190,9 @@ class ReadSamplerADC(ReadADC):
 
         self.debug_mode = logger.isEnabledFor(logging.DEBUG)
 
+        # Preallocated buffer for a reading of every channel
+        self.channel_buffer = [0.0] * self.NUM_CHANNELS
+
         # %% Kernel invariants
         kernel_invariants = getattr(self, "kernel_invariants", set())
         self.kernel_invariants = kernel_invariants | {"debug_mode"}
@@ -132,16 +222,24 @@ class ReadSamplerADC(ReadADC):
 
     @kernel
     def read_adc(self):
-        samples = [0.0] * 8
-        self.sampler_device.sample(samples)
+        self.sampler_device.sample(self.channel_buffer)
 
-        return samples[self.sampler_channel]
+        return self.channel_buffer[self.sampler_channel]
+
+    @kernel
+    def read_all_channels(self, data: TList(TFloat)):
+        self.sampler_device.sample(data)
 
 
 class ReadSUServoADC(ReadADC):
     """
     Reads the voltage on a SUServo input channel
 
+    Each read of the servo memory uses up all of the slack, so each one is
+    preceded by a 20 us delay. This means that every reading advances the
+    timeline by 20 us, and :meth:`read_all_channels` by 20 us per channel,
+    on top of any `sample_spacing`.
+
     The channel to be read is passed as arguments to :meth:`.build_fragment`, e.g.::
 
         self.setattr_fragment(
@@ -158,6 +256,18 @@ class ReadSUServoADC(ReadADC):
         self.suservo_channel: SUServoChannel = suservo_channel
         self.suservo_profile_number = suservo_profile_number
 
+        # Preallocated buffer for a reading of every channel
+        self.channel_buffer = [0.0] * self.NUM_CHANNELS
+
+        # Reads of the servo memory wait for the RTIO counter to reach the
+        # cursor, using up all of the slack, so each one is preceded by this
+        # much to give the core device time to issue it
+        self.read_slack_mu = np.int64(self.core.seconds_to_mu(20 * us))
+
+        # %% Kernel invariants
+        kernel_invariants = getattr(self, "kernel_invariants", set())
+        self.kernel_invariants = kernel_invariants | {"read_slack_mu"}
+
     def host_setup(self):
         super().host_setup()
 
@@ -169,7 +279,8 @@ class ReadSUServoADC(ReadADC):
         if self.suservo_profile_number == -1:
             self.suservo_profile_number = self.suservo_channel_number
 
-        self.suservo_has_been_setup = False
+        # Leave the SUServo alone if another fragment will initiate it
+        self.suservo_has_been_setup = not claim_suservo_init(self.suservo_device)
 
     @kernel
     def device_setup(self) -> None:
@@ -182,8 +293,52 @@ class ReadSUServoADC(ReadADC):
 
     @kernel
     def read_adc(self):
+        """
+        Read the voltage on this channel
+
+        This method advances the timeline by 20 us, before the read.
+        """
+        delay_mu(self.read_slack_mu)
         return self.suservo_device.get_adc(self.suservo_channel_number)
 
+    @kernel
+    def read_all_channels(self, data: TList(TFloat)):
+        """
+        Read every ADC channel into `data`, of length NUM_CHANNELS
+
+        This method advances the timeline by 20 us before each read, i.e. by
+        160 us in total.
+        """
+        if len(data) != self.NUM_CHANNELS:
+            raise ValueError("Output array is wrong size")
+
+        for ch in range(self.NUM_CHANNELS):
+            delay_mu(self.read_slack_mu)
+            data[ch] = self.suservo_device.get_adc(ch)
+
+    @kernel
+    def read_adc_mu(self):
+        """
+        Read the raw ADC value, without the conversion to volts
+
+        Use :meth:`adc_mu_to_volts` to convert the readings on the host. This
+        method advances the timeline by 20 us, before the read.
+        """
+        delay_mu(self.read_slack_mu)
+        return self.suservo_device.get_adc_mu(self.suservo_channel_number)
+
+    @host_only
+    def adc_mu_to_volts(self, data_mu):
+        """Convert (an array of) raw readings from :meth:`read_adc_mu` to volts"""
+        gain = (self.suservo_device.gains >> (2 * self.suservo_channel_number)) & 0b11
+        return adc_mu_to_volt(np.asarray(data_mu), gain)
+
     @kernel
     def read_ctrl_signal(self):
+        """
+        Read the control signal (y) of this channel's profile
+
+        This method advances the timeline by 20 us, before the read.
+        """
+        delay_mu(self.read_slack_mu)
         return self.suservo_channel.get_y(self.suservo_profile_number)
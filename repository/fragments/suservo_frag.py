@@ -1,26 +1,31 @@
 import logging
-from typing import Set
 
 from artiq.coredevice.core import Core
 from artiq.coredevice.suservo import Channel
 from artiq.coredevice.suservo import SUServo, T_CYCLE, COEFF_SHIFT, COEFF_WIDTH
-from artiq.coredevice.urukul import CPLD  # noqa F401
+from artiq.coredevice.urukul import CPLD
 from artiq.experiment import (
-    delay,
-    at_mu,
-    now_mu,
     kernel,
-    rpc,
     TBool,
     TFloat,
     TInt32,
     MHz,
-    ms,
 )
 from ndscan.experiment import Fragment
 from numpy import int32
 
 from repository.models.devices import SUServoedBeam
+from repository.utils.kernel_trace import KernelTrace, get_kernel_trace
+from repository.utils.suservo_registry import (
+    UrukulAttenuationCache,
+    claim_suservo_init,
+    get_attenuation_cache,
+)
+
+# Attenuation used for Urukul channels without a SUServoedBeam default
+MAX_ATTENUATION = 31.5
+
+logger = logging.getLogger(__name__)
 
 
 class SUServoFrag(Fragment):
@@ -46,14 +51,11 @@ class SUServoFrag(Fragment):
     changes the attenuation of one - i.e. all SUServo outputs that share an
     Urukul with the one being written and that have not had their attenuation
     set during the current ARTIQ experiment will have their attenuations reset.
+    The register is shadowed by a
+    :class:`~repository.utils.suservo_registry.UrukulAttenuationCache` shared by
+    all fragments in the experiment, so each change is a single SPI write.
     """
 
-    # A set of which suservos have been initiated, stored as a class variable
-    # so that suservo devices are only initiated once. This is a set of ARTIQ
-    # channels that represent suservos which have been initiated during this
-    # EnvExperiment
-    initiated_suservos: Set[int] = set()
-
     def build_fragment(self, channel: str):
         self.setattr_device("core")
         self.core: Core
@@ -61,12 +63,15 @@ class SUServoFrag(Fragment):
         self.channel = channel
 
         # Kernel variables
-        self.debug_enabled = logging.getLogger().getEffectiveLevel() >= logging.DEBUG
+        self.debug_enabled = logger.isEnabledFor(logging.INFO)
         self.first_run = True
 
+        # Debug events are recorded into a trace shared by the whole experiment
+        self.trace: KernelTrace = get_kernel_trace(self.core)
+
         # %% Kernel invariants
         kernel_invariants = getattr(self, "kernel_invariants", set())
-        self.kernel_invariants = kernel_invariants | {"debug_enabled"}
+        self.kernel_invariants = kernel_invariants | {"debug_enabled", "trace"}
 
     def host_setup(self):
         super().host_setup()
@@ -74,27 +79,23 @@ class SUServoFrag(Fragment):
         self.suservo_channel: Channel = self.get_device(self.channel)
         self.suservo: SUServo = self.suservo_channel.servo
 
-        # We pull default atts on this cpld to avoid clobbering their atts
-        # in reset_all_attenuations. We assume that all suservo_chs are ordered
-        # properly by channel# so that for each set of 4 they share a cpld
-
-        # Find the default attenuations from SUServoedBeams
-        beams = [
-            (dev.name, dev.suservo_device, dev.attenuation)
-            for dev in SUServoedBeam.all().values()
-        ]
-        minch = min([self.get_device(dev[1]).channel for dev in beams])
-        # Assume cplds are logically chunked by channel number
-        start_ch = (self.suservo_channel.channel - minch) // 4 * 4
-        # our number inside the group of 4
-        self.channel_index_within_group = (self.suservo_channel.channel - minch) % 4
-        # we now want this and the next 3 channels
-        self.beams = beams[start_ch : start_ch + 4]
-        if self.debug_enabled:
-            logging.info(
-                "Default beams: %s",
-                self.beams,
-            )
+        # Only the first fragment in this experiment to claim a SUServo will
+        # initiate it - decided here so that device_setup needs no RPCs
+        self.needs_suservo_init = claim_suservo_init(self.suservo)
+
+        # Share a shadow of this Urukul's attenuation register with every other
+        # fragment that uses it. It's seeded with the SUServoedBeam defaults so
+        # that channels which this experiment doesn't touch aren't clobbered
+        cpld: CPLD = self.suservo_channel.dds.cpld
+        default_atts = [MAX_ATTENUATION] * 4
+        for beam in SUServoedBeam.values():
+            beam_channel: Channel = self.get_device(beam.suservo_device)
+            if beam_channel.dds.cpld is cpld:
+                default_atts[beam_channel.servo_channel % 4] = beam.attenuation
+        self.att_cache: UrukulAttenuationCache = get_attenuation_cache(
+            cpld, default_atts
+        )
+        self.attenuator_channel: int = self.suservo_channel.servo_channel % 4
 
         # These are conventions in the AION lab:
         self.sampler_channel: int = self.suservo_channel.servo_channel
@@ -104,47 +105,73 @@ class SUServoFrag(Fragment):
         self.kernel_invariants.add("suservo")
         self.kernel_invariants.add("sampler_channel")
         self.kernel_invariants.add("suservo_profile")
-        self.kernel_invariants.add("beams")
+        self.kernel_invariants.add("att_cache")
+        self.kernel_invariants.add("attenuator_channel")
+        self.kernel_invariants.add("needs_suservo_init")
 
-    @kernel
-    def calc_atts_reg(self, att):
-        # We have to write all 4 channels at once due to hardware constraints.
-        # We therefore need to use the defaults for everything but ourselves
-        reg = 0
-        for i in range(4):
-            delay(1 * ms)
-            reg += self.suservo.cplds[0].att_to_mu(
-                self.beams[i][2] if i != self.channel_index_within_group else att
-            ) << (i * 8)
-        return reg
-
-    @rpc
-    def mark_suservo_initiated(self, suservo_channel: TInt32) -> TBool:
-        """
-        Check whether the given suservo has been initiated and return True if it
-        has. In either case, mark it as now having been initiated
+        self._register_trace_events()
 
-        This is an RPC so that we can use python features like class members to
-        communicate between instances. This could be done purely on the core
-        using e.g. a singleton class, but that's more complex. Here I'll pay the
-        few ms penalty for keeping the code simpler.
-        """
-        out = suservo_channel in self.__class__.initiated_suservos
-        self.__class__.initiated_suservos.add(suservo_channel)
-        return out
+    def _register_trace_events(self):
+        register = self.trace.register
+        name = self.channel
+        profile = self.suservo_profile
+
+        self.trace_init = register(logger, f"Initiating suservo {name} -> enabled")
+        self.trace_skip_init = register(
+            logger, f"Skipping suservo {name} - already initiated"
+        )
+        self.trace_set_att = register(
+            logger,
+            f"Setting the attenuator for {name} ({self.attenuator_channel}/4) to %s",
+        )
+        self.trace_reset_atts = register(
+            logger, f"Resetting the attenuators on the same Urukul as {name}"
+        )
+        self.trace_set_dds = register(
+            logger,
+            f"Setting DDS for {name} (profile={profile}): frequency=%s, offset=%s",
+        )
+        self.trace_set_pgia = register(
+            logger, f"Setting PGIA gain for {self.sampler_channel}: %s"
+        )
+        self.trace_set_setpoint = register(
+            logger, f"Setting setpoint for {name} (profile={profile}): %s V -> %s"
+        )
+        self.trace_set_channel_state = register(
+            logger,
+            f"Setting channel state for {name} (profile={profile}): "
+            "en_out=%s, enable_iir=%s",
+        )
+        self.trace_set_iir_gains = register(
+            logger, f"Setting iir params for {name} (profile={profile}): kp=%s, ki=%s"
+        )
+        self.trace_set_iir_limits = register(
+            logger,
+            f"Setting iir params for {name} (profile={profile}): "
+            "gain_limit=%s, delay=%s",
+        )
+        self.trace_set_y = register(
+            logger, f"Setting y for {name} (profile={profile}): y=%s"
+        )
+
+        self.kernel_invariants |= {
+            attr for attr in vars(self) if attr.startswith("trace_")
+        }
+
+    def host_cleanup(self):
+        # Log anything still in the trace when the kernel returned
+        self.trace.flush()
+
+        super().host_cleanup()
 
     @kernel
     def device_setup(self):
         self.device_setup_subfragments()
 
         # Initiate the suservo itself (i.e. all four channels)
-        if self.first_run and not self.mark_suservo_initiated(self.suservo.channel):
+        if self.first_run and self.needs_suservo_init:
             if self.debug_enabled:
-                logging.info(
-                    "Initiating suservo %s = artiq channel 0x%x -> enabled",
-                    self.channel,
-                    self.suservo.channel,
-                )
+                self.trace.record(self.trace_init)
 
             self.core.break_realtime()
             self.suservo.init()
@@ -152,10 +179,7 @@ class SUServoFrag(Fragment):
 
         else:
             if self.debug_enabled:
-                logging.info(
-                    "Skipping suservo %s  - already initiated",
-                    self.channel,
-                )
+                self.trace.record(self.trace_skip_init)
 
         if self.first_run:
             self.first_run = False
@@ -165,6 +189,22 @@ class SUServoFrag(Fragment):
             # a deterministic initialisation
             self.set_pgia_gain_mu(0)
 
+        # Ship the events recorded so far, before any time-critical code runs
+        self.flush_trace()
+
+    @kernel
+    def flush_trace(self):
+        """
+        Ship the debug events recorded since the last flush to the host
+
+        This is a single async RPC, and does nothing unless debugging is
+        enabled. Call it at the end of the caller's ``run_once`` so that the
+        events of each scan point are logged as it runs, rather than only when
+        the buffer fills up or the experiment finishes.
+        """
+        if self.debug_enabled:
+            self.trace.flush()
+
     @kernel
     def log_channel(self, profile_num: int32 = -1):
         """
@@ -222,14 +262,14 @@ class SUServoFrag(Fragment):
         self.core.break_realtime()
         status = self.suservo.get_status()
         # Bit 0: enabled, bit 1: done, bits 8-15: channel clip indicators.
-        logging.info("a1=%s, b0=%s, b1=%s", a1, b0, b1)
-        logging.info(
+        logger.info("a1=%s, b0=%s, b1=%s", a1, b0, b1)
+        logger.info(
             "SUServo enabled=%s,done=%s,clipping=%s",
             bool(status & 1),
             bool(status & 2),
             status >> 8,
         )
-        logging.info(
+        logger.info(
             "Profile %s (y=%s): freq=%s, phase=%s, sampler_channel=%s, delay=%s, \
                 offset=%s, kp=%s, ki=%s, gain_limit=%s",
             profile_num,
@@ -262,27 +302,19 @@ class SUServoFrag(Fragment):
         """
         Set only the attenuator for this channel on this Urukul
 
-        If reset_all_attenuations hasn't been called this will clobber
-        the other channels on the same Urukul
+        The other channels on the same Urukul are rewritten from the shared
+        attenuation cache, i.e. they keep their defaults unless another fragment
+        has changed them during this experiment. If `needs_reset` is set, they
+        are reset to their defaults regardless.
         """
         if needs_reset:
             self._reset_all_attenuations(attenuation)
             return
 
-        attenuator_channel = self.suservo_channel.servo_channel % 4
-
         if self.debug_enabled:
-            slack_mu = now_mu() - self.core.get_rtio_counter_mu()
-            logging.info(
-                "Setting the attenuator for %s (%s/4) to %f",
-                self.channel,
-                attenuator_channel,
-                attenuation,
-            )
-            at_mu(self.core.get_rtio_counter_mu() + slack_mu)
-
-        cpld = self.suservo_channel.dds.cpld  # type: CPLD
-        cpld.set_att(attenuator_channel, attenuation)
+            self.trace.record(self.trace_set_att, attenuation)
+
+        self.att_cache.set_att(self.attenuator_channel, attenuation)
 
     @kernel
     def _reset_all_attenuations(self, attenuation: TFloat):
@@ -290,19 +322,14 @@ class SUServoFrag(Fragment):
         Set the required attenuation but also reset the attenuations of all
         other channels on the same Urukul to their defaults
 
-        This is annoyingly required because there is no way of getting
-        information out from the SUServo gateware about the current settings, so
-        they have to be reset on each run.
+        There is no way of getting information out from the SUServo gateware
+        about the current settings, so the defaults come from the shared
+        attenuation cache rather than from the hardware.
         """
         if self.debug_enabled:
-            slack_mu = now_mu() - self.core.get_rtio_counter_mu()
-            logging.warning("Setting the attenuator for all channels to their defaults")
-            at_mu(self.core.get_rtio_counter_mu() + slack_mu)
-
-        cpld = self.suservo_channel.dds.cpld  # type: CPLD
-        cpld.get_att_mu()
+            self.trace.record(self.trace_reset_atts)
 
-        cpld.set_all_att_mu(self.calc_atts_reg(attenuation))
+        self.att_cache.set_att(self.attenuator_channel, attenuation, reset_others=True)
 
     @kernel
     def set_suservo(
@@ -362,16 +389,7 @@ class SUServoFrag(Fragment):
             offset (TFloat): IIR offset (negative setpoint) in units of full scale
         """
         if self.debug_enabled:
-            slack_mu = now_mu() - self.core.get_rtio_counter_mu()
-            logging.info(
-                "Setting DDS for %s (profile=%s): frequency=%s, offset=%s, phase=%s",
-                self.channel,
-                profile,
-                frequency,
-                offset,
-                phase,
-            )
-            at_mu(self.core.get_rtio_counter_mu() + slack_mu)
+            self.trace.record(self.trace_set_dds, frequency, offset)
 
         self.suservo_channel.set_dds(
             profile=profile,
@@ -388,13 +406,7 @@ class SUServoFrag(Fragment):
         See :meth:`artiq.coredevice.suservo.SUServo.set_pgia_mu` for details.
         """
         if self.debug_enabled:
-            slack_mu = now_mu() - self.core.get_rtio_counter_mu()
-            logging.info(
-                "Setting PGIA gain for %s: %s",
-                self.sampler_channel,
-                gain_mu,
-            )
-            at_mu(self.core.get_rtio_counter_mu() + slack_mu)
+            self.trace.record(self.trace_set_pgia, float(gain_mu))
 
         self.suservo.set_pgia_mu(self.sampler_channel, gain_mu)
 
@@ -411,15 +423,7 @@ class SUServoFrag(Fragment):
         offset = self.setpoint_to_offset(new_setpoint)
 
         if self.debug_enabled:
-            slack_mu = now_mu() - self.core.get_rtio_counter_mu()
-            logging.info(
-                "Setting setpoint for %s (profile=%s): %s V -> %s",
-                self.channel,
-                self.suservo_profile,
-                new_setpoint,
-                offset,
-            )
-            at_mu(self.core.get_rtio_counter_mu() + slack_mu)
+            self.trace.record(self.trace_set_setpoint, new_setpoint, offset)
 
         self.suservo_channel.set_dds_offset(profile=self.suservo_profile, offset=offset)
 
@@ -435,15 +439,7 @@ class SUServoFrag(Fragment):
         iir = 1 if enable_iir else 0
 
         if self.debug_enabled:
-            slack_mu = now_mu() - self.core.get_rtio_counter_mu()
-            logging.info(
-                "Setting channel state for %s (profile=%s): en_out=%s, enable_iir=%s",
-                self.channel,
-                self.suservo_profile,
-                out,
-                iir,
-            )
-            at_mu(self.core.get_rtio_counter_mu() + slack_mu)
+            self.trace.record(self.trace_set_channel_state, float(out), float(iir))
 
         self.suservo_channel.set(
             en_out=out,
@@ -458,19 +454,8 @@ class SUServoFrag(Fragment):
         details. Note all of kp,ki,gain_limit should usually be negative.
         """
         if self.debug_enabled:
-            slack_mu = now_mu() - self.core.get_rtio_counter_mu()
-            logging.info(
-                "Setting iir params for %s (profile= %s): sampler_channel=%s,\
-                    kp=%s, ki=%s, gain_limit=%s, delay=%s",
-                self.channel,
-                self.suservo_profile,
-                self.sampler_channel,
-                kp,
-                ki,
-                gain_limit,
-                delay,
-            )
-            at_mu(self.core.get_rtio_counter_mu() + slack_mu)
+            self.trace.record(self.trace_set_iir_gains, kp, ki)
+            self.trace.record(self.trace_set_iir_limits, gain_limit, delay)
 
         self.set_y(0.0)  # clear integrator
         self.suservo_channel.set_iir(
@@ -481,13 +466,6 @@ class SUServoFrag(Fragment):
     def set_y(self, amplitude: TFloat):
         """Set the amplitude of the channel"""
         if self.debug_enabled:
-            slack_mu = now_mu() - self.core.get_rtio_counter_mu()
-            logging.info(
-                "Setting y for %s (profile= %s): y=%s",
-                self.channel,
-                self.suservo_profile,
-                amplitude,
-            )
-            at_mu(self.core.get_rtio_counter_mu() + slack_mu)
+            self.trace.record(self.trace_set_y, amplitude)
 
         self.suservo_channel.set_y(profile=self.suservo_profile, y=amplitude)
@@ -0,0 +1,157 @@
+import logging
+from typing import List, Optional
+
+from artiq.coredevice.core import Core
+from artiq.coredevice.suservo import Channel as SUServoChannel
+from artiq.coredevice.suservo import COEFF_WIDTH, Y_FULL_SCALE_MU
+from artiq.experiment import TFloat, TInt32, TList, host_only, kernel, portable
+from ndscan.experiment import Fragment
+
+logger = logging.getLogger(__name__)
+
+
+class SUServoGroupWriter(Fragment):
+    """
+    Write setpoints, amplitudes and frequencies to several SUServo channels at
+    once
+
+    :class:`~repository.fragments.suservo_frag.SUServoFrag` handles a single
+    channel, so changing several beams together means a series of calls, each
+    repeating its unit conversions between RTIO writes. This fragment instead
+    covers a group of channels (all 8 ``suservo_ch*`` by default), converts
+    everything to machine units first and then issues the profile writes back
+    to back, so that simultaneous beam changes are separated by only the
+    minimum SUServo write spacing.
+
+    Channels are addressed by their index within the group - use
+    :meth:`index_of` on the host to look one up from a device name or alias.
+    As elsewhere in the AION lab, each channel uses the profile with the same
+    number as its servo channel.
+
+    Values are passed as arrays from the kernel to :meth:`write_setpoints` /
+    :meth:`write_profiles`, since they are usually parameters which may be
+    scanned or ramped. The conversions run in the kernel, but all of them
+    happen before the first write.
+
+    Example usage::
+
+        self.setattr_fragment("suservo_writer", SUServoGroupWriter)
+        self.suservo_writer: SUServoGroupWriter
+
+        ...
+
+        @kernel
+        def ramp_down(self):
+            self.suservo_writer.write_setpoints([0, 1], [0.5, 0.25])
+    """
+
+    def build_fragment(self, channels: Optional[List[str]] = None):
+        self.setattr_device("core")
+        self.core: Core
+
+        if channels is None:
+            channels = [f"suservo_ch{i}" for i in range(8)]
+
+        self.channel_names = channels
+        self.channels: List[SUServoChannel] = [self.get_device(c) for c in channels]
+        self.num_channels = len(self.channels)
+
+        # %% Kernel invariants
+        kernel_invariants = getattr(self, "kernel_invariants", set())
+        self.kernel_invariants = kernel_invariants | {"channels", "num_channels"}
+
+    @host_only
+    def index_of(self, channel_name: str) -> int:
+        """
+        Get the index within this group of a SUServo channel, given its device
+        name or an alias of it
+        """
+        # Aliases give separate device objects, so compare the servo channels
+        device: SUServoChannel = self.get_device(channel_name)
+        for i, channel in enumerate(self.channels):
+            if (
+                channel.servo is device.servo
+                and channel.servo_channel == device.servo_channel
+            ):
+                return i
+        raise KeyError(f"{channel_name} is not in this SUServoGroupWriter")
+
+    @portable
+    def setpoint_to_offset_mu(self, setpoint_v: TFloat) -> TInt32:
+        """
+        Convert a setpoint in volts to an IIR offset in machine units
+
+        This uses the same convention as
+        :meth:`~repository.fragments.suservo_frag.SUServoFrag.setpoint_to_offset`,
+        i.e. full scale is 10 V and the offset is the negative setpoint.
+        """
+        return int(round(-1.0 * setpoint_v / 10.0 * (1 << COEFF_WIDTH - 1)))
+
+    @portable
+    def amplitude_to_y_mu(self, amplitude: TFloat) -> TInt32:
+        """Convert an amplitude from 0 to 1 to a y-value in machine units"""
+        y_mu = int(round(amplitude * Y_FULL_SCALE_MU))
+        if y_mu < 0 or y_mu > Y_FULL_SCALE_MU:
+            raise ValueError("Invalid SUServo y-value!")
+        return y_mu
+
+    @portable
+    def frequency_to_ftw(self, index: TInt32, frequency: TFloat) -> TInt32:
+        """Convert a frequency in Hz to a tuning word for the given channel"""
+        return self.channels[index].dds.frequency_to_ftw(frequency)
+
+    @kernel
+    def write_setpoints(self, indices: TList(TInt32), setpoints_v: TList(TFloat)):
+        """
+        Write new setpoints (in volts) to the given channels
+
+        All conversions happen before the first write, so the offsets are
+        written back to back. This method advances the timeline by one SUServo
+        write per channel.
+        """
+        offsets_mu = [0] * len(indices)
+        for i in range(len(indices)):
+            offsets_mu[i] = self.setpoint_to_offset_mu(setpoints_v[i])
+
+        for i in range(len(indices)):
+            channel = self.channels[indices[i]]
+            channel.set_dds_offset_mu(channel.servo_channel, offsets_mu[i])
+
+    @kernel
+    def write_profiles(
+        self,
+        indices: TList(TInt32),
+        setpoints_v: TList(TFloat),
+        amplitudes: TList(TFloat),
+        frequencies: TList(TFloat),
+    ):
+        """
+        Write setpoints (in volts), amplitudes (0 to 1) and frequencies (in Hz)
+        to the given channels
+
+        All conversions happen before the first write, so the profiles are
+        written back to back. This method advances the timeline by five SUServo
+        writes per channel: one for the y-value and four for the profile.
+        """
+        offsets_mu = [0] * len(indices)
+        ys_mu = [0] * len(indices)
+        ftws = [0] * len(indices)
+        for i in range(len(indices)):
+            offsets_mu[i] = self.setpoint_to_offset_mu(setpoints_v[i])
+            ys_mu[i] = self.amplitude_to_y_mu(amplitudes[i])
+            ftws[i] = self.frequency_to_ftw(indices[i], frequencies[i])
+
+        self._write_profiles_mu(indices, offsets_mu, ys_mu, ftws)
+
+    @kernel
+    def _write_profiles_mu(
+        self,
+        indices: TList(TInt32),
+        offsets_mu: TList(TInt32),
+        ys_mu: TList(TInt32),
+        ftws: TList(TInt32),
+    ):
+        for i in range(len(indices)):
+            channel = self.channels[indices[i]]
+            channel.set_y_mu(channel.servo_channel, ys_mu[i])
+            channel.set_dds_mu(channel.servo_channel, ftws[i], offsets_mu[i])
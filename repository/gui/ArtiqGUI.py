@@ -21,11 +21,16 @@ from PyQt5.QtWidgets import (
     QVBoxLayout,
     QTextEdit,
     QPushButton,
+    QTableView,
+    QSplitter,
+    QAbstractItemView,
 )
+from PyQt5.QtCore import Qt
 
 # include the artiq path by slicing our current path to the root
 sys.path.append(__file__.split("artiq")[0] + "artiq")
 from repository.gui.components.ScientificSpin import ScientificSpin  # noqa
+from repository.gui.components.DatasetModel import DatasetModel  # noqa
 
 
 class GUIClient:
@@ -40,6 +45,8 @@ class GUIClient:
         for subscriber in ["dataset", "explist", "schedule", "dlcpro", "booster"]:
             self.__dict__[f"{subscriber}"] = dict()
             self.__dict__[f"{subscriber}_callbacks"] = []
+            # called with each sync_struct mod, for incremental updates
+            self.__dict__[f"{subscriber}_mod_callbacks"] = []
 
     async def connect(self):
         """Initialize connections."""
@@ -50,31 +57,44 @@ class GUIClient:
             loop.create_task(self.connect_rpc(target))
 
         # Connect subscribers
-        for name, db, callbacks, port in [
-            ("datasets", self.dataset, self.dataset_callbacks, self.port_notify),
-            ("explist", self.explist, self.explist_callbacks, self.port_notify),
-            ("schedule", self.schedule, self.schedule_callbacks, self.port_notify),
-            ("DLCProState", self.dlcpro, self.dlcpro_callbacks, 3271),
+        for name, target, port in [
+            ("datasets", "dataset", self.port_notify),
+            ("explist", "explist", self.port_notify),
+            ("schedule", "schedule", self.port_notify),
+            ("DLCProState", "dlcpro", 3271),
         ]:
-            loop.create_task(self.connect_subscriber(name, db, callbacks, port))
+            loop.create_task(
+                self.connect_subscriber(
+                    name,
+                    self.__dict__[target],
+                    self.__dict__[f"{target}_callbacks"],
+                    port,
+                    mod_callbacks=self.__dict__[f"{target}_mod_callbacks"],
+                )
+            )
 
         loop.create_task(self.connect_booster())
 
         logging.info("Connecting to services...")
 
     async def connect_subscriber(
-        self, name, db: dict, callbacks, port=None, server=None
+        self, name, db: dict, callbacks, port=None, server=None, mod_callbacks=()
     ):
         port = self.port_notify if port is None else port
         server = self.server if server is None else server
 
         def _create(data):
             logging.debug(f"New {name}")
+            # Replace rather than merge, so entries deleted while we were
+            # disconnected don't linger
+            db.clear()
             db.update(data)
             return db
 
         def _update(mod):
             logging.debug(f"New {name} mod")
+            for cb in mod_callbacks:
+                cb(mod)
             for cb in callbacks:
                 cb()
             return
@@ -155,6 +175,12 @@ class GUIClient:
         self.__dict__[f"{target}_callbacks"].append(cb)
         cb()
 
+    def register_mod_callback(self, target, cb):
+        """Register a callback to be called with every sync_struct mod of a
+        subscription - it is called with an "init" mod straight away"""
+        self.__dict__[f"{target}_mod_callbacks"].append(cb)
+        cb({"action": "init"})
+
     async def _submit_by_content(self, content, exp_class_name, title):
         scheduler: Scheduler = self.rpc_clients["schedule"]
         expid = {
@@ -221,10 +247,14 @@ class MainWindow(QWidget):
         ]:
             label = QLabel(f"{name}::")
             label.mousePressEvent = lambda *args, fn=fn: fn()
-            self.__dict__[f"{name}_text"] = QTextEdit()
-            self.__dict__[f"{name}_text"].setReadOnly(True)
             layout.addWidget(label)
-            layout.addWidget(self.__dict__[f"{name}_text"])
+
+            if name == "dataset":
+                layout.addWidget(self.make_dataset_browser())
+            else:
+                self.__dict__[f"{name}_text"] = QTextEdit()
+                self.__dict__[f"{name}_text"].setReadOnly(True)
+                layout.addWidget(self.__dict__[f"{name}_text"])
             fn()
 
             if name == "dataset":
@@ -236,11 +266,51 @@ class MainWindow(QWidget):
         self.layout = layout
         self.setLayout(self.layout)
 
+    def make_dataset_browser(self):
+        """Table of datasets with the full value of the selected one below
+
+        The table is updated row by row from the dataset mods, and values are
+        only formatted in full when selected, so that large arrays such as
+        camera images don't stall the GUI.
+        """
+        self.dataset_model = DatasetModel(self.client.dataset)
+
+        self.dataset_view = QTableView()
+        self.dataset_view.setModel(self.dataset_model)
+        self.dataset_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.dataset_view.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.dataset_view.horizontalHeader().setStretchLastSection(True)
+        self.dataset_view.verticalHeader().hide()
+        self.dataset_view.selectionModel().currentRowChanged.connect(
+            lambda *args: self.show_dataset_value()
+        )
+
+        self.dataset_value = QTextEdit()
+        self.dataset_value.setReadOnly(True)
+
+        splitter = QSplitter(Qt.Vertical)
+        splitter.addWidget(self.dataset_view)
+        splitter.addWidget(self.dataset_value)
+        return splitter
+
     def update_dataset(self):
-        text = ""
-        for key, value in self.client.dataset.items():
-            text += f"{key}\n\t{value}\n"
-        self.dataset_text.setText(text)
+        self.dataset_model.apply_mod({"action": "init"})
+        self.show_dataset_value()
+
+    def on_dataset_mod(self, mod):
+        self.dataset_model.apply_mod(mod)
+
+        # Keep the detail pane current if the selected dataset changed
+        key = self.dataset_model.key(self.dataset_view.currentIndex())
+        changed = mod["path"][0] if mod.get("path") else mod.get("key")
+        if key is not None and (mod["action"] == "init" or changed == key):
+            self.show_dataset_value()
+
+    def show_dataset_value(self):
+        key = self.dataset_model.key(self.dataset_view.currentIndex())
+        self.dataset_value.setText(
+            "" if key is None else self.dataset_model.value_text(key)
+        )
 
     def update_explist(self):
         text = ""
@@ -261,8 +331,9 @@ class MainWindow(QWidget):
         self.booster_text.setText(str(self.client.booster))
 
     def register_callbacks(self):
-        for target in ["dataset", "explist", "schedule", "dlcpro", "booster"]:
+        for target in ["explist", "schedule", "dlcpro", "booster"]:
             self.client.register_callback(target, getattr(self, f"update_{target}"))
+        self.client.register_mod_callback("dataset", self.on_dataset_mod)
 
     def saveDataset(self):
         data = {key: val[1] for key, val in self.client.dataset.items()}
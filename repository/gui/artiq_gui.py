@@ -236,30 +236,11 @@ class PIDControl(QWidget):
         )
         top.addWidget(self.setpoint)
 
-        # if we are visible we want to update the ADC value
-        def update_adc():
-            if self.isVisible():
-                volt = self.manager.get_adc(ch)
-                pow = "?? <b>mW</b>"
-                g = self.manager.calib_gains[ch]
-                o = self.manager.calib_offsets[ch]
-                if g != 1.0 or o != 0.0:
-                    power = g * volt + o
-                    pow = f"{power if power >= 0.1 else power*1e3:.1f} \
-                        <b>{'mW' if power >= 0.1 else 'uW'}</b>"
-                self.adc_val.setText(
-                    f"{pow} | {volt:.2f} <b>V</b> | \
-                        {self.manager.get_y(ch)*100:.0f}%"
-                )
-
+        # Updated by SUServoGUI's poller while we are visible
         self.adc_val = QLabel("?? <b>mW</b> | ?? <b>V</b> | ??%")
         top.addStretch()
         top.addWidget(self.adc_val)
 
-        self.timer = QTimer()
-        self.timer.timeout.connect(lambda: update_adc())
-        self.timer.start(500)
-
         layout.addLayout(top)
         bottom = QHBoxLayout()
 
@@ -308,6 +289,16 @@ class PIDControl(QWidget):
         layout.addLayout(bottom)
         self.setLayout(layout)
 
+    def update_adc(self, volt, y):
+        pow = "?? <b>mW</b>"
+        g = self.manager.calib_gains[self.ch]
+        o = self.manager.calib_offsets[self.ch]
+        if g != 1.0 or o != 0.0:
+            power = g * volt + o
+            pow = f"{power if power >= 0.1 else power*1e3:.1f} \
+                <b>{'mW' if power >= 0.1 else 'uW'}</b>"
+        self.adc_val.setText(f"{pow} | {volt:.2f} <b>V</b> | {y*100:.0f}%")
+
     def set(self):
         self.manager.set_iir(
             self.ch,
@@ -385,8 +376,8 @@ class SingleChannelSUServo(QWidget):
         self.tabs.addTab(freq, "DDS")
 
         # PID
-        pid = PIDControl(self.manager, ch=channel)
-        self.tabs.addTab(pid, "PID")
+        self.pid = PIDControl(self.manager, ch=channel)
+        self.tabs.addTab(self.pid, "PID")
 
         # Booster
         self.booster = BoosterControl(boostermanager, self.set_tab, ch=channel)
@@ -474,6 +465,17 @@ class SUServoGUI(QWidget):
     def __init__(self, manager):
         super().__init__()
         self.manager = manager
+
+        # Coalesce edits (e.g. dragging a slider) made within 50 ms of the first
+        # into a single kernel - the timer isn't restarted by later edits, so
+        # the GUI keeps up with continuous motion
+        self.flush_timer = QTimer()
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(50)
+        self.flush_timer.timeout.connect(self.manager.flush)
+        self.manager.schedule_flush = (
+            lambda: self.flush_timer.isActive() or self.flush_timer.start()
+        )
         self.setGeometry(self.x(), self.y(), self.minimumWidth(), self.minimumHeight())
         self.booster = BoosterTelemetry(self.update_booster)
         self.booster.set_telem_period(1)
@@ -524,6 +526,23 @@ class SUServoGUI(QWidget):
         # capture the keyboard numbers to enable/disable channels
         self.installEventFilter(self)
 
+        # Read every channel in one kernel per tick and hand the readings to
+        # the PID panels which are on screen
+        self.poll_timer = QTimer()
+        self.poll_timer.timeout.connect(self.poll_readings)
+        self.poll_timer.start(500)
+
+    def poll_readings(self):
+        visible = [ch.pid for ch in self.ch if ch.pid.isVisible()]
+        if not visible:
+            return
+
+        self.manager.read_all()
+        for pid in visible:
+            pid.update_adc(
+                self.manager.adc_readings[pid.ch], self.manager.y_readings[pid.ch]
+            )
+
     def eventFilter(self, obj, event):
         if (
             event.type() == event.KeyPress
@@ -0,0 +1,118 @@
+import bisect
+
+import numpy as np
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
+
+
+# Arrays with more elements than this are summarised by their shape and dtype
+SUMMARY_SIZE = 16
+# Longest text shown for a single value in the table
+MAX_TEXT = 100
+
+
+def dataset_value(entry):
+    """Get the value from a dataset DB entry, which is (persist, value, metadata)"""
+    if isinstance(entry, dict):
+        return entry.get("value")
+    if isinstance(entry, (tuple, list)) and len(entry) >= 2:
+        return entry[1]
+    return entry
+
+
+def summarise(value):
+    """Short text for a value, without formatting large arrays"""
+    if isinstance(value, (list, tuple)) and len(value) > SUMMARY_SIZE:
+        return f"{type(value).__name__} of length {len(value)}"
+    if isinstance(value, np.ndarray) and value.size > SUMMARY_SIZE:
+        return f"array {'x'.join(map(str, value.shape))} {value.dtype}"
+
+    text = repr(value)
+    if len(text) > MAX_TEXT:
+        text = text[: MAX_TEXT - 3] + "..."
+    return text
+
+
+class DatasetModel(QAbstractTableModel):
+    """Table of datasets kept up to date from the sync_struct mods of the
+    dataset DB
+
+    Feed every mod to :meth:`apply_mod`: only the rows it touches are updated,
+    and their summaries are only recomputed when they are next drawn. Use
+    :meth:`value_text` to format a full value on demand.
+    """
+
+    def __init__(self, datasets: dict, parent=None):
+        super().__init__(parent)
+        self.datasets = datasets
+        self.keys = sorted(datasets)
+        self._summaries = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.keys)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else 2
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return ["Name", "Value"][section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+
+        key = self.keys[index.row()]
+        if index.column() == 0:
+            return key
+
+        if key not in self._summaries:
+            self._summaries[key] = summarise(dataset_value(self.datasets.get(key)))
+        return self._summaries[key]
+
+    def key(self, index):
+        return self.keys[index.row()] if index.isValid() else None
+
+    def value_text(self, key):
+        """Format the full value of a dataset, e.g. for a detail pane"""
+        value = dataset_value(self.datasets.get(key))
+        if isinstance(value, np.ndarray):
+            return f"shape {value.shape}, dtype {value.dtype}\n{np.array2string(value)}"
+        return repr(value)
+
+    def apply_mod(self, mod):
+        """Update the rows touched by a sync_struct mod of the dataset DB"""
+        action = mod["action"]
+        if action == "init":
+            self.beginResetModel()
+            self.keys = sorted(self.datasets)
+            self._summaries.clear()
+            self.endResetModel()
+            return
+
+        if mod["path"]:
+            # A change inside a dataset's entry, e.g. mutate_dataset
+            self._changed(mod["path"][0])
+            return
+
+        key = mod["key"]
+        row = bisect.bisect_left(self.keys, key)
+        exists = row < len(self.keys) and self.keys[row] == key
+        if action == "setitem" and exists:
+            self._changed(key)
+        elif action == "setitem":
+            self.beginInsertRows(QModelIndex(), row, row)
+            self.keys.insert(row, key)
+            self.endInsertRows()
+        elif action == "delitem" and exists:
+            self.beginRemoveRows(QModelIndex(), row, row)
+            del self.keys[row]
+            self._summaries.pop(key, None)
+            self.endRemoveRows()
+
+    def _changed(self, key):
+        row = bisect.bisect_left(self.keys, key)
+        if row < len(self.keys) and self.keys[row] == key:
+            self._summaries.pop(key, None)
+            index = self.index(row, 1)
+            self.dataChanged.emit(index, index)
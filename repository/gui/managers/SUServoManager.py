@@ -6,6 +6,30 @@ from artiq.coredevice.ttl import TTLInOut
 
 import numpy as np
 
+from repository.utils.suservo_registry import get_attenuation_cache
+
+# Parts of a channel's state which can be written separately, as bit flags
+CHANNEL_GAIN = 1
+CHANNEL_DDS = 2
+CHANNEL_IIR = 4
+CHANNEL_STATE = 8
+CHANNEL_Y = 16
+CHANNEL_ALL = CHANNEL_GAIN | CHANNEL_DDS | CHANNEL_IIR | CHANNEL_STATE | CHANNEL_Y
+
+# The parts of a channel's state that depend on each per-channel dataset. The
+# offset is stored in volts, so its machine units depend on the gain too
+CHANNEL_FIELDS = {
+    "gains": CHANNEL_GAIN | CHANNEL_DDS,
+    "freqs": CHANNEL_DDS,
+    "offsets": CHANNEL_DDS,
+    "Ps": CHANNEL_IIR,
+    "Is": CHANNEL_IIR,
+    "Gls": CHANNEL_IIR,
+    "en_outs": CHANNEL_STATE,
+    "en_iirs": CHANNEL_STATE,
+    "ys": CHANNEL_Y,
+}
+
 
 class SUServoManager:  # {{{
     """
@@ -13,6 +37,16 @@ class SUServoManager:  # {{{
 
     It tries to load the state from the dataset provided
     if it doesn't exist it will create a new one
+
+    The setters (`set_freq`, `set_y`, `enable`, ...) only queue the change on
+    the host. Queued changes are applied by :meth:`flush`, which writes the
+    final values of the changed parts of every touched channel in a single
+    kernel and then updates each changed dataset with one `set_dataset`. The
+    servo overwrites y while its IIR is running, so y is only written to
+    channels whose IIR is off. Set `schedule_flush` to a
+    callable which arranges for :meth:`flush` to be called shortly, e.g. by
+    starting a single-shot timer, to coalesce GUI edits over that window -
+    otherwise every change is flushed immediately.
     """
 
     def __init__(
@@ -33,6 +67,21 @@ class SUServoManager:  # {{{
 
         assert len(self.channels) == 8, "There must be 8 channels per SUServo"
 
+        # The ADC channel fed into each servo channel's IIR
+        self.adcs = list(range(8))
+
+        # Latest readings from read_all()
+        self.adc_readings = [0.0] * 8
+        self.y_readings = [0.0] * 8
+
+        # Changes queued since the last flush()
+        self.schedule_flush = None
+        self.queued_datasets = set()
+        # The CHANNEL_* flags of the parts of each channel to be rewritten
+        self.queued_channels = [0] * 8
+        self.queued_atts = [False] * 8
+        self.queued_shutters = [False] * len(self.shutters)
+
         vals = [
             ("enabled", 1, None),
             ("gains", [0] * 8, None),
@@ -50,6 +99,7 @@ class SUServoManager:  # {{{
             ("calib_offsets", [0.0] * 8, "V"),
         ]
 
+        self.units = {dataset: unit for dataset, _, unit in vals}
         for dataset, default, unit in vals:
             temp = experiment.get_dataset(name + "." + dataset, default=default)
             # we set the values back so we are allowed to mutate then later
@@ -61,6 +111,12 @@ class SUServoManager:  # {{{
             )
             self.__dict__[dataset] = temp
 
+        # The attenuators can't be read back in SUServo mode, so shadow them
+        self.att_caches = [
+            get_attenuation_cache(cpld, self.atts[4 * i : 4 * i + 4])
+            for i, cpld in enumerate(self.suservo.cplds)
+        ]
+
         self.set_all()
 
     @kernel
@@ -78,6 +134,22 @@ class SUServoManager:  # {{{
         # delay(50 * us)
         return v
 
+    @kernel
+    def read_all(self):
+        """
+        Read all 8 ADCs and all 8 y values in one kernel
+
+        The results are left in `adc_readings` and `y_readings`, so pollers
+        need a single kernel per update rather than two per channel
+        """
+        self.core.break_realtime()
+        for ch in range(8):
+            self.adc_readings[ch] = self.suservo.get_adc(ch)
+            delay(20 * us)
+        for ch in range(8):
+            self.y_readings[ch] = self.channels[ch].get_y(ch)
+            delay(20 * us)
+
     @kernel
     def get_y(self, ch: np.int64):
         """
@@ -93,25 +165,118 @@ class SUServoManager:  # {{{
         # delay(50 * us)
         return y
 
+    def _queue(self, index, **values):
+        """Queue changes to entry `index` of the given datasets and the
+        hardware behind them, e.g. ``self._queue(ch, ys=0.5)``"""
+        for dataset, value in values.items():
+            self.__dict__[dataset][index] = value
+            self.queued_datasets.add(dataset)
+
+            if dataset == "atts":
+                self.queued_atts[index] = True
+            elif dataset == "en_shutters":
+                self.queued_shutters[index] = True
+            else:
+                self.queued_channels[index] |= CHANNEL_FIELDS[dataset]
+
+        if self.schedule_flush is None:
+            self.flush()
+        else:
+            self.schedule_flush()
+
+    def flush(self):
+        """Apply all queued changes in one kernel and update their datasets"""
+        if not self.queued_datasets:
+            return
+
+        datasets = self.queued_datasets
+        channels = self.queued_channels
+        atts = self.queued_atts
+        shutters = self.queued_shutters
+        self.queued_datasets = set()
+        self.queued_channels = [0] * 8
+        self.queued_atts = [False] * 8
+        self.queued_shutters = [False] * len(self.shutters)
+
+        self._apply_queued(channels, atts, shutters)
+
+        for dataset in sorted(datasets):
+            self.experiment.set_dataset(
+                self.name + "." + dataset,
+                self.__dict__[dataset],
+                persist=True,
+                unit=self.units[dataset],
+            )
+
     @kernel
-    def _mutate_and_set_float(self, dataset, variable, index, value):
-        """Mutate the dataset and change our internal store of the value
-        We have to pass both the dataset reference and local variable
-        as __dict__ access is illegal on kernel
-        """
-        self.experiment.mutate_dataset(self.name + "." + dataset, index, value)
-        variable[index] = value
-        delay(50 * ms)
+    def _apply_queued(self, channels, atts, shutters):
+        self.core.break_realtime()
+
+        for shutter in range(len(self.shutters)):
+            if shutters[shutter]:
+                self._write_shutter(shutter)
+
+        for ch in range(8):
+            fields = channels[ch]
+            if fields & CHANNEL_STATE:
+                # Disabling the IIR leaves whatever y it last computed
+                fields |= CHANNEL_Y
+            if self.en_iirs[ch]:
+                # A running IIR computes y itself, so writing one would only
+                # kick the lock
+                fields &= ~CHANNEL_Y
+
+            if fields:
+                self._write_channel(ch, fields)
+            if atts[ch]:
+                self.att_caches[ch // 4].set_att(ch % 4, self.atts[ch])
 
     @kernel
-    def _mutate_and_set_int(self, dataset, variable, index, value):
-        """Mutate the dataset and change our internal store of the value
-        We have to pass both the dataset reference and local variable
-        as __dict__ access is illegal on kernel
-        """
-        self.experiment.mutate_dataset(self.name + "." + dataset, index, value)
-        variable[index] = value
-        delay(50 * ms)
+    def _write_shutter(self, shutter):
+        if self.en_shutters[shutter]:
+            self.shutters[shutter].on()
+        else:
+            self.shutters[shutter].off()
+        delay(10 * us)
+
+    @kernel
+    def _write_channel(self, ch, fields=CHANNEL_ALL):
+        """Write the parts of the stored state of a channel given by `fields`,
+        a combination of the CHANNEL_* flags, to the SUServo"""
+        if fields & CHANNEL_GAIN:
+            # set gain on Sampler channel to 10^gain - these are wiped in the init
+            self.suservo.set_pgia_mu(ch, self.gains[ch])
+
+        if fields & CHANNEL_DDS:
+            # Set profile parameters
+            self.channels[ch].set_dds(
+                profile=ch,
+                frequency=self.freqs[ch] * MHz,
+                offset=self.offset_to_mu(self.offsets[ch], ch),
+            )
+            delay(200 * us)
+
+        if fields & CHANNEL_IIR:
+            # PI loop params
+            self.channels[ch].set_iir(
+                profile=ch,
+                adc=self.adcs[ch],
+                kp=self.Ps[ch],
+                ki=self.Is[ch],
+                g=self.Gls[ch],
+            )
+            delay(20 * us)
+
+        if fields & CHANNEL_STATE:
+            self.channels[ch].set(
+                en_out=self.en_outs[ch], en_iir=self.en_iirs[ch], profile=ch
+            )
+            delay(10 * us)
+
+        if fields & CHANNEL_Y:
+            # After the state, in case that has just stopped the IIR
+            self.channels[ch].set_y(profile=ch, y=self.ys[ch])
+            delay(10 * us)
 
     @kernel
     def enable_servo(self):
@@ -131,40 +296,19 @@ class SUServoManager:  # {{{
         self.core.break_realtime()
         self.suservo.set_config(enable=0)
 
-    @kernel
     def enable(self, ch: np.int32):
         """Enable a given channel"""
-        self._mutate_and_set_int("en_outs", self.en_outs, ch, 1)
-        self.core.break_realtime()
-        self.channels[ch].set(1, self.en_iirs[ch], ch)
+        self._queue(ch, en_outs=1)
 
-    @kernel
     def disable(self, ch: np.int32):
         """Disable a given channel"""
-        self._mutate_and_set_int("en_outs", self.en_outs, ch, 0)
-        self.core.break_realtime()
-        self.channels[ch].set(0, self.en_iirs[ch], ch)
+        self._queue(ch, en_outs=0)
 
-    @kernel
     def set_gain(self, ch, gain):
-        self._mutate_and_set_float("gains", self.gains, ch, gain)
-        self.core.break_realtime()
-        self.suservo.set_pgia_mu(ch, gain)
+        self._queue(ch, gains=gain)
 
-    @kernel
     def set_att(self, ch, att):
-        self._mutate_and_set_float("atts", self.atts, ch, att)
-
-        # We have to write all 4 channels at once -
-        # so convert each to mu and accumulate into reg
-        reg = 0
-        for i in range(4):
-            reg += self.suservo.cplds[0].att_to_mu(
-                self.atts[i if ch < 4 else 4 + i]
-            ) << (i * 8)
-
-        self.core.break_realtime()
-        self.suservo.cplds[ch // 4].set_all_att_mu(reg)
+        self._queue(ch, atts=att)
 
     @kernel
     def offset_to_mu(self, setpoint, ch=0):
@@ -173,7 +317,6 @@ class SUServoManager:  # {{{
         """
         return -setpoint * (10.0 ** (self.gains[ch] - 1))
 
-    @kernel
     def set_dds(self, ch: np.int32, freq, offset):
         """
         Frequency is in MHz
@@ -181,76 +324,40 @@ class SUServoManager:  # {{{
         """
         if freq < 0.0 or freq > 400.0:
             raise ValueError("Frequency out of range")
-        self._mutate_and_set_float("freqs", self.freqs, ch, freq)
-        self._mutate_and_set_float("offsets", self.offsets, ch, offset)
-
-        self.core.break_realtime()
+        self._queue(ch, freqs=freq, offsets=offset)
 
-        self.channels[ch].set_dds(
-            profile=ch,
-            frequency=freq * MHz,
-            offset=self.offset_to_mu(offset, ch),
-        )
-
-    @kernel
     def set_freq(self, ch: np.int32, freq):
         """
-        Frequency is in Hz
+        Frequency is in MHz
         """
         self.set_dds(ch, freq, self.offsets[ch])
 
-    @kernel
     def set_offset(self, ch: np.int32, offset):
         """
         Offset is in V
         """
         self.set_dds(ch, self.freqs[ch], offset)
 
-    @kernel
     def set_y(self, ch: np.int32, y):
-        self._mutate_and_set_float("ys", self.ys, ch, y)
+        self._queue(ch, ys=y)
 
-        self.core.break_realtime()
-        self.channels[ch].set_y(profile=ch, y=y)
-
-    @kernel
     def set_iir(self, ch: np.int32, adc, P, I, Gl):  # noqa: E741
-        self._mutate_and_set_float("Ps", self.Ps, ch, P)
-        self._mutate_and_set_float("Is", self.Is, ch, I)
-        self._mutate_and_set_float("Gls", self.Gls, ch, Gl)
-
-        self.core.break_realtime()
-        self.channels[ch].set_iir(profile=ch, adc=adc, kp=P, ki=I, g=Gl)
+        self.adcs[ch] = adc
+        self._queue(ch, Ps=P, Is=I, Gls=Gl)
 
-    @kernel
     def enable_iir(self, ch: np.int32):
-        self._mutate_and_set_int("en_iirs", self.en_iirs, ch, 1)
+        self._queue(ch, en_iirs=1)
 
-        self.core.break_realtime()
-        self.channels[ch].set(self.en_outs[ch], 1, ch)
-
-    @kernel
     def disable_iir(self, ch: np.int32):
-        self._mutate_and_set_int("en_iirs", self.en_iirs, ch, 0)
+        self._queue(ch, en_iirs=0)
 
-        self.core.break_realtime()
-        self.channels[ch].set(self.en_outs[ch], 0, ch)
-        delay(10 * us)
-        self.set_y(ch, self.ys[ch])
-
-    @kernel
     def open_shutter(self, ch):
         """Enable a given shutter"""
-        self._mutate_and_set_int("en_shutters", self.en_shutters, ch, 1)
-        self.core.break_realtime()
-        self.shutters[ch].on()
+        self._queue(ch, en_shutters=1)
 
-    @kernel
     def close_shutter(self, ch):
         """Disable a given shutter"""
-        self._mutate_and_set_int("en_shutters", self.en_shutters, ch, 0)
-        self.core.break_realtime()
-        self.shutters[ch].off()
+        self._queue(ch, en_shutters=0)
 
     @kernel
     def set_all(self):
@@ -269,10 +376,7 @@ class SUServoManager:  # {{{
 
         # shutters
         for shutter in range(len(self.shutters)):
-            if self.en_shutters[shutter]:
-                self.open_shutter(shutter)
-            else:
-                self.close_shutter(shutter)
+            self._write_shutter(shutter)
 
         delay(10 * ms)
         self.experiment.set_dataset(
@@ -280,33 +384,17 @@ class SUServoManager:  # {{{
         )
         self.core.break_realtime()
 
+        # Everything but the channel states, so the outputs stay off until the
+        # attenuators are set
         for ch in range(8):
             self.core.break_realtime()
-            # set gain on Sampler channel  to 10^gain - these are wiped in the init
-            self.suservo.set_pgia_mu(ch, self.gains[ch])
-
-            # Set profile parameters
-            self.set_dds(ch, self.freqs[ch], self.offsets[ch])
+            self._write_channel(ch, CHANNEL_ALL & ~CHANNEL_STATE)
 
-            delay(200 * us)
-            # PI loop params
-            self.channels[ch].set_iir(
-                profile=ch,
-                adc=ch,
-                kp=self.Ps[ch],
-                ki=self.Is[ch],
-                g=self.Gls[ch],
-            )
-            delay(20 * us)
-            self.channels[ch].set_y(profile=ch, y=self.ys[ch])
+        # set attenuation on all 4 channels of each Urukul in one write
+        for cache in self.att_caches:
+            cache.write()
 
         for ch in range(8):
-            # set attenuation on all 4 channels -
-            # we set all from the dataset then overwrite the one we want
-            self.suservo.cplds[ch // 4].set_att(ch % 4, self.atts[ch])
-            self.channels[ch].set(
-                en_out=self.en_outs[ch], en_iir=self.en_iirs[ch], profile=ch
-            )
-            delay(5 * 1.2 * us)
+            self._write_channel(ch, CHANNEL_STATE)
 
         self.suservo.set_config(enable=self.enabled)
@@ -1,25 +1,100 @@
 import asyncio
+import collections
 import aiomqtt
 from PyQt5.QtCore import QThread, pyqtSignal, QObject
 import logging
 
 
+BOOSTER_TOPIC = "dt/sinara/booster/fc-0f-e7-23-77-30"
+
+
 class TelemetryWorker(QObject):
+    """Holds a single MQTT session with the Booster for telemetry and settings
+
+    Settings are queued with :meth:`publish_many` from any thread and sent
+    over the same session as the telemetry subscription. Each batch is sent
+    together, with QoS 1, and the outcome of every message is reported with
+    the `published` signal. If the connection drops, it is re-established and
+    anything still queued is sent then.
+    """
+
     telemetry_received = pyqtSignal(int, str)
+    # topic, whether the broker acknowledged it, and the error if not
+    published = pyqtSignal(str, bool, str)
 
-    def __init__(self, server="137.222.69.28"):
+    def __init__(self, server="137.222.69.28", retry=5.0):
         super().__init__()
         self.server = server
+        self.retry = retry
+
+        # Batches of (topic, payload) waiting to be sent. deque appends and
+        # pops are thread-safe, so the Qt thread can add to it directly
+        self.pending = collections.deque()
+        self.loop = None
+        self.wakeup = None
 
     async def listen(self):
+        # Set up the wakeup before publishing the loop for publish_many to use
+        self.wakeup = asyncio.Event()
+        self.wakeup.set()
+        self.loop = asyncio.get_running_loop()
+
+        while True:
+            try:
+                async with aiomqtt.Client(self.server) as client:
+                    tasks = [
+                        asyncio.create_task(self._receive(client)),
+                        asyncio.create_task(self._publish_pending(client)),
+                    ]
+                    try:
+                        done, _ = await asyncio.wait(
+                            tasks, return_when=asyncio.FIRST_EXCEPTION
+                        )
+                        for task in done:
+                            task.result()
+                    finally:
+                        for task in tasks:
+                            task.cancel()
+            except aiomqtt.exceptions.MqttError as e:
+                logging.error(
+                    f"Booster: Connection lost ({e}), retrying in {self.retry} s"
+                )
+            await asyncio.sleep(self.retry)
+
+    async def _receive(self, client):
         # we want to listen to updates of channel[0-7]/[state,input power, output power]
-        async with aiomqtt.Client(self.server) as client:
-            await client.subscribe(
-                "dt/sinara/booster/fc-0f-e7-23-77-30/telemetry/#"
-            )
-            client._on_message = self.handle_message
-            async for message in client.messages:
-                self.handle_message(message)
+        await client.subscribe(f"{BOOSTER_TOPIC}/telemetry/#")
+        async for message in client.messages:
+            self.handle_message(message)
+
+    async def _publish_pending(self, client):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.pending:
+                batch = self.pending[0]
+                results = await asyncio.gather(
+                    *(
+                        client.publish(topic, payload, qos=1)
+                        for topic, payload in batch
+                    ),
+                    return_exceptions=True,
+                )
+                # A broken connection leaves the batch queued, to be sent
+                # again once we have reconnected
+                errors = [
+                    r for r in results if isinstance(r, aiomqtt.exceptions.MqttError)
+                ]
+                if errors:
+                    raise errors[0]
+
+                self.pending.popleft()
+                for (topic, _), result in zip(batch, results):
+                    if isinstance(result, Exception):
+                        logging.error(f"Booster: Publishing {topic} failed: {result}")
+                        self.published.emit(topic, False, str(result))
+                    else:
+                        self.published.emit(topic, True, "")
 
     def handle_message(self, message: aiomqtt.Message):
         """Handle a message from the MQTT broker
@@ -29,57 +104,57 @@ class TelemetryWorker(QObject):
         data = message.payload.decode()
         self.telemetry_received.emit(ch, data)
 
-    async def set_telem_period(self, period=1):
-        try:
-            async with aiomqtt.Client(self.server) as client:
-                await client.publish(
-                    "dt/sinara/booster/fc-0f-e7-23-77-30/settings/telemetry_period",
-                    str(period),
-                )
-        except aiomqtt.exceptions.MqttError as e:
-            logging.error(f"Booster: Setting telemetry period failed: {e}")
+    def publish_many(self, messages):
+        """Queue a batch of (setting, payload) messages to be sent together
+
+        Settings are topics relative to the Booster's settings, e.g.
+        "channel/0/state". This returns immediately and can be called from any
+        thread.
+        """
+        self.pending.append(
+            [
+                (f"{BOOSTER_TOPIC}/settings/{setting}", payload)
+                for setting, payload in messages
+            ]
+        )
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def set_telem_period(self, period=1):
+        self.publish_many([("telemetry_period", str(period))])
 
-    async def set_fan_speed(self, speed=0.2):
+    def set_fan_speed(self, speed=0.2):
         if speed < 0 or speed > 1:
             logging.error("Fan speed must be between 0 and 1")
-        try:
-            async with aiomqtt.Client(self.server) as client:
-                await client.publish(
-                    "dt/sinara/booster/fc-0f-e7-23-77-30/settings/fan_speed",
-                    str(speed),
-                )
-        except aiomqtt.exceptions.MqttError as e:
-            logging.error(f"Booster: Setting fan speed failed: {e}")
+            return
+        self.publish_many([("fan_speed", str(speed))])
 
-    async def set_interlock(self, ch, db=35.0):
+    def set_interlock(self, ch, db=35.0):
         """Set the interlock state of a channel ch to db"""
-        try:
-            async with aiomqtt.Client(self.server) as client:
-                await client.publish(
-                    f"dt/sinara/booster/fc-0f-e7-23-77-30/settings/channel\
-                        /{ch}/output_interlock_threshold",
-                    str(db),
-                )
-        except aiomqtt.exceptions.MqttError as e:
-            logging.error(f"Booster: Setting interlock failed: {e}")
+        self.publish_many([(f"channel/{ch}/output_interlock_threshold", str(db))])
+
+    def set_states(self, states):
+        """Set the states of several channels at once from a dict of
+        {ch: state}, each state in ['Off','Powered','Enabled']"""
+        self.publish_many(
+            [(f"channel/{ch}/state", f'"{state}"') for ch, state in states.items()]
+        )
 
-    async def set_state(self, ch, state="Enabled"):
+    def set_state(self, ch, state="Enabled"):
         """Set the state of a channel ch to state ['Off','Powered','Enabled']"""
-        try:
-            async with aiomqtt.Client(self.server) as client:
-                await client.publish(
-                    f"dt/sinara/booster/fc-0f-e7-23-77-30/settings/channel/{ch}/state",
-                    f"\"{state}\"",
-                )
-        except aiomqtt.exceptions.MqttError as e:
-            logging.error(f"Booster: Setting state failed: {e}")
+        self.set_states({ch: state})
 
     def run(self):
         asyncio.run(self.listen())
 
 
 class BoosterTelemetry(QThread):
-    """Register a callback to be called when telemetry is received by the worker"""
+    """Register a callback to be called when telemetry is received by the worker
+
+    The setters only queue their messages for the worker's MQTT session, so
+    they don't block the calling thread. Connect to `worker.published` to hear
+    whether they were acknowledged.
+    """
 
     def __init__(self, callback, server="137.222.69.28"):
         super().__init__()
@@ -96,19 +171,27 @@ class BoosterTelemetry(QThread):
             self.failed = True
 
     def set_telem_period(self, period=1):
-        asyncio.run(self.worker.set_telem_period(period))
+        self.worker.set_telem_period(period)
+
+    def set_fan_speed(self, speed=0.2):
+        self.worker.set_fan_speed(speed)
 
     def set_interlock(self, ch, db=35.0):
-        asyncio.run(self.worker.set_interlock(ch, db))
+        self.worker.set_interlock(ch, db)
 
     def enable_channel(self, ch):
-        print(f"Enabling channel {ch}")
-        # asyncio.run(self.worker.set_state(ch, "Powered"))
-        # asyncio.sleep(0.5)
-        asyncio.run(self.worker.set_state(ch, "Enabled"))
+        self.worker.set_state(ch, "Enabled")
 
     def disable_channel(self, ch):
-        asyncio.run(self.worker.set_state(ch, "Off"))
+        self.worker.set_state(ch, "Off")
+
+    def enable_channels(self, chs=range(8)):
+        """Enable several channels in one batch"""
+        self.worker.set_states({ch: "Enabled" for ch in chs})
+
+    def disable_channels(self, chs=range(8)):
+        """Disable several channels in one batch"""
+        self.worker.set_states({ch: "Off" for ch in chs})
 
 
 if __name__ == "__main__":
@@ -117,12 +200,11 @@ if __name__ == "__main__":
 
     app = QApplication(sys.argv)
     telemetry = BoosterTelemetry(lambda ch, data: print(ch, data))
+    telemetry.worker.published.connect(
+        lambda topic, ok, error: print(topic, "OK" if ok else error)
+    )
 
     telemetry.set_telem_period(1)
-
-    for i in range(8):
-        telemetry.enable_channel(i)
-
-    telemetry.start()
+    telemetry.enable_channels(range(8))
 
     sys.exit(app.exec_())
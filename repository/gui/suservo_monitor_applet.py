@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Applet plotting every channel published by
+:class:`~repository.fragments.display_suservo_monitor.AllSUServosReadingFrag`
+"""
+
+import PyQt5  # noqa: F401 # make sure pyqtgraph imports Qt5
+import numpy as np
+import pyqtgraph as pg
+from PyQt5 import QtWidgets
+
+from artiq.applets.simple import SimpleApplet
+
+
+class SUServoMonitorView(QtWidgets.QWidget):
+    def __init__(self, args, req):
+        QtWidgets.QWidget.__init__(self)
+        self.args = args
+
+        layout = QtWidgets.QVBoxLayout()
+        self.setLayout(layout)
+
+        self.adc_plot = pg.PlotWidget()
+        self.adc_plot.setLabel("left", "Photodiode", units="V")
+        self.adc_plot.addLegend()
+        layout.addWidget(self.adc_plot)
+
+        self.y_plot = pg.PlotWidget()
+        self.y_plot.setLabel("left", "Control signal (y)")
+        self.y_plot.setLabel("bottom", "Time", units="s")
+        self.y_plot.setXLink(self.adc_plot)
+        layout.addWidget(self.y_plot)
+
+        self.adc_curves = []
+        self.y_curves = []
+        self.names = None
+
+    def _make_curves(self, names):
+        self.adc_plot.clear()
+        self.y_plot.clear()
+
+        self.adc_curves = []
+        self.y_curves = []
+        for i, name in enumerate(names):
+            pen = pg.mkPen(pg.intColor(i, hues=len(names)), width=1.5)
+            self.adc_curves.append(self.adc_plot.plot(pen=pen, name=name))
+            self.y_curves.append(self.y_plot.plot(pen=pen))
+
+        self.names = list(names)
+
+    def data_changed(self, value, metadata, persist, mods):
+        try:
+            readings = np.asarray(value[self.args.readings])
+            times = np.asarray(value[self.args.time])
+            names = value[self.args.names]
+        except KeyError:
+            return
+
+        if readings.ndim != 2 or len(times) != len(readings):
+            return
+
+        if self.names != list(names):
+            self._make_curves(names)
+
+        num_channels = len(self.names)
+        for i in range(num_channels):
+            self.adc_curves[i].setData(times, readings[:, i])
+            self.y_curves[i].setData(times, readings[:, num_channels + i])
+
+
+def main():
+    applet = SimpleApplet(SUServoMonitorView)
+    # Default to the datasets published by AllSUServosReadingFrag
+    for name, default, help in [
+        ("readings", "SUServoMonitor.readings", "Readings, one row per sample"),
+        ("time", "SUServoMonitor.time", "Sample times"),
+        ("names", "SUServoMonitor.names", "Channel names"),
+    ]:
+        applet._arggroup_datasets.add_argument(f"--{name}", default=default, help=help)
+        applet.dataset_args.add(name)
+    applet.run()
+
+
+if __name__ == "__main__":
+    main()
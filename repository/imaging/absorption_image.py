@@ -42,6 +42,7 @@ class AbsorptionImageExpFrag(ExpFragment):
             "mot_beam_setter",
             ControlBeamsWithoutCoolingAOM,
             beam_infos=[SUServoedBeam["MOT"]],
+            use_dma=True,
         )
         self.mot_beam_setter: ControlBeamsWithoutCoolingAOM
 
@@ -49,6 +50,7 @@ class AbsorptionImageExpFrag(ExpFragment):
             "img_beam_setter",
             ControlBeamsWithoutCoolingAOM,
             beam_infos=[SUServoedBeam["IMG"]],
+            use_dma=True,
         )
         self.img_beam_setter: ControlBeamsWithoutCoolingAOM
 
@@ -75,6 +77,11 @@ class AbsorptionImageExpFrag(ExpFragment):
     def run_once(self):
         self.core.reset()
 
+        # All DMA sequences were recorded in device_setup, so fetch their handles
+        self.mot_beam_setter.precalculate_dma_handles()
+        self.img_beam_setter.precalculate_dma_handles()
+        self.core.break_realtime()
+
         self.coil_setter.turn_off()  # make sure we unload MOT
         delay(100 * ms)
 
@@ -40,6 +40,7 @@ class FluorescenceImageExpFrag(ExpFragment):
             "mot_beam_setter",
             ControlBeamsWithoutCoolingAOM,
             beam_infos=[SUServoedBeam["MOT"]],
+            use_dma=True,
         )
         self.mot_beam_setter: ControlBeamsWithoutCoolingAOM
 
@@ -47,6 +48,7 @@ class FluorescenceImageExpFrag(ExpFragment):
             "img_beam_setter",
             ControlBeamsWithoutCoolingAOM,
             beam_infos=[SUServoedBeam["IMG"]],
+            use_dma=True,
         )
         self.img_beam_setter: ControlBeamsWithoutCoolingAOM
 
@@ -64,6 +66,10 @@ class FluorescenceImageExpFrag(ExpFragment):
     @kernel
     def run_once(self):
         self.core.reset()
+
+        # All DMA sequences were recorded in device_setup, so fetch their handles
+        self.mot_beam_setter.precalculate_dma_handles()
+        self.img_beam_setter.precalculate_dma_handles()
         self.core.break_realtime()
         self.coil_setter.turn_off()  # make sure we unload MOT
         delay(100 * ms)
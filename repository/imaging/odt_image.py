@@ -9,6 +9,7 @@ from ndscan.experiment.parameters import FloatParamHandle
 from repository.imaging.PCO_Camera import PcoCamera
 from repository.fragments.current_supply_setter import SetAnalogCurrentSupplies
 from repository.fragments.beam_setter import ControlBeamsWithoutCoolingAOM
+from repository.utils.shutter_planner import ShutterPlanner
 from repository.models.devices import SUServoedBeam, VDrivenSupply
 
 
@@ -42,6 +43,8 @@ class ODTAbsorptionImageExpFrag(ExpFragment):
             "mot_beam_setter",
             ControlBeamsWithoutCoolingAOM,
             beam_infos=[SUServoedBeam["MOT"]],
+            use_dma=True,
+            plan_shutters=True,
         )
         self.mot_beam_setter: ControlBeamsWithoutCoolingAOM
 
@@ -49,6 +52,8 @@ class ODTAbsorptionImageExpFrag(ExpFragment):
             "img_beam_setter",
             ControlBeamsWithoutCoolingAOM,
             beam_infos=[SUServoedBeam["IMG"]],
+            use_dma=True,
+            plan_shutters=True,
         )
         self.img_beam_setter: ControlBeamsWithoutCoolingAOM
 
@@ -56,9 +61,15 @@ class ODTAbsorptionImageExpFrag(ExpFragment):
             "odt_beam_setter",
             ControlBeamsWithoutCoolingAOM,
             beam_infos=[SUServoedBeam["CDT2"]],
+            use_dma=True,
+            plan_shutters=True,
         )
         self.odt_beam_setter: ControlBeamsWithoutCoolingAOM
 
+        # The three beam setters act close together, so their shutter moves are
+        # collected and written in one pass after each group of changes
+        self.shutter_planner: ShutterPlanner = self.mot_beam_setter.shutter_planner
+
         self.setattr_param(
             "load_time",
             FloatParam,
@@ -83,6 +94,12 @@ class ODTAbsorptionImageExpFrag(ExpFragment):
     def run_once(self):
         self.core.reset()
 
+        # All DMA sequences were recorded in device_setup, so fetch their handles
+        self.mot_beam_setter.precalculate_dma_handles()
+        self.img_beam_setter.precalculate_dma_handles()
+        self.odt_beam_setter.precalculate_dma_handles()
+        self.core.break_realtime()
+
         self.coil_setter.turn_off()  # make sure we unload MOT
         delay(100 * ms)
 
@@ -91,10 +108,12 @@ class ODTAbsorptionImageExpFrag(ExpFragment):
         self.img_beam_setter.turn_beams_off()
         self.odt_beam_setter.turn_beams_off()
         self.coil_setter.set_defaults()
+        self.shutter_planner.emit()
         delay(self.load_time.get())
 
         # turn on the ODT
         self.odt_beam_setter.turn_beams_on()
+        self.shutter_planner.emit()
         delay(100 * ms)  # allow it to settle
 
         # release MOT and propagate cloud -
@@ -104,6 +123,7 @@ class ODTAbsorptionImageExpFrag(ExpFragment):
             self.mot_beam_setter.turn_beams_off(ignore_shutters=True)
         delay(self.hold_time_in_ODT.get())
         self.odt_beam_setter.turn_beams_off()
+        self.shutter_planner.emit()
 
         # image atoms trapped in ODT
         with parallel:
@@ -111,6 +131,7 @@ class ODTAbsorptionImageExpFrag(ExpFragment):
             self.pco_camera.capture_image()
         delay(self.exposure_time.get())
         self.img_beam_setter.turn_beams_off()
+        self.shutter_planner.emit()
         delay(self.pco_camera.BUSY_TIME)
 
         # reference image
@@ -119,6 +140,7 @@ class ODTAbsorptionImageExpFrag(ExpFragment):
             self.pco_camera.capture_image()
         delay(self.exposure_time.get())
         self.img_beam_setter.turn_beams_off()
+        self.shutter_planner.emit()
         delay(self.pco_camera.BUSY_TIME)
 
         # background image
@@ -131,6 +153,8 @@ class ODTAbsorptionImageExpFrag(ExpFragment):
         self.mot_beam_setter.turn_beams_on()
         self.img_beam_setter.turn_beams_off()
 
+        self.shutter_planner.emit()
+
         self.core.wait_until_mu(now_mu())
         self.update_images()
 
@@ -24,6 +24,10 @@ class DummySUServoFrag:
     ):
         pass
 
+    @kernel
+    def set_attenuation(self, attenuation: TFloat, needs_reset: TBool = False):
+        pass
+
     @kernel
     def set_channel_state(self, en_out=True, enable_iir=True):
         pass
@@ -2,7 +2,7 @@ import logging
 from typing import List
 
 from artiq.experiment import EnvExperiment, BooleanValue
-from submodules.topticadlcpro.toptica_wrapper.driver import TopticaDLCPro
+from controllers.driver_topticadlc import TopticaDLCPro
 from repository.utils.get_local_devices import get_local_devices
 
 
@@ -0,0 +1,75 @@
+"""
+Kernel-side shadows of Fastino state shared between Fragments
+
+The hold and continuous-update settings of a Fastino are single card-wide
+masks, written as a whole and with no readback. Several Fragments (e.g. one
+:class:`~repository.fragments.current_supply_setter.SetAnalogCurrentSupplies`
+per group of coils) can use different channels of the same Fastino, so each of
+them must only change its own bits. They therefore share a shadow of the masks,
+keyed weakly on the device object as in
+:mod:`~repository.utils.suservo_registry`.
+"""
+
+import weakref
+
+from artiq.coredevice.fastino import Fastino
+from artiq.experiment import TBool, TInt32, kernel
+from numpy import int32
+
+# The masks of each Fastino in use in this experiment
+_fastino_masks: "weakref.WeakKeyDictionary[Fastino, FastinoChannelMasks]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+class FastinoChannelMasks:
+    """
+    Shadows of a Fastino's hold and continuous-update masks
+
+    Both start with no channels set. Don't construct this directly - use
+    :func:`get_fastino_masks` so that all users of a Fastino share them.
+    """
+
+    def __init__(self, fastino: Fastino):
+        self.fastino = fastino
+
+        self.hold_mask = int32(0)
+        self.continuous_mask = int32(0)
+
+        self.kernel_invariants = {"fastino"}
+
+    @kernel
+    def set_hold(self, channel_mask: TInt32, hold: TBool):
+        """
+        Hold (or release) the channels in `channel_mask`, leaving the others
+        as they were
+
+        See :meth:`artiq.coredevice.fastino.Fastino.set_hold`.
+        """
+        if hold:
+            self.hold_mask |= channel_mask
+        else:
+            self.hold_mask &= ~channel_mask
+        self.fastino.set_hold(self.hold_mask)
+
+    @kernel
+    def set_continuous(self, channel_mask: TInt32, continuous: TBool):
+        """
+        Enable (or disable) continuous updates of the channels in
+        `channel_mask`, leaving the others as they were
+
+        See :meth:`artiq.coredevice.fastino.Fastino.set_continuous`.
+        """
+        if continuous:
+            self.continuous_mask |= channel_mask
+        else:
+            self.continuous_mask &= ~channel_mask
+        self.fastino.set_continuous(self.continuous_mask)
+
+
+def get_fastino_masks(fastino: Fastino) -> FastinoChannelMasks:
+    """Get the shared mask shadows for a Fastino, creating them if required"""
+    if fastino not in _fastino_masks:
+        _fastino_masks[fastino] = FastinoChannelMasks(fastino)
+
+    return _fastino_masks[fastino]
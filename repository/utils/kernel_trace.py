@@ -0,0 +1,181 @@
+"""
+Low-overhead debug tracing for kernel code
+
+Logging from a kernel costs an RPC per message and eats into the slack, so the
+act of debugging a sequence changes its timing. Instead, Fragments can record
+structured events into a :class:`KernelTrace`: a preallocated buffer on the core
+device which is shipped back to the host in a single async RPC when flushed.
+
+Each event is a message registered on the host (so that strings never have to be
+built on the core device) along with the timeline cursor, the slack at the time
+of recording and up to two float arguments.
+
+Usage in a Fragment::
+
+    logger = logging.getLogger(__name__)
+
+    class MyFrag(Fragment):
+        def build_fragment(self):
+            self.setattr_device("core")
+
+            self.debug_enabled = logger.isEnabledFor(logging.INFO)
+            self.trace = get_kernel_trace(self.core)
+            self.trace_set_x = self.trace.register(logger, "Setting x=%s, y=%s")
+
+            kernel_invariants = getattr(self, "kernel_invariants", set())
+            self.kernel_invariants = kernel_invariants | {
+                "debug_enabled",
+                "trace",
+                "trace_set_x",
+            }
+
+        @kernel
+        def set_x(self, x, y):
+            if self.debug_enabled:
+                self.trace.record(self.trace_set_x, x, y)
+            ...
+
+Since `debug_enabled` is a kernel invariant, the compiler removes the whole block
+when it is False, so tracing costs nothing unless it is enabled. The buffer is
+flushed automatically when full and by :meth:`KernelTrace.flush`, which can also
+be called on the host to log anything left over when the kernel returns.
+"""
+
+import logging
+import re
+import weakref
+from typing import List
+
+from artiq.coredevice.core import Core
+from artiq.experiment import (
+    TFloat,
+    TInt32,
+    TInt64,
+    TList,
+    host_only,
+    kernel,
+    now_mu,
+    portable,
+    rpc,
+)
+from numpy import int32, int64
+
+# Matches a %-style placeholder, once "%%" escapes have been removed
+_PLACEHOLDER = re.compile(r"%[-#0 +]*\d*(?:\.\d+)?[a-zA-Z]")
+
+# The trace shared by all Fragments using each core device in this experiment
+_traces: "weakref.WeakKeyDictionary[Core, KernelTrace]" = weakref.WeakKeyDictionary()
+
+
+class KernelTrace:
+    """
+    A preallocated kernel-side buffer of debug events
+
+    Don't construct this directly - use :func:`get_kernel_trace` so that all
+    Fragments in an experiment share a single buffer, and therefore a single
+    RPC per flush.
+    """
+
+    def __init__(self, core: Core, capacity: int = 256):
+        self.core = core
+        self.capacity = capacity
+
+        # Registered events: the logger to emit each one to, its message and
+        # the number of arguments the message takes
+        self.loggers: List[logging.Logger] = []
+        self.messages: List[str] = []
+        self.num_args: List[int] = []
+
+        # The buffer
+        self.num_events = 0
+        self.event_ids = [int32(0)] * capacity
+        self.timestamps_mu = [int64(0)] * capacity
+        self.slacks_mu = [int64(0)] * capacity
+        self.args_a = [0.0] * capacity
+        self.args_b = [0.0] * capacity
+
+        self.kernel_invariants = {"core", "capacity"}
+
+    @host_only
+    def register(self, logger: logging.Logger, message: str) -> int:
+        """
+        Register an event type and return its id for :meth:`record`
+
+        `message` is a %-style format string with up to two placeholders,
+        which are filled with the float arguments passed to :meth:`record`.
+        """
+        num_args = len(_PLACEHOLDER.findall(message.replace("%%", "")))
+        if num_args > 2:
+            raise ValueError(f"Trace messages take at most 2 arguments: {message}")
+
+        self.loggers.append(logger)
+        self.messages.append(message)
+        self.num_args.append(num_args)
+        return len(self.messages) - 1
+
+    @kernel
+    def record(self, event_id: TInt32, a: TFloat = 0.0, b: TFloat = 0.0):
+        """
+        Record an event at the timeline cursor
+
+        This does not move the timeline cursor and makes no RPCs unless the
+        buffer is full, in which case it is flushed first.
+        """
+        if self.num_events >= self.capacity:
+            self.flush()
+
+        i = self.num_events
+        self.event_ids[i] = event_id
+        self.timestamps_mu[i] = now_mu()
+        self.slacks_mu[i] = now_mu() - self.core.get_rtio_counter_mu()
+        self.args_a[i] = a
+        self.args_b[i] = b
+        self.num_events = i + 1
+
+    @portable
+    def flush(self):
+        """
+        Ship all recorded events to the host with a single async RPC
+
+        This can also be called on the host, e.g. from ``host_cleanup``, to log
+        any events that were left in the buffer when the kernel returned.
+        """
+        if self.num_events > 0:
+            self._emit(
+                self.num_events,
+                self.event_ids,
+                self.timestamps_mu,
+                self.slacks_mu,
+                self.args_a,
+                self.args_b,
+            )
+            self.num_events = 0
+
+    @rpc(flags={"async"})
+    def _emit(
+        self,
+        num_events: TInt32,
+        event_ids: TList(TInt32),
+        timestamps_mu: TList(TInt64),
+        slacks_mu: TList(TInt64),
+        args_a: TList(TFloat),
+        args_b: TList(TFloat),
+    ):
+        for i in range(num_events):
+            event_id = event_ids[i]
+            args = (args_a[i], args_b[i])[: self.num_args[event_id]]
+
+            self.loggers[event_id].info(
+                "[t=%d mu, slack=%.1f us] " + self.messages[event_id],
+                timestamps_mu[i],
+                1e6 * self.core.mu_to_seconds(slacks_mu[i]),
+                *args,
+            )
+
+
+def get_kernel_trace(core: Core) -> KernelTrace:
+    """Get the trace shared by all users of `core` in this experiment"""
+    if core not in _traces:
+        _traces[core] = KernelTrace(core)
+
+    return _traces[core]
@@ -0,0 +1,36 @@
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Fixed-length history of the latest rows of readings, for monitors which
+    publish a rolling window to a dataset
+
+    Rows are added in blocks with :meth:`extend` and read back, oldest first,
+    with :meth:`ordered`. Pass `width` to store rows of several values, e.g.
+    one per channel, otherwise each row is a single float.
+    """
+
+    def __init__(self, length: int, width: int = 0):
+        self.length = length
+        shape = (length, width) if width else (length,)
+        self.data = np.zeros(shape)
+        self.index = 0
+        self.count = 0
+
+    def extend(self, rows) -> None:
+        """Add a block of rows, overwriting the oldest if full"""
+        rows = np.asarray(rows)[-self.length :]
+        indices = (self.index + np.arange(len(rows))) % self.length
+        self.data[indices] = rows
+        self.index = (self.index + len(rows)) % self.length
+        self.count = min(self.count + len(rows), self.length)
+
+    def ordered(self) -> np.ndarray:
+        """Get the stored rows in the order they were added"""
+        if self.count < self.length:
+            return self.data[: self.count].copy()
+        return np.roll(self.data, -self.index, axis=0)
+
+    def __len__(self) -> int:
+        return self.count
@@ -116,5 +116,7 @@ class SetSUServoExpFrag(ExpFragment):
             self.enable_iir.get(),
         )
 
+        self.SUServoFrag.flush_trace()
+
 
 SetSUServoExp = make_fragment_scan_exp(SetSUServoExpFrag)
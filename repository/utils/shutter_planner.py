@@ -0,0 +1,239 @@
+"""
+Sequence-level planning of shutter moves
+
+Each :class:`~repository.fragments.beam_setter.ControlBeamsWithoutCoolingAOM`
+opens its shutters in the past, ahead of the AOM edge. When several of them act
+close together their past-time writes interleave, which uses up RTIO lanes and
+can cause collisions when two requests hit the same shutter at the same time.
+
+Instead, beam setters built with ``plan_shutters=True`` hand their shutter
+moves to a :class:`ShutterPlanner`: a kernel-side buffer shared by all users of
+a core device. When :meth:`ShutterPlanner.emit` is called, the requests are
+sorted by timestamp, redundant moves are dropped and the remaining moves are
+written in a single monotonic pass, so that the shutters use one lane no matter
+how many beam groups are involved.
+
+Usage in an ExpFragment::
+
+    def build_fragment(self):
+        ...
+        self.setattr_fragment(
+            "mot_beam_setter",
+            ControlBeamsWithoutCoolingAOM,
+            beam_infos=[SUServoedBeam["MOT"]],
+            plan_shutters=True,
+        )
+        self.shutter_planner = self.mot_beam_setter.shutter_planner
+
+    @kernel
+    def run_once(self):
+        ...
+        self.mot_beam_setter.turn_beams_on()
+        self.img_beam_setter.turn_beams_off()
+        # Write the shutter moves requested above
+        self.shutter_planner.emit()
+        delay(self.load_time.get())
+        ...
+
+:meth:`~ShutterPlanner.emit` must be called while the earliest requested move
+is still in the future, i.e. after each group of beam changes rather than once
+at the end of the sequence. It is also called automatically if the buffer
+fills.
+"""
+
+import logging
+import weakref
+from typing import List
+
+from artiq.coredevice.core import Core
+from artiq.coredevice.ttl import TTLOut
+from artiq.experiment import (
+    TBool,
+    TInt32,
+    TInt64,
+    at_mu,
+    host_only,
+    kernel,
+    now_mu,
+    rpc,
+)
+from numpy import int32, int64
+
+logger = logging.getLogger(__name__)
+
+# The planner shared by all Fragments using each core device in this experiment
+_planners: "weakref.WeakKeyDictionary[Core, ShutterPlanner]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+class ShutterPlanner:
+    """
+    A kernel-side buffer of requested shutter moves
+
+    Don't construct this directly - use :func:`get_shutter_planner` so that
+    all Fragments in an experiment share a single plan.
+
+    Requests for the state the shutter was last set to are dropped. Moves of
+    the same shutter less than `min_toggle_interval` apart are still written,
+    since both were asked for, but a warning is logged as the shutter can't
+    follow them.
+
+    The planner only knows about the moves it writes itself. If anything else
+    moves a planned shutter, e.g. a beam setter built without
+    ``plan_shutters=True``, its last state here goes stale, and a later planned
+    move to that state is silently dropped.
+
+    The lists of shutters start with `placeholder_shutter` as entry 0 so that
+    the ARTIQ compiler can infer their types even if no shutters are
+    registered. It is never moved unless it is also registered.
+    """
+
+    def __init__(
+        self,
+        core: Core,
+        placeholder_shutter: TTLOut,
+        capacity: int = 64,
+        min_toggle_interval=1e-3,
+    ):
+        self.core = core
+        self.capacity = capacity
+
+        self.min_toggle_mu = int64(core.seconds_to_mu(min_toggle_interval))
+        self.t_rtio_cycle_mu = int64(core.ref_multiplier)
+
+        # Registered shutters, the state each was last set to by the planner
+        # (-1 for unknown, 0 for closed and 1 for open) and when
+        self.shutters: List[TTLOut] = [placeholder_shutter]
+        self.last_states: List[int] = [-1]
+        self.last_times_mu: List[int64] = [int64(0)]
+
+        # The requests
+        self.num_events = 0
+        self.timestamps_mu = [int64(0)] * capacity
+        self.shutter_ids = [int32(0)] * capacity
+        self.states = [False] * capacity
+
+        self.kernel_invariants = {
+            "core",
+            "capacity",
+            "min_toggle_mu",
+            "t_rtio_cycle_mu",
+            "shutters",
+        }
+
+    @host_only
+    def register(self, shutter: TTLOut) -> int:
+        """Register a shutter and return its id for :meth:`request`"""
+        for i, existing in enumerate(self.shutters):
+            if existing is shutter:
+                return i
+
+        self.shutters.append(shutter)
+        self.last_states.append(-1)
+        self.last_times_mu.append(int64(0))
+        return len(self.shutters) - 1
+
+    @kernel
+    def request(self, shutter_id: TInt32, t_mu: TInt64, state: TBool):
+        """
+        Request that a shutter is opened (`state` = True) or closed at `t_mu`
+
+        This does not move the timeline cursor and writes no RTIO events
+        unless the buffer is full, in which case it is emitted first.
+        """
+        if self.num_events >= self.capacity:
+            self.emit()
+
+        i = self.num_events
+        self.timestamps_mu[i] = t_mu
+        self.shutter_ids[i] = shutter_id
+        self.states[i] = state
+        self.num_events = i + 1
+
+    @kernel
+    def emit(self):
+        """
+        Write all requested shutter moves in timestamp order
+
+        Events which would land on the same coarse RTIO cycle as the previous
+        one are pushed back by a cycle so that only one lane is used. This
+        method does not move the timeline cursor.
+        """
+        n = self.num_events
+
+        # Insertion sort by timestamp. This is stable, so requests made later
+        # are written later when they tie
+        for i in range(1, n):
+            t = self.timestamps_mu[i]
+            shutter_id = self.shutter_ids[i]
+            state = self.states[i]
+
+            j = i - 1
+            while j >= 0 and self.timestamps_mu[j] > t:
+                self.timestamps_mu[j + 1] = self.timestamps_mu[j]
+                self.shutter_ids[j + 1] = self.shutter_ids[j]
+                self.states[j + 1] = self.states[j]
+                j -= 1
+
+            self.timestamps_mu[j + 1] = t
+            self.shutter_ids[j + 1] = shutter_id
+            self.states[j + 1] = state
+
+        t_saved_mu = now_mu()
+        t_last_mu = int64(0)
+        first = True
+
+        for i in range(n):
+            shutter_id = self.shutter_ids[i]
+            state = 1 if self.states[i] else 0
+            if self.last_states[shutter_id] == state:
+                continue
+
+            t_mu = self.timestamps_mu[i]
+            if not first and t_mu < t_last_mu + self.t_rtio_cycle_mu:
+                t_mu = t_last_mu + self.t_rtio_cycle_mu
+
+            if (
+                self.last_states[shutter_id] >= 0
+                and t_mu - self.last_times_mu[shutter_id] < self.min_toggle_mu
+            ):
+                self._warn_fast_toggle(
+                    shutter_id, t_mu - self.last_times_mu[shutter_id]
+                )
+
+            at_mu(t_mu)
+            if self.states[i]:
+                self.shutters[shutter_id].on()
+            else:
+                self.shutters[shutter_id].off()
+
+            self.last_states[shutter_id] = state
+            self.last_times_mu[shutter_id] = t_mu
+            t_last_mu = t_mu
+            first = False
+
+        self.num_events = 0
+        at_mu(t_saved_mu)
+
+    @rpc(flags={"async"})
+    def _warn_fast_toggle(self, shutter_id: TInt32, interval_mu: TInt64):
+        logger.warning(
+            "Shutter on RTIO channel %d moved twice within %.3f ms, which it "
+            "can't follow",
+            self.shutters[shutter_id].channel,
+            1e3 * self.core.mu_to_seconds(interval_mu),
+        )
+
+
+def get_shutter_planner(core: Core, placeholder_shutter: TTLOut) -> ShutterPlanner:
+    """
+    Get the planner shared by all users of `core` in this experiment
+
+    `placeholder_shutter` is any TTL, used as described in
+    :class:`ShutterPlanner` by the first caller only.
+    """
+    if core not in _planners:
+        _planners[core] = ShutterPlanner(core, placeholder_shutter)
+
+    return _planners[core]
@@ -0,0 +1,138 @@
+"""
+Host-side bookkeeping for SUServo devices shared between Fragments
+
+Several Fragments (e.g. one :class:`~repository.fragments.suservo_frag.SUServoFrag`
+per beam) can drive channels of the same SUServo. Only one of them should
+call ``init()`` on the device, otherwise the later ones clobber the settings
+written by the earlier ones. Likewise, they all have to agree on the contents of
+the attenuation register of each Urukul CPLD, since it can only be written as a
+whole and cannot be read back in SUServo mode.
+
+The state here is keyed weakly on the device objects themselves. ARTIQ builds a
+fresh set of device objects for each experiment, so nothing carries over between
+runs and everything is decided once on the host during ``host_setup``.
+"""
+
+import weakref
+from typing import List
+
+from artiq.coredevice.suservo import SUServo
+from artiq.coredevice.urukul import CPLD
+from artiq.experiment import TBool, TFloat, TInt32, kernel
+from numpy import int32, int64
+
+# SUServo devices which have been claimed for initialisation in this experiment
+_claimed_suservos: "weakref.WeakSet[SUServo]" = weakref.WeakSet()
+
+# The attenuation cache for each CPLD in use in this experiment
+_attenuation_caches: "weakref.WeakKeyDictionary[CPLD, UrukulAttenuationCache]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def claim_suservo_init(suservo: SUServo) -> bool:
+    """
+    Claim responsibility for initialising the given SUServo
+
+    Returns True for the first caller in this experiment and False for every
+    subsequent one, so the caller can store the result as a kernel invariant
+    and decide whether to call ``init()`` without any RPCs.
+
+    Example usage in a Fragment's ``host_setup``::
+
+        self.needs_suservo_init = claim_suservo_init(self.suservo)
+        self.kernel_invariants.add("needs_suservo_init")
+
+    Args:
+        suservo (SUServo): The SUServo device to be initialised
+
+    Returns:
+        bool: Whether the caller should initialise the SUServo
+    """
+    if suservo in _claimed_suservos:
+        return False
+
+    _claimed_suservos.add(suservo)
+    return True
+
+
+class UrukulAttenuationCache:
+    """
+    Default attenuations and single-channel writes for an Urukul CPLD
+
+    In SUServo mode the attenuation register cannot be read back, so changing
+    one channel means writing all four. The CPLD driver already keeps a shadow
+    of the register in ``cpld.att_reg``, which ``set_all_att_mu`` updates, so
+    this object builds on that rather than keeping a copy of its own. That way
+    it can't disagree with anything which calls ``cpld.set_att*`` directly.
+
+    The shadow is seeded with default attenuations on the host, so a single
+    channel can be changed with one ``set_all_att_mu`` and no readback.
+
+    Don't construct this directly - use :func:`get_attenuation_cache` so that
+    all users of a CPLD share the same defaults.
+    """
+
+    def __init__(self, cpld: CPLD, default_atts: List[float]):
+        if len(default_atts) != 4:
+            raise ValueError("An Urukul has exactly 4 attenuators")
+
+        self.cpld = cpld
+
+        reg = 0
+        for i, att in enumerate(default_atts):
+            reg |= int(cpld.att_to_mu(att)) << (8 * i)
+
+        # The register that "reset" restores. The one we believe is currently
+        # loaded into the hardware is the CPLD's own shadow
+        self.default_att_reg = int32(int64(reg))
+        cpld.att_reg = self.default_att_reg
+
+        self.kernel_invariants = {"cpld", "default_att_reg"}
+
+    @kernel
+    def set_att_mu(self, channel: TInt32, att_mu: TInt32, reset_others: TBool = False):
+        """
+        Set a single attenuator in machine units, rewriting the other three
+        from the CPLD's shadow register
+
+        If `reset_others` is set, the other three are first restored to their
+        defaults. Either way, this costs a single SPI write to the CPLD, see
+        :meth:`artiq.coredevice.urukul.CPLD.set_all_att_mu`.
+        """
+        reg = self.default_att_reg if reset_others else self.cpld.att_reg
+
+        shift = 8 * channel
+        reg = (reg & ~(0xFF << shift)) | ((att_mu & 0xFF) << shift)
+        self.cpld.set_all_att_mu(reg)
+
+    @kernel
+    def set_att(self, channel: TInt32, att: TFloat, reset_others: TBool = False):
+        """Set a single attenuator in dB, see :meth:`set_att_mu`"""
+        self.set_att_mu(channel, self.cpld.att_to_mu(att), reset_others)
+
+    @kernel
+    def reset(self):
+        """Write the default attenuations to all four channels"""
+        self.cpld.set_all_att_mu(self.default_att_reg)
+
+    @kernel
+    def write(self):
+        """Write the shadowed attenuations to all four channels"""
+        self.cpld.set_all_att_mu(self.cpld.att_reg)
+
+
+def get_attenuation_cache(
+    cpld: CPLD, default_atts: List[float]
+) -> UrukulAttenuationCache:
+    """
+    Get the shared attenuation cache for a CPLD, creating it if required
+
+    `default_atts` (in dB, one per channel) are only used by the first caller
+    in each experiment. Later callers get the existing cache, so that they see
+    the attenuations written by the others.
+    """
+    if cpld not in _attenuation_caches:
+        _attenuation_caches[cpld] = UrukulAttenuationCache(cpld, default_atts)
+
+    return _attenuation_caches[cpld]
@@ -125,5 +125,7 @@ class TuneSUServoExpFrag(ExpFragment):
 
         self.SUServoFrag.log_channel()
 
+        self.SUServoFrag.flush_trace()
+
 
 TuneSUServo = make_fragment_scan_exp(TuneSUServoExpFrag)
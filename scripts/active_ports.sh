@@ -83,6 +83,9 @@ sudo netstat -nlp | grep ':3272'
 echo -e "${GREEN}HighFinesse out-of-tree :3273${NC}"
 sudo netstat -nlp | grep ':3273'
 
+echo -e "${GREEN}Controller manager metrics :3274${NC}"
+sudo netstat -nlp | grep ':3274'
+
 echo -e "${GREEN}InfluxDB schedule bridge :3275${NC}"
 sudo netstat -nlp | grep ':3275'
 